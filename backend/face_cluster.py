@@ -0,0 +1,159 @@
+"""
+Offline face clustering used by the people re-clustering job
+
+Online matching assigns each face to a person the moment it is stored, so the
+result depends on upload order. This module clusters a user's whole library
+at once: a thresholded k-nearest-neighbour graph is built in row blocks (spread
+over a process pool by the caller), then clustered with Chinese whispers,
+the graph clustering dlib uses for face descriptors. plan_assignments turns
+the clusters into person moves that leave user-named people untouched.
+
+Functions called in pool workers are module level so they can be pickled.
+"""
+
+import random
+from typing import Dict, List, Optional
+
+import numpy as np
+
+KNN_NEIGHBOURS = 16
+# Rows scored per distance block inside a worker, bounded so the block stays ~64 MB
+KNN_BLOCK_ELEMENTS = 16 * 1024 * 1024
+
+_shared: Dict[str, tuple] = {}
+
+
+def _descriptors(path: str) -> tuple:
+    """(descriptors, squared norms) saved by the caller, loaded once per worker process"""
+    if path not in _shared:
+        _shared.clear()
+        data = np.load(path)
+        _shared[path] = (data, (data ** 2).sum(axis=1))
+    return _shared[path]
+
+
+def knn_rows(path: str, start: int, stop: int, k: int, threshold: float) -> tuple:
+    """Neighbour edges for rows [start, stop): up to k nearest other faces closer than threshold
+    Returns (sources, targets) row arrays
+    """
+    data, norms = _descriptors(path)
+    count = len(data)
+    k = min(k, count - 1)
+    if k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    block = max(1, KNN_BLOCK_ELEMENTS // count)
+    limit = threshold * threshold
+    sources, targets = [], []
+    for lo in range(start, stop, block):
+        hi = min(lo + block, stop)
+        squared = norms[lo:hi, None] + norms[None, :] - 2 * data[lo:hi] @ data.T
+        squared[np.arange(hi - lo), np.arange(lo, hi)] = np.inf  # No self edges
+        # Faces within the threshold are few, so filter first and rank only those
+        rows, cols = np.nonzero(squared < limit)
+        order = np.lexsort((squared[rows, cols], rows))
+        rows, cols = rows[order], cols[order]
+        starts = np.searchsorted(rows, rows)
+        keep = np.arange(len(rows)) - starts < k
+        sources.append(rows[keep] + lo)
+        targets.append(cols[keep])
+    return np.concatenate(sources), np.concatenate(targets)
+
+
+def chinese_whispers(count: int, sources: np.ndarray, targets: np.ndarray,
+                     iterations: int = 20, seed: int = 0) -> np.ndarray:
+    """Cluster label per row of an undirected graph given as edge arrays
+    Every node repeatedly takes the most common label among its neighbours, visiting nodes in random order
+    """
+    # Symmetric adjacency in CSR form
+    src = np.concatenate([sources, targets])
+    dst = np.concatenate([targets, sources])
+    order = np.lexsort((dst, src))
+    src, dst = src[order], dst[order]
+    keep = np.ones(len(src), dtype=bool)
+    keep[1:] = (src[1:] != src[:-1]) | (dst[1:] != dst[:-1])
+    src, dst = src[keep], dst[keep]
+    indptr = np.zeros(count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=count), out=indptr[1:])
+    neighbours = [dst[indptr[i]:indptr[i + 1]].tolist() for i in range(count)]
+
+    labels = list(range(count))
+    nodes = [i for i in range(count) if neighbours[i]]
+    rng = random.Random(seed)
+    for _ in range(iterations):
+        rng.shuffle(nodes)
+        changed = 0
+        for node in nodes:
+            votes: Dict[int, int] = {}
+            for other in neighbours[node]:
+                label = labels[other]
+                votes[label] = votes.get(label, 0) + 1
+            best = max(votes, key=votes.get)
+            if best != labels[node]:
+                labels[node] = best
+                changed += 1
+        if changed == 0:
+            break
+
+    # Renumber clusters 0..n-1
+    _, dense = np.unique(np.asarray(labels), return_inverse=True)
+    return dense.astype(np.int64)
+
+
+def plan_assignments(clusters: np.ndarray, person_labels: np.ndarray, named: np.ndarray,
+                     min_cluster_size: int = 2) -> np.ndarray:
+    """Target person label for every face, or -1 - n for the n-th new person
+    - Faces of named people never move, and named people may own several clusters
+    - Each cluster goes to the person holding most of its faces, named people first;
+      an unnamed person owns at most one cluster, its largest (other parts are split off)
+    - Clusters smaller than min_cluster_size leave their faces where they are
+    """
+    targets = person_labels.astype(np.int64).copy()
+    cluster_sizes = np.bincount(clusters)
+
+    # (cluster, person) pairs with how many faces of that person are in the cluster
+    pairs, pair_counts = np.unique(np.stack([clusters, person_labels]), axis=1, return_counts=True)
+    candidates = sorted(
+        zip(pairs[0].tolist(), pairs[1].tolist(), pair_counts.tolist()),
+        key=lambda c: (not named[c[1]], -c[2])
+    )
+
+    owner: Dict[int, int] = {}
+    owned = set()
+    for cluster, person, _ in candidates:
+        if cluster in owner or cluster_sizes[cluster] < min_cluster_size:
+            continue
+        if named[person] or person not in owned:
+            owner[cluster] = person
+            owned.add(person)
+
+    cluster_owner = np.zeros(len(cluster_sizes), dtype=np.int64)
+    has_owner = cluster_sizes >= min_cluster_size
+    new_people = 0
+    for cluster in np.flatnonzero(has_owner).tolist():
+        if cluster in owner:
+            cluster_owner[cluster] = owner[cluster]
+        else:
+            cluster_owner[cluster] = -1 - new_people
+            new_people += 1
+
+    move = has_owner[clusters] & ~named[person_labels]
+    targets[move] = cluster_owner[clusters[move]]
+    return targets
+
+
+def cluster_descriptors(path: str, threshold: float, k: int = KNN_NEIGHBOURS,
+                        chunk: Optional[int] = None, pool=None) -> np.ndarray:
+    """Blocking end-to-end clustering of the saved matrix (benchmarks and scripts);
+    the server runs the same steps itself so it can report progress
+    """
+    count = len(_descriptors(path)[0])
+    chunk = chunk or max(1, count // 64)
+    spans = [(start, min(start + chunk, count)) for start in range(0, count, chunk)]
+    if pool is None:
+        parts: List[tuple] = [knn_rows(path, lo, hi, k, threshold) for lo, hi in spans]
+    else:
+        parts = list(pool.map(knn_rows, *zip(*[(path, lo, hi, k, threshold) for lo, hi in spans])))
+    sources = np.concatenate([p[0] for p in parts]) if parts else np.empty(0, dtype=np.int64)
+    targets = np.concatenate([p[1] for p in parts]) if parts else np.empty(0, dtype=np.int64)
+    return chinese_whispers(count, sources, targets)
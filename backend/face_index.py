@@ -0,0 +1,460 @@
+"""
+Face descriptor indexes used to group faces into people
+
+FaceMatrix is an exact brute-force index. IVFFaceIndex narrows each search to
+the faces in the nearest k-means clusters, for libraries with hundreds of
+thousands of faces. Both keep one float32 row per face with a person label and
+score people with the same tiered top-3 rule.
+"""
+
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+DESCRIPTOR_DIM = 128
+ASSIGN_CHUNK = 8192
+# Upper bound on query x face distance entries held at once by match_many
+MATCH_BLOCK_ELEMENTS = 16 * 1024 * 1024
+# Stored descriptors are little-endian float32, 512 bytes per face
+DESCRIPTOR_DTYPE = np.dtype('<f4')
+# Tries at reading a saved index while concurrent saves swap directories underneath
+LOAD_ATTEMPTS = 3
+
+
+def pack_descriptor(descriptor) -> bytes:
+    """Descriptor as packed float32 bytes for storage"""
+    return np.asarray(descriptor, dtype=DESCRIPTOR_DTYPE).tobytes()
+
+
+def unpack_descriptor(value) -> np.ndarray:
+    """Stored descriptor (packed bytes, or a legacy list of floats) as a float32 array"""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return np.frombuffer(value, dtype=DESCRIPTOR_DTYPE)
+    return np.asarray(value, dtype=np.float32)
+
+
+def stack_descriptors(values: list) -> np.ndarray:
+    """(n, 128) float32 matrix from stored descriptors
+    When every value is packed, the bytes are joined once and viewed without per-row decoding
+    """
+    if not values:
+        return np.empty((0, DESCRIPTOR_DIM), dtype=np.float32)
+    if all(isinstance(v, bytes) for v in values):
+        return np.frombuffer(b''.join(values), dtype=DESCRIPTOR_DTYPE).reshape(-1, DESCRIPTOR_DIM)
+    return np.stack([unpack_descriptor(v) for v in values])
+
+
+def _grow(array: np.ndarray, needed: int) -> np.ndarray:
+    """Return array with capacity for at least `needed` rows, doubling when full"""
+    if len(array) >= needed:
+        return array
+    capacity = max(64, needed, len(array) * 2)
+    grown = np.empty((capacity,) + array.shape[1:], dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+def score_people(distances: np.ndarray, labels: np.ndarray) -> tuple:
+    """Best person for one query as (label, distance, match_quality)
+    Per person: min distance blended with the mean of the best 2-3 faces
+    """
+    # Sort by person, then distance, so each person's closest faces come first
+    order = np.lexsort((distances, labels))
+    sorted_distances = distances[order]
+    people, starts, counts = np.unique(labels[order], return_index=True, return_counts=True)
+
+    last = len(distances) - 1
+    d1 = sorted_distances[starts]
+    d2 = np.where(counts >= 2, sorted_distances[np.minimum(starts + 1, last)], d1)
+    d3 = np.where(counts >= 3, sorted_distances[np.minimum(starts + 2, last)], d2)
+    final = np.where(
+        counts >= 3,
+        d1 * 0.6 + (d1 + d2 + d3) / 3 * 0.4,  # 3+ faces: weighted with average of best 3
+        np.where(counts == 2, d1 * 0.7 + (d1 + d2) / 2 * 0.3, d1)
+    )
+
+    best = int(np.argmin(final))
+    if counts[best] >= 3:
+        quality = "high_confidence"
+    elif counts[best] == 2:
+        quality = "medium_confidence"
+    else:
+        quality = "low_confidence"
+    return int(people[best]), float(final[best]), quality
+
+
+def nearest_centroids(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Index of the closest centroid for every row, computed in chunks"""
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    result = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), ASSIGN_CHUNK):
+        chunk = np.asarray(vectors[start:start + ASSIGN_CHUNK], dtype=np.float32)
+        # ||x - c||^2 without the constant ||x||^2 term
+        scores = centroid_norms[None, :] - 2 * chunk @ centroids.T
+        result[start:start + len(chunk)] = scores.argmin(axis=1)
+    return result
+
+
+def kmeans(data: np.ndarray, k: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """Plain Lloyd's k-means; empty clusters are reseeded from random points"""
+    rng = np.random.default_rng(seed)
+    k = min(k, len(data))
+    centroids = np.array(data[rng.choice(len(data), k, replace=False)], dtype=np.float32)
+    for _ in range(iterations):
+        assign = nearest_centroids(data, centroids)
+        order = np.argsort(assign, kind='stable')
+        clusters, starts, counts = np.unique(assign[order], return_index=True, return_counts=True)
+        sums = np.add.reduceat(data[order], starts, axis=0)
+        centroids[clusters] = sums / counts[:, None]
+        empty = np.setdiff1d(np.arange(k), clusters)
+        if len(empty):
+            centroids[empty] = data[rng.choice(len(data), len(empty), replace=False)]
+    return centroids
+
+
+class FaceMatrix:
+    """Exact index: all of a user's assigned face descriptors with a person label per row
+    Deleted faces are masked out rather than compacted
+    """
+
+    def __init__(self, version: int = 0):
+        self.version = version
+        # Rows loaded from disk (possibly memory-mapped, read-only), then rows added in memory
+        self.base = np.empty((0, DESCRIPTOR_DIM), dtype=np.float32)
+        self.tail = np.empty((0, DESCRIPTOR_DIM), dtype=np.float32)
+        self.labels = np.empty(0, dtype=np.int32)
+        self.alive = np.empty(0, dtype=bool)
+        self.face_ids: List[str] = []
+        self.face_rows: Dict[str, int] = {}
+        self.person_ids: List[str] = []
+        self.person_index: Dict[str, int] = {}
+        self.size = 0  # Rows including deleted ones
+        self.live = 0
+        self.dirty = False  # Changed since last save
+
+    @classmethod
+    def from_rows(cls, version: int, face_ids: List[str], person_ids: List[str], descriptors) -> "FaceMatrix":
+        index = cls(version)
+        index.add_many(face_ids, person_ids, descriptors)
+        return index
+
+    @property
+    def base_size(self) -> int:
+        return len(self.base)
+
+    def _label(self, person_id: str) -> int:
+        label = self.person_index.get(person_id)
+        if label is None:
+            label = len(self.person_ids)
+            self.person_ids.append(person_id)
+            self.person_index[person_id] = label
+        return label
+
+    def add_many(self, face_ids: List[str], person_ids: List[str], descriptors) -> np.ndarray:
+        """Append faces in bulk; returns their row numbers"""
+        count = len(face_ids)
+        if count == 0:
+            return np.empty(0, dtype=np.int64)
+        vectors = np.asarray(descriptors, dtype=np.float32).reshape(count, DESCRIPTOR_DIM)
+        first = self.size
+        tail_start = first - self.base_size
+
+        self.tail = _grow(self.tail, tail_start + count)
+        self.labels = _grow(self.labels, first + count)
+        self.alive = _grow(self.alive, first + count)
+
+        self.tail[tail_start:tail_start + count] = vectors
+        self.labels[first:first + count] = [self._label(p) for p in person_ids]
+        self.alive[first:first + count] = True
+        for offset, face_id in enumerate(face_ids):
+            self.face_ids.append(face_id)
+            self.face_rows[face_id] = first + offset
+
+        self.size += count
+        self.live += count
+        self.dirty = True
+        return np.arange(first, first + count)
+
+    def add(self, face_id: str, person_id: str, descriptor) -> int:
+        return int(self.add_many([face_id], [person_id], [descriptor])[0])
+
+    def remove_faces(self, face_ids: List[str]):
+        rows = [self.face_rows.pop(f) for f in face_ids if f in self.face_rows]
+        rows = [r for r in rows if self.alive[r]]
+        if rows:
+            self.alive[rows] = False
+            self.live -= len(rows)
+            self.dirty = True
+
+    def remove_person(self, person_id: str):
+        label = self.person_index.get(person_id)
+        if label is None:
+            return
+        mask = (self.labels[:self.size] == label) & self.alive[:self.size]
+        removed = int(mask.sum())
+        if removed:
+            self.alive[:self.size][mask] = False
+            self.live -= removed
+            self.dirty = True
+
+    def relabel(self, from_person_ids: List[str], to_person_id: str):
+        """Move all faces of from_person_ids onto to_person_id (person merge)"""
+        target = self._label(to_person_id)
+        for person_id in from_person_ids:
+            label = self.person_index.get(person_id)
+            if label is not None and label != target:
+                labels = self.labels[:self.size]
+                labels[labels == label] = target
+                self.dirty = True
+
+    def vectors(self, rows: np.ndarray) -> np.ndarray:
+        """Descriptors for the given row numbers, from the base and/or the tail"""
+        if self.base_size == 0:
+            return self.tail[rows]
+        in_base = rows < self.base_size
+        if in_base.all():
+            return np.asarray(self.base[rows])
+        result = np.empty((len(rows), DESCRIPTOR_DIM), dtype=np.float32)
+        result[in_base] = self.base[rows[in_base]]
+        result[~in_base] = self.tail[rows[~in_base] - self.base_size]
+        return result
+
+    def _candidates(self, query: np.ndarray) -> Optional[np.ndarray]:
+        """Rows worth scoring for this query; None means every live row"""
+        return None
+
+    def _candidate_distances(self, descriptor) -> tuple:
+        """(rows, distances) of the rows considered for this query"""
+        query = np.asarray(descriptor, dtype=np.float32)
+        rows = self._candidates(query)
+        if rows is None:
+            if self.base_size == 0 and self.live == self.size:
+                # Fast path: contiguous in-memory matrix, nothing deleted
+                rows = np.arange(self.size)
+                vectors = self.tail[:self.size]
+            else:
+                rows = np.flatnonzero(self.alive[:self.size])
+                vectors = self.vectors(rows)
+        else:
+            rows = rows[self.alive[rows]]
+            vectors = self.vectors(rows)
+        return rows, np.linalg.norm(vectors - query, axis=1)
+
+    def match(self, descriptor) -> Optional[tuple]:
+        """Best matching person as (person_id, distance, match_quality), or None when empty"""
+        if self.live == 0:
+            return None
+        rows, distances = self._candidate_distances(descriptor)
+        if len(rows) == 0:
+            return None
+        label, distance, quality = score_people(distances, self.labels[rows])
+        return self.person_ids[label], distance, quality
+
+    def search(self, descriptor, k: int, exclude_face_id: Optional[str] = None) -> List[tuple]:
+        """k nearest faces as (face_id, person_id, distance), closest first"""
+        if self.live == 0:
+            return []
+        rows, distances = self._candidate_distances(descriptor)
+        exclude = self.face_rows.get(exclude_face_id) if exclude_face_id else None
+        if exclude is not None:
+            keep = rows != exclude
+            rows, distances = rows[keep], distances[keep]
+        k = min(k, len(rows))
+        if k == 0:
+            return []
+        top = np.argpartition(distances, k - 1)[:k]
+        top = top[np.argsort(distances[top])]
+        return [
+            (self.face_ids[row], self.person_ids[label], float(distance))
+            for row, label, distance in zip(rows[top].tolist(), self.labels[rows[top]].tolist(), distances[top].tolist())
+        ]
+
+    def match_many(self, descriptors) -> List[Optional[tuple]]:
+        """match() for every row of descriptors, sharing one distance matrix per block of queries"""
+        queries = np.asarray(descriptors, dtype=np.float32).reshape(-1, DESCRIPTOR_DIM)
+        if self.live == 0:
+            return [None] * len(queries)
+        rows = np.flatnonzero(self.alive[:self.size])
+        vectors = self.vectors(rows)
+        labels = self.labels[rows]
+        vector_norms = (vectors ** 2).sum(axis=1)
+        block = max(1, MATCH_BLOCK_ELEMENTS // len(rows))
+        results = []
+        for start in range(0, len(queries), block):
+            chunk = queries[start:start + block]
+            # ||q - x||^2 = ||q||^2 + ||x||^2 - 2 q.x
+            squared = (chunk ** 2).sum(axis=1)[:, None] + vector_norms[None, :] - 2 * chunk @ vectors.T
+            distances = np.sqrt(np.maximum(squared, 0))
+            for row in distances:
+                label, distance, quality = score_people(row, labels)
+                results.append((self.person_ids[label], distance, quality))
+        return results
+
+
+class IVFFaceIndex(FaceMatrix):
+    """Inverted-file index: faces are bucketed by nearest k-means centroid and a query
+    only scores the faces in its `nprobe` closest buckets
+    Can be saved to a directory and loaded back with the descriptors memory-mapped
+    """
+
+    def __init__(self, version: int = 0, nprobe: int = 8):
+        super().__init__(version)
+        self.nprobe = nprobe
+        self.centroids: Optional[np.ndarray] = None
+        self.assign = np.empty(0, dtype=np.int32)
+        self.lists: List[List[int]] = []
+
+    @staticmethod
+    def default_nlist(count: int) -> int:
+        return int(max(1, min(4096, round(np.sqrt(count)))))
+
+    @classmethod
+    def build(cls, version: int, face_ids: List[str], person_ids: List[str], descriptors,
+              centroids: Optional[np.ndarray] = None, nlist: Optional[int] = None,
+              nprobe: int = 8, sample_size: int = 50000, seed: int = 0) -> "IVFFaceIndex":
+        """Train centroids (unless given) and add all faces"""
+        index = cls(version, nprobe)
+        vectors = np.asarray(descriptors, dtype=np.float32).reshape(-1, DESCRIPTOR_DIM)
+        if centroids is None and len(vectors):
+            rng = np.random.default_rng(seed)
+            sample = vectors if len(vectors) <= sample_size else vectors[rng.choice(len(vectors), sample_size, replace=False)]
+            centroids = kmeans(sample, nlist or cls.default_nlist(len(vectors)), seed=seed)
+        if centroids is not None:
+            index.set_centroids(centroids)
+        index.add_many(face_ids, person_ids, vectors)
+        return index
+
+    def set_centroids(self, centroids: np.ndarray):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.lists = [[] for _ in range(len(self.centroids))]
+
+    def add_many(self, face_ids: List[str], person_ids: List[str], descriptors) -> np.ndarray:
+        rows = super().add_many(face_ids, person_ids, descriptors)
+        if len(rows) and self.centroids is not None:
+            clusters = nearest_centroids(self.vectors(rows), self.centroids)
+            self.assign = _grow(self.assign, self.size)
+            self.assign[rows] = clusters
+            for row, cluster in zip(rows.tolist(), clusters.tolist()):
+                self.lists[cluster].append(row)
+        return rows
+
+    def _candidates(self, query: np.ndarray) -> Optional[np.ndarray]:
+        if self.centroids is None:
+            return None
+        nprobe = min(self.nprobe, len(self.centroids))
+        distances = ((self.centroids - query) ** 2).sum(axis=1)
+        probe = np.argpartition(distances, nprobe - 1)[:nprobe]
+        rows = [self.lists[c] for c in probe.tolist() if self.lists[c]]
+        if not rows:
+            return np.empty(0, dtype=np.int64)
+        return np.fromiter((r for lst in rows for r in lst), dtype=np.int64)
+
+    def match_many(self, descriptors) -> List[Optional[tuple]]:
+        if self.centroids is None:
+            return super().match_many(descriptors)
+        # Each query probes its own lists, so there is no shared matrix to batch over
+        return [self.match(q) for q in np.asarray(descriptors, dtype=np.float32).reshape(-1, DESCRIPTOR_DIM)]
+
+    # ----- persistence -----
+
+    def save(self, path):
+        """Write live rows to a fresh versioned directory, then switch CURRENT to it"""
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        target = path / f"v{self.version}-{os.getpid()}"
+        if target.exists():
+            shutil.rmtree(target)
+        target.mkdir()
+
+        rows = np.flatnonzero(self.alive[:self.size])
+        np.save(target / 'vectors.npy', self.vectors(rows))
+        np.save(target / 'labels.npy', self.labels[rows])
+        if self.centroids is not None:
+            np.save(target / 'centroids.npy', self.centroids)
+            np.save(target / 'assign.npy', self.assign[rows])
+        with open(target / 'meta.json', 'w') as f:
+            json.dump({
+                "version": self.version,
+                "nprobe": self.nprobe,
+                "person_ids": self.person_ids,
+                "face_ids": [self.face_ids[r] for r in rows.tolist()],
+            }, f)
+
+        # Other processes may save the same user's index concurrently: each writes its own
+        # pointer file, and only directories older than whatever CURRENT names now are removed
+        pointer = path / f'CURRENT.{os.getpid()}.tmp'
+        pointer.write_text(target.name)
+        os.replace(pointer, path / 'CURRENT')
+        current = _saved_version((path / 'CURRENT').read_text().strip())
+        for old in path.iterdir():
+            version = _saved_version(old.name)
+            if old.is_dir() and version is not None and current is not None and version < current:
+                shutil.rmtree(old, ignore_errors=True)
+        self.dirty = False
+
+    @classmethod
+    def load(cls, path, mmap: bool = True) -> Optional["IVFFaceIndex"]:
+        """Load a saved index; descriptors stay on disk when mmap is set
+        Returns None when nothing (readable) is saved
+        """
+        path = Path(path)
+        for _ in range(LOAD_ATTEMPTS):
+            try:
+                return cls._load(path, mmap)
+            except FileNotFoundError:
+                # A concurrent save replaced CURRENT and removed the directory being read
+                continue
+            except (OSError, ValueError, KeyError):
+                return None
+        return None
+
+    @classmethod
+    def _load(cls, path: Path, mmap: bool) -> "IVFFaceIndex":
+        current = path / (path / 'CURRENT').read_text().strip()
+        with open(current / 'meta.json') as f:
+            meta = json.load(f)
+
+        index = cls(meta['version'], meta.get('nprobe', 8))
+        index.base = np.load(current / 'vectors.npy', mmap_mode='r' if mmap else None)
+        count = len(index.base)
+        index.labels = np.array(np.load(current / 'labels.npy'), dtype=np.int32)
+        index.alive = np.ones(count, dtype=bool)
+        index.person_ids = meta['person_ids']
+        index.person_index = {p: i for i, p in enumerate(index.person_ids)}
+        index.face_ids = meta['face_ids']
+        index.face_rows = {f: i for i, f in enumerate(index.face_ids)}
+        index.size = index.live = count
+
+        centroids_file = current / 'centroids.npy'
+        if centroids_file.exists():
+            index.set_centroids(np.load(centroids_file))
+            index.assign = np.array(np.load(current / 'assign.npy'), dtype=np.int32)
+            order = np.argsort(index.assign, kind='stable')
+            clusters, starts = np.unique(index.assign[order], return_index=True)
+            for cluster, rows in zip(clusters.tolist(), np.split(order, starts[1:])):
+                index.lists[cluster] = rows.tolist()
+        return index
+
+    @staticmethod
+    def load_centroids(path) -> Optional[np.ndarray]:
+        """Centroids from a saved index, to rebuild without retraining"""
+        path = Path(path)
+        try:
+            current = path / (path / 'CURRENT').read_text().strip()
+            return np.load(current / 'centroids.npy')
+        except (OSError, ValueError):
+            return None
+
+
+def _saved_version(name: str) -> Optional[int]:
+    """Index version of a 'v{version}-{pid}' directory name, None for anything else"""
+    if not name.startswith('v') or '-' not in name:
+        return None
+    try:
+        return int(name[1:].split('-', 1)[0])
+    except ValueError:
+        return None
@@ -0,0 +1,115 @@
+"""
+Event-loop stall watchdog
+
+Something synchronous inside a coroutine (a requests call, bcrypt, image work)
+freezes every request on the loop. The watchdog makes that visible: the loop
+stamps a heartbeat every interval, and a daemon thread that finds the heartbeat
+older than the threshold grabs the loop thread's current stack, which is the
+code that is blocking. When the loop comes back the stall is reported once,
+with its duration, through the logger and an optional on_stall callback (used
+to feed metrics).
+
+Opt in with LOOP_WATCHDOG_MS=<threshold in milliseconds>; overhead is one timer
+callback per interval on the loop plus a thread that wakes equally often.
+Self-contained so the same file can ship next to the worker templates.
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import sysconfig
+import threading
+import time
+import traceback
+from typing import Callable, Optional
+
+STACK_LIMIT = 25  # Innermost frames kept in a report
+_LIBRARY_PATHS = tuple(
+    os.path.normcase(path) for path in {sysconfig.get_paths()['stdlib'], sysconfig.get_paths()['purelib']}
+)
+
+
+def blocking_site(frame) -> str:
+    """'file:line function' of the innermost frame outside the stdlib and installed packages"""
+    innermost = frame
+    while frame is not None:
+        filename = os.path.normcase(frame.f_code.co_filename)
+        if not filename.startswith(_LIBRARY_PATHS) and 'site-packages' not in filename and filename != os.path.normcase(__file__):
+            return f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno} {frame.f_code.co_name}"
+        frame = frame.f_back
+    code = innermost.f_code
+    return f"{os.path.basename(code.co_filename)}:{innermost.f_lineno} {code.co_name}"
+
+
+class LoopWatchdog:
+    """Detects event-loop stalls longer than threshold seconds and captures the blocking stack"""
+
+    def __init__(self, threshold: float, on_stall: Optional[Callable[[float, str, str], None]] = None,
+                 logger: Optional[logging.Logger] = None):
+        self.threshold = threshold
+        self.interval = max(threshold / 4, 0.005)
+        self.on_stall = on_stall  # Called on the watchdog thread with (seconds, site, stack)
+        self.logger = logger or logging.getLogger(__name__)
+        self.last_beat = time.monotonic()
+        self._loop = None
+        self._loop_thread = None
+        self._handle = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start watching the running loop; call from inside it"""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._beat()
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        self.logger.info(f"Event loop watchdog on, reporting stalls over {self.threshold * 1000:.0f} ms")
+
+    def stop(self):
+        self._stopped.set()
+        if self._handle:
+            self._handle.cancel()
+
+    def _beat(self):
+        self.last_beat = time.monotonic()
+        self._handle = self._loop.call_later(self.interval, self._beat)
+
+    def _watch(self):
+        stalled_beat = None  # Heartbeat the current stall started after
+        site = stack = None
+        while not self._stopped.wait(self.interval):
+            beat = self.last_beat
+            late = time.monotonic() - beat - self.interval
+            if stalled_beat is None:
+                if late > self.threshold:
+                    frame = sys._current_frames().get(self._loop_thread)
+                    if frame is None:
+                        continue
+                    stalled_beat = beat
+                    site = blocking_site(frame)
+                    stack = ''.join(traceback.format_stack(frame, limit=STACK_LIMIT))
+            elif beat != stalled_beat:
+                # Loop is back; the gap between the two heartbeats is the stall
+                self._report(beat - stalled_beat - self.interval, site, stack)
+                stalled_beat = None
+
+    def _report(self, duration: float, site: str, stack: str):
+        self.logger.warning(f"Event loop blocked for {duration * 1000:.0f} ms at {site}\n{stack}")
+        if self.on_stall:
+            try:
+                self.on_stall(duration, site, stack)
+            except Exception as e:
+                self.logger.error(f"Loop stall callback failed: {str(e)}")
+
+
+def watchdog_from_env(on_stall: Optional[Callable[[float, str, str], None]] = None,
+                      logger: Optional[logging.Logger] = None) -> Optional[LoopWatchdog]:
+    """Start a watchdog on the running loop when LOOP_WATCHDOG_MS is set, else return None"""
+    threshold_ms = float(os.environ.get('LOOP_WATCHDOG_MS') or 0)
+    if threshold_ms <= 0:
+        return None
+    watchdog = LoopWatchdog(threshold_ms / 1000, on_stall=on_stall, logger=logger)
+    watchdog.start()
+    return watchdog
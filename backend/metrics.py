@@ -0,0 +1,177 @@
+"""
+Prometheus metrics for the backend
+
+Everything here is cheap enough for the hot path: a pure ASGI middleware times
+requests by route template, a pymongo command listener records the duration
+the driver already measures, a requests.Session subclass times Telegram Bot API
+calls, a background task samples event-loop lag and the opt-in loop watchdog
+(loop_watchdog.py) reports stalls. GET /metrics renders the registry; with
+PROMETHEUS_MULTIPROC_DIR set (several server processes) it aggregates the
+per-process files instead.
+"""
+
+import asyncio
+import os
+import time
+from urllib.parse import urlsplit
+
+import requests
+from pymongo import monitoring
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+)
+from prometheus_client import multiprocess
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+MONGO_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+LOOP_LAG_INTERVAL = 0.5  # Seconds between lag samples
+
+http_requests = Counter(
+    "http_requests_total", "HTTP requests by route template and status",
+    ["method", "route", "status"]
+)
+http_latency = Histogram(
+    "http_request_duration_seconds", "Time until the response body was fully sent",
+    ["method", "route"], buckets=LATENCY_BUCKETS
+)
+http_in_progress = Gauge(
+    "http_requests_in_progress", "Requests currently being handled",
+    ["method"], multiprocess_mode="livesum"
+)
+mongo_latency = Histogram(
+    "mongo_command_duration_seconds", "MongoDB command round trips by collection",
+    ["command", "collection"], buckets=MONGO_BUCKETS
+)
+mongo_failures = Counter(
+    "mongo_command_failures_total", "MongoDB commands that returned an error",
+    ["command", "collection"]
+)
+telegram_latency = Histogram(
+    "telegram_api_request_duration_seconds", "Telegram Bot API calls by method",
+    ["method"], buckets=LATENCY_BUCKETS
+)
+telegram_requests = Counter(
+    "telegram_api_requests_total", "Telegram Bot API calls by method and HTTP status ('error' when no response)",
+    ["method", "status"]
+)
+loop_lag = Histogram(
+    "event_loop_lag_seconds", "How late the event loop ran a timer", buckets=LOOP_LAG_BUCKETS
+)
+loop_lag_last = Gauge(
+    "event_loop_lag_last_seconds", "Most recent event loop lag sample", multiprocess_mode="max"
+)
+loop_stalls = Counter(
+    "event_loop_stalls_total", "Stalls over the watchdog threshold by blocking code site", ["site"]
+)
+loop_stall_duration = Histogram(
+    "event_loop_stall_duration_seconds", "How long the event loop was blocked", buckets=LOOP_LAG_BUCKETS
+)
+
+
+class MetricsMiddleware:
+    """Counts and times HTTP requests, labelled by route template so ids do not explode cardinality"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status = 500
+        in_progress = http_in_progress.labels(method)
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        in_progress.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            in_progress.dec()
+            # The router stores the matched route on the scope
+            route = getattr(scope.get("route"), "path", "unmatched")
+            http_latency.labels(method, route).observe(elapsed)
+            http_requests.labels(method, route, str(status)).inc()
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """pymongo listener; pass an instance in the client's event_listeners"""
+
+    def __init__(self):
+        self.collections = {}  # request_id -> collection of commands in flight
+
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        if event.command_name == "getMore":
+            target = event.command.get("collection")
+        self.collections[event.request_id] = target if isinstance(target, str) else ""
+
+    def succeeded(self, event):
+        collection = self.collections.pop(event.request_id, "")
+        mongo_latency.labels(event.command_name, collection).observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        collection = self.collections.pop(event.request_id, "")
+        mongo_latency.labels(event.command_name, collection).observe(event.duration_micros / 1e6)
+        mongo_failures.labels(event.command_name, collection).inc()
+
+
+def telegram_method(url: str) -> str:
+    """Bot API method of a request URL; file downloads are reported as 'file'"""
+    path = urlsplit(url).path
+    if path.startswith("/file/"):
+        return "file"
+    return path.rsplit("/", 1)[-1] or "unknown"
+
+
+class TelegramSession(requests.Session):
+    """requests.Session that records Telegram Bot API latency and outcomes per method"""
+
+    def request(self, method, url, *args, **kwargs):
+        api_method = telegram_method(url)
+        start = time.perf_counter()
+        try:
+            response = super().request(method, url, *args, **kwargs)
+        except requests.RequestException:
+            telegram_requests.labels(api_method, "error").inc()
+            raise
+        finally:
+            telegram_latency.labels(api_method).observe(time.perf_counter() - start)
+        telegram_requests.labels(api_method, str(response.status_code)).inc()
+        return response
+
+
+async def monitor_loop_lag(interval: float = LOOP_LAG_INTERVAL):
+    """Sleep for interval and record how much later than that the loop woke us"""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(loop.time() - start - interval, 0.0)
+        loop_lag.observe(lag)
+        loop_lag_last.set(lag)
+
+
+def record_loop_stall(duration: float, site: str, stack: str):
+    """on_stall callback for the loop watchdog"""
+    loop_stalls.labels(site).inc()
+    loop_stall_duration.observe(duration)
+
+
+def render_metrics() -> tuple:
+    """(body, content type) in the Prometheus text format"""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
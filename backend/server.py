@@ -1,26 +1,50 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile, File, Form
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, status, UploadFile, File, Form
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import Response, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne, DeleteOne, ReturnDocument
+from pymongo.errors import DuplicateKeyError
 import os
+import socket
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional
+from pydantic import BaseModel, Field, ConfigDict, EmailStr, field_validator
+from typing import List, Optional, Union
+from collections import OrderedDict, Counter
 import uuid
 from datetime import datetime, timezone, timedelta
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 import asyncio
+import time
+from contextlib import asynccontextmanager
+import multiprocessing
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from telethon import TelegramClient
 from telethon.sessions import StringSession
 from telethon.tl.functions.channels import CreateChannelRequest
 from telethon.tl.functions.messages import ExportChatInviteRequest
+from telethon.tl.functions.auth import ExportLoginTokenRequest, ImportLoginTokenRequest
+from telethon.tl.types.auth import LoginTokenMigrateTo, LoginTokenSuccess
 import base64
+import binascii
 import io
 import qrcode
 import requests
+import orjson
+import numpy as np
+from face_index import (
+    DESCRIPTOR_DIM, DESCRIPTOR_DTYPE, FaceMatrix, IVFFaceIndex,
+    pack_descriptor, unpack_descriptor, stack_descriptors
+)
+from face_cluster import KNN_NEIGHBOURS, knn_rows, chinese_whispers, plan_assignments
+from metrics import (
+    MetricsMiddleware, MongoCommandMetrics, TelegramSession, monitor_loop_lag, record_loop_stall, render_metrics
+)
+from loop_watchdog import watchdog_from_env
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 
@@ -30,7 +54,7 @@ load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, tz_aware=True, event_listeners=[MongoCommandMetrics()])
 db = client[os.environ['DB_NAME']]
 
 # Security
@@ -40,9 +64,6 @@ SECRET_KEY = os.environ.get("JWT_SECRET_KEY", "your-secret-key-change-in-product
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 43200  # 30 days
 
-# Telegram clients storage (in-memory for demo, use Redis in production)
-telegram_clients = {}
-
 # Create the main app
 app = FastAPI()
 api_router = APIRouter(prefix="/api")
@@ -97,6 +118,7 @@ class FileMetadata(BaseModel):
     folder_id: Optional[str] = None
     is_trashed: bool = False
     trashed_at: Optional[datetime] = None
+    purge_at: Optional[datetime] = None  # Set while trashed: when the trash scheduler deletes it
     is_public: bool = False
     share_token: Optional[str] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
@@ -121,12 +143,54 @@ class Folder(BaseModel):
     user_id: str
     name: str
     parent_id: Optional[str] = None
+    ancestors: List[str] = Field(default_factory=list)  # Folder ids from root down to parent
+    is_trashed: bool = False
+    trashed_at: Optional[datetime] = None
+    purge_at: Optional[datetime] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class FolderCreate(BaseModel):
     name: str
     parent_id: Optional[str] = None
 
+class FolderUpdate(BaseModel):
+    name: Optional[str] = None
+    parent_id: Optional[str] = None  # Only applied when sent; null moves to root
+
+class FolderOperation(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: str
+    folder_id: str
+    action: str  # 'delete' or 'restore'
+    status: str = "pending"  # pending, running, completed, failed
+    folders_processed: int = 0
+    files_processed: int = 0
+    error: Optional[str] = None
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class Job(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: str
+    type: str  # Key into JOB_HANDLERS
+    params: dict = {}
+    priority: int = 0  # Higher runs first
+    status: str = "queued"  # queued, running, completed, failed
+    attempts: int = 0
+    max_attempts: int = 3
+    run_after: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    progress: float = 0.0
+    result: dict = {}
+    error: Optional[str] = None
+    worker: Optional[str] = None
+    lease_expires_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
 class ApiKeysUpdate(BaseModel):
     cloudinary_cloud_name: Optional[str] = None
     cloudinary_api_key: Optional[str] = None
@@ -150,28 +214,64 @@ class TelegramCodeVerify(BaseModel):
 
 class TelegramQRRequest(BaseModel):
     session_id: str
+    wait: int = Field(25, ge=0, le=50)  # Seconds to hold the request open until the QR is scanned
 
 class ChannelIdUpdate(BaseModel):
     channel_id: int
 
+def decode_packed_descriptor(value):
+    """Before-validator for descriptor fields: base64 strings become the packed bytes"""
+    if isinstance(value, str):
+        try:
+            value = base64.b64decode(value, validate=True)
+        except binascii.Error:
+            raise ValueError("descriptor must be a list of floats or base64 float32")
+        if len(value) != DESCRIPTOR_DIM * DESCRIPTOR_DTYPE.itemsize:
+            raise ValueError(f"packed descriptor must hold {DESCRIPTOR_DIM} float32 values")
+    elif isinstance(value, list) and len(value) != DESCRIPTOR_DIM:
+        raise ValueError(f"descriptor must hold {DESCRIPTOR_DIM} values")
+    return value
+
+FACE_SEARCH_MAX_K = 200
+
 class FaceDetection(BaseModel):
     box: dict  # {x, y, width, height}
-    descriptor: List[float]  # 128-dimensional face descriptor
+    # 128-dimensional face descriptor: a list of floats, or base64 of the packed
+    # little-endian float32 bytes (decoded here, skips validating 128 floats per face)
+    descriptor: Union[bytes, List[float]]
     confidence: float
 
+    _decode_descriptor = field_validator('descriptor', mode='before')(decode_packed_descriptor)
+
 class FaceDataCreate(BaseModel):
     file_id: str
     detections: List[FaceDetection]
 
+class FaceBatchCreate(BaseModel):
+    items: List[FaceDataCreate]
+
+class FaceSearchRequest(BaseModel):
+    # Either an existing face or a raw descriptor (same formats as FaceDetection)
+    face_id: Optional[str] = None
+    descriptor: Optional[Union[bytes, List[float]]] = None
+    k: int = Field(default=20, ge=1, le=FACE_SEARCH_MAX_K)
+    max_distance: Optional[float] = None
+
+    _decode_descriptor = field_validator('descriptor', mode='before')(decode_packed_descriptor)
+
+# Schema 2 stores descriptor as packed float32 bytes instead of a list of doubles
+FACE_SCHEMA_VERSION = 2
+
 class FaceData(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     file_id: str
     user_id: str
     person_id: Optional[str] = None  # Assigned after grouping
-    descriptor: List[float]
+    descriptor: bytes  # Packed float32, see pack_descriptor
     box: dict  # Bounding box coordinates
     confidence: float
+    schema_version: int = FACE_SCHEMA_VERSION
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class Person(BaseModel):
@@ -192,6 +292,28 @@ class PersonMerge(BaseModel):
     person_ids: List[str]  # List of person IDs to merge
     target_person_id: str  # The person to merge into
 
+class ReclusterRequest(BaseModel):
+    apply: bool = False  # False only records the proposed changes
+
+class FaceClusterJob(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: str
+    apply: bool = False
+    status: str = "pending"  # pending, running, completed, failed
+    stage: Optional[str] = None  # loading, neighbours, clustering, planning, applying
+    progress: float = 0.0  # 0-1 within the current stage
+    face_count: int = 0
+    cluster_count: int = 0
+    faces_moved: int = 0
+    people_merged: int = 0  # Unnamed people whose faces all moved elsewhere
+    people_split: int = 0  # People that lost only some of their faces
+    people_created: int = 0
+    proposals: List[dict] = []  # Largest moves: from_person_id, to_person_id (None = new), face_count
+    error: Optional[str] = None
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
 class BulkDeleteRequest(BaseModel):
     file_ids: List[str]
 
@@ -239,6 +361,133 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         raise HTTPException(status_code=401, detail="Invalid token")
 
 
+# ========== LISTING HELPERS ==========
+
+# Named views for file listings. None means the full document.
+FILE_LIST_VIEWS = {
+    "grid": ["id", "name", "size", "mime_type", "thumbnail_url"],
+    "detail": None,
+}
+
+def resolve_projection(model, view: Optional[str] = None, fields: Optional[str] = None, views: Optional[dict] = None) -> Optional[dict]:
+    """Build a Mongo projection from a named view or a comma-separated field list
+    Returns None when the full document should be returned
+    """
+    selected = None
+    if fields:
+        selected = [f.strip() for f in fields.split(',') if f.strip()]
+        unknown = [f for f in selected if f not in model.model_fields]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    elif view:
+        if not views or view not in views:
+            raise HTTPException(status_code=400, detail=f"Unknown view: {view}")
+        selected = views[view]
+
+    if not selected:
+        return None
+
+    projection = {"_id": 0, "id": 1}
+    for f in selected:
+        projection[f] = 1
+    return projection
+
+def model_projection(model) -> dict:
+    """Mongo projection of exactly the model's fields, so internal fields never reach a response"""
+    return {"_id": 0, **{f: 1 for f in model.model_fields}}
+
+
+# Rows below come straight from our own collections (written via model_dump),
+# so listings skip per-row pydantic validation and encode with orjson.
+ORJSON_OPTIONS = orjson.OPT_NAIVE_UTC
+STREAM_BATCH_SIZE = 500
+
+class FastJSONResponse(Response):
+    """JSON response for trusted database rows, encoded with orjson"""
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=ORJSON_OPTIONS)
+
+async def stream_json_rows(cursor):
+    """Encode rows from a Motor cursor as a JSON array, one batch at a time"""
+    yield b'['
+    first = True
+    batch = []
+    async for row in cursor:
+        batch.append(orjson.dumps(row, option=ORJSON_OPTIONS))
+        if len(batch) >= STREAM_BATCH_SIZE:
+            yield (b'' if first else b',') + b','.join(batch)
+            first = False
+            batch = []
+    if batch:
+        yield (b'' if first else b',') + b','.join(batch)
+    yield b']'
+
+def stream_rows_response(cursor) -> StreamingResponse:
+    """Stream a Motor cursor to the client as a JSON array"""
+    return StreamingResponse(stream_json_rows(cursor), media_type="application/json")
+
+
+# Keyset pagination over (created_at, id) for file listings
+FILE_PAGE_MAX = 1000
+FILE_SORT = [("created_at", 1), ("id", 1)]
+
+def encode_file_cursor(row: dict) -> str:
+    """Opaque cursor pointing just after this row"""
+    raw = orjson.dumps([row['created_at'], row['id']], option=ORJSON_OPTIONS)
+    return base64.urlsafe_b64encode(raw).decode()
+
+def decode_file_cursor(cursor: str) -> tuple:
+    """(created_at, id) of the row a cursor points after"""
+    try:
+        created_at, last_id = orjson.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created_at), last_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def apply_file_cursor(query: dict, cursor: Optional[str]) -> dict:
+    """Restrict a file query to rows after the cursor"""
+    if not cursor:
+        return query
+    created_at, last_id = decode_file_cursor(cursor)
+    return {**query, "$or": [
+        {"created_at": {"$gt": created_at}},
+        {"created_at": created_at, "id": {"$gt": last_id}}
+    ]}
+
+completed_migrations = set()  # Ids of migrations seen completed; they never go back
+
+async def migration_completed(migration_id: str) -> bool:
+    if migration_id in completed_migrations:
+        return True
+    state = await db.migrations.find_one({"_id": migration_id}, {"completed": 1})
+    if state and state.get("completed"):
+        completed_migrations.add(migration_id)
+        return True
+    return False
+
+async def fetch_file_page(query: dict, projection: dict, limit: int, cursor: Optional[str] = None):
+    """Fetch one page of files and the cursor for the next page (None on the last page)
+    Until the timestamp migration is done some created_at values are still strings, which
+    Mongo orders by type rather than by time; a cursor would skip them, so the whole
+    (capped) listing is returned as one page instead
+    """
+    if not await migration_completed(TIMESTAMP_MIGRATION_ID):
+        rows = await db.files.find(query, projection).sort(FILE_SORT).limit(FILE_PAGE_MAX).to_list(FILE_PAGE_MAX)
+        return rows, None
+    limit = max(1, min(limit, FILE_PAGE_MAX))
+    if len(projection) > 1:
+        # Cursor needs the sort keys even for slim views
+        projection = {**projection, "created_at": 1}
+    rows = await db.files.find(apply_file_cursor(query, cursor), projection).sort(FILE_SORT).limit(limit + 1).to_list(limit + 1)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_file_cursor(rows[-1])
+    return rows, next_cursor
+
+
 # ========== AUTH ROUTES ==========
 
 @api_router.post("/auth/signup", response_model=TokenResponse)
@@ -252,7 +501,6 @@ async def signup(user_data: UserSignup):
     user = User(email=user_data.email)
     user_dict = user.model_dump()
     user_dict['hashed_password'] = get_password_hash(user_data.password)
-    user_dict['created_at'] = user_dict['created_at'].isoformat()
     
     await db.users.insert_one(user_dict)
     
@@ -274,39 +522,402 @@ async def get_me(current_user: User = Depends(get_current_user)):
     return current_user
 
 
+# ========== TELEGRAM LOGIN SESSIONS ==========
+# A login needs a connected TelegramClient from request-qr/request-code until the verify
+# call. The live client stays in the process that started the login (login_sessions)
+# while its serializable state (session string with the auth key, phone code hash) goes
+# to db.telegram_logins. A verify call landing on another process is forwarded to the
+# owner when it set PROCESS_URL, otherwise the client is rebuilt from the stored session.
+# Logins expire after LOGIN_SESSION_TTL; expired clients are disconnected by a sweeper.
+# A QR login is watched from the moment it is created (Telethon only sees the scan while
+# QRLogin.wait runs), so the verify call just long-polls the watcher's result. A restored
+# QR login has no QRLogin to wait on; its watcher asks Telegram every QR_POLL_INTERVAL.
+
+LOGIN_SESSION_TTL = timedelta(minutes=10)
+LOGIN_SWEEP_INTERVAL = 30  # Seconds
+LOGIN_POOL_SIZE = int(os.environ.get('LOGIN_POOL_SIZE', 2))  # Pre-connected clients kept for new logins
+PROCESS_URL = os.environ.get('PROCESS_URL')  # Base URL other processes can reach this one at
+LOGIN_FORWARD_HEADER = "X-Login-Forwarded"
+QR_POLL_INTERVAL = 3  # Seconds between scan checks of a restored QR login
+
+def new_login_client(session: str = "") -> TelegramClient:
+    return TelegramClient(
+        StringSession(session),
+        int(os.environ.get('TELEGRAM_API_ID', '0')),
+        os.environ.get('TELEGRAM_API_HASH', '')
+    )
+
+def render_qr_png(data: str) -> str:
+    """QR code PNG as base64 (CPU bound, run it off the event loop)"""
+    qr = qrcode.QRCode(version=1, box_size=10, border=5)
+    qr.add_data(data)
+    qr.make(fit=True)
+    
+    img = qr.make_image(fill_color="black", back_color="white")
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+    return base64.b64encode(buffer.getvalue()).decode()
+
+class LoginClientPool:
+    """Connected but unauthorized clients kept ready, so a login skips the connect and key exchange"""
+    
+    def __init__(self, size: int):
+        self.size = size
+        self.idle = []
+        self.refilling = None
+    
+    async def acquire(self) -> TelegramClient:
+        while self.idle:
+            client = self.idle.pop()
+            if client.is_connected():
+                self.refill()
+                return client
+            await client.disconnect()
+        self.refill()
+        client = new_login_client()
+        await client.connect()
+        return client
+    
+    def refill(self):
+        if self.size and (self.refilling is None or self.refilling.done()):
+            self.refilling = asyncio.create_task(self._fill())
+    
+    async def _fill(self):
+        while len(self.idle) < self.size:
+            client = new_login_client()
+            try:
+                await client.connect()
+            except Exception as e:
+                logger.warning(f"Failed to pre-connect a Telegram login client: {str(e)}")
+                return
+            self.idle.append(client)
+    
+    async def close(self):
+        if self.refilling:
+            self.refilling.cancel()
+        for client in self.idle:
+            await client.disconnect()
+        self.idle.clear()
+
+login_client_pool = LoginClientPool(LOGIN_POOL_SIZE)
+
+class LoginSessionManager:
+    """Live clients of logins held by this process, keyed by login session id"""
+    
+    def __init__(self):
+        self.sessions = {}  # session_id -> {'client', 'expires_at', 'qr_login', 'watcher'}
+    
+    async def start(self, user_id: str, kind: str, client: TelegramClient, qr_login=None, **state) -> str:
+        """Store a new login and keep its client live here; QR logins start being watched"""
+        now = datetime.now(timezone.utc)
+        session_id = str(uuid.uuid4())
+        expires_at = now + LOGIN_SESSION_TTL
+        await db.telegram_logins.insert_one({
+            "id": session_id,
+            "user_id": user_id,
+            "kind": kind,  # 'qr' or 'phone'
+            "session": StringSession.save(client.session),
+            "owner": PROCESS_ID,
+            "owner_url": PROCESS_URL,
+            "created_at": now,
+            "expires_at": expires_at,
+            **state
+        })
+        entry = {'client': client, 'qr_login': qr_login, 'expires_at': expires_at, 'watcher': None}
+        if qr_login:
+            entry['watcher'] = asyncio.create_task(self._watch_qr(session_id, user_id, entry))
+        self.sessions[session_id] = entry
+        return session_id
+    
+    async def _watch_qr(self, session_id: str, user_id: str, entry: dict):
+        """Finish the login as soon as the QR is scanned and leave the outcome on the login document"""
+        try:
+            if entry['qr_login']:
+                await entry['qr_login'].wait()
+            else:
+                await self._poll_qr(entry)
+            outcome = {"result": await complete_telegram_login(entry['client'], user_id)}
+        except asyncio.TimeoutError:
+            outcome = {"expired": True}
+        except Exception as e:
+            logger.error(f"QR login error: {str(e)}")
+            outcome = {"error": str(e)}
+        # The session is authorized after a scan; only the outcome is needed from here on
+        await db.telegram_logins.update_one({"id": session_id}, {"$set": outcome, "$unset": {"session": ""}})
+        if self.sessions.get(session_id) is entry:
+            del self.sessions[session_id]
+        if "result" not in outcome:
+            await self._disconnect(session_id, entry)
+    
+    @staticmethod
+    async def _poll_qr(entry: dict):
+        """QRLogin.wait for a restored login: check with Telegram until scanned or the code expires"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (entry['qr_expires_at'] - datetime.now(timezone.utc)).total_seconds()
+        while not await qr_token_accepted(entry['client']):
+            if loop.time() + QR_POLL_INTERVAL > deadline:
+                raise asyncio.TimeoutError()
+            await asyncio.sleep(QR_POLL_INTERVAL)
+    
+    def get(self, session_id: str) -> Optional[dict]:
+        entry = self.sessions.get(session_id)
+        if entry and entry['expires_at'] > datetime.now(timezone.utc):
+            return entry
+        return None
+    
+    async def restore(self, login: dict) -> dict:
+        """Take over a login started elsewhere by reconnecting with its stored session"""
+        client = new_login_client(login['session'])
+        await client.connect()
+        entry = {'client': client, 'qr_login': None, 'expires_at': login['expires_at'], 'watcher': None}
+        if login['kind'] == "qr":
+            entry['qr_expires_at'] = login.get('qr_expires_at') or login['expires_at']
+            entry['watcher'] = asyncio.create_task(self._watch_qr(login['id'], login['user_id'], entry))
+        self.sessions[login['id']] = entry
+        await db.telegram_logins.update_one(
+            {"id": login['id']},
+            {"$set": {"owner": PROCESS_ID, "owner_url": PROCESS_URL}}
+        )
+        logger.info(f"Restored Telegram login {login['id']} from its stored session")
+        return entry
+    
+    async def close(self, session_id: str, keep_client: bool = False):
+        """Finish a login and forget it everywhere; keep_client when the client was handed to user_clients"""
+        entry = self.sessions.pop(session_id, None)
+        if entry and not keep_client:
+            await self._disconnect(session_id, entry)
+        await db.telegram_logins.delete_one({"id": session_id})
+    
+    async def sweep(self):
+        """Disconnect clients of expired logins; the TTL index removes their documents"""
+        now = datetime.now(timezone.utc)
+        for session_id in [sid for sid, e in self.sessions.items() if e['expires_at'] <= now]:
+            await self._disconnect(session_id, self.sessions.pop(session_id))
+    
+    async def run_sweeper(self):
+        while True:
+            await asyncio.sleep(LOGIN_SWEEP_INTERVAL)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Login session sweep error: {str(e)}")
+    
+    async def shutdown(self):
+        """Disconnect everything; pending logins stay in the store for other processes to restore"""
+        for session_id in list(self.sessions):
+            await self._disconnect(session_id, self.sessions.pop(session_id))
+        await db.telegram_logins.update_many({"owner": PROCESS_ID}, {"$set": {"owner_url": None}})
+    
+    @staticmethod
+    async def _disconnect(session_id: str, entry: dict):
+        if entry['watcher'] and entry['watcher'] is not asyncio.current_task():
+            entry['watcher'].cancel()
+        try:
+            await entry['client'].disconnect()
+        except Exception as e:
+            logger.warning(f"Failed to disconnect login client {session_id}: {str(e)}")
+
+login_sessions = LoginSessionManager()
+
+async def forward_login_request(login: dict, path: str, payload: dict, http_request: Request) -> Optional[Response]:
+    """Replay a verify call on the process holding the live client; None if that is not possible"""
+    if login.get('owner') == PROCESS_ID or not login.get('owner_url') or http_request.headers.get(LOGIN_FORWARD_HEADER):
+        return None
+    try:
+        response = await asyncio.to_thread(
+            requests.post,
+            f"{login['owner_url'].rstrip('/')}/api{path}",
+            json=payload,
+            headers={"Authorization": http_request.headers.get("authorization", ""), LOGIN_FORWARD_HEADER: PROCESS_ID},
+            timeout=payload.get('wait', 0) + 30
+        )
+    except requests.RequestException as e:
+        logger.warning(f"Login owner {login['owner']} unreachable, restoring locally: {str(e)}")
+        return None
+    return Response(content=response.content, status_code=response.status_code, media_type="application/json")
+
+async def qr_token_accepted(client: TelegramClient) -> bool:
+    """Ask Telegram whether a QR token of this auth key was scanned (QRLogin.wait without the live update)"""
+    result = await client(ExportLoginTokenRequest(
+        api_id=int(os.environ.get('TELEGRAM_API_ID', '0')),
+        api_hash=os.environ.get('TELEGRAM_API_HASH', ''),
+        except_ids=[]
+    ))
+    if isinstance(result, LoginTokenMigrateTo):
+        await client._switch_dc(result.dc_id)
+        result = await client(ImportLoginTokenRequest(result.token))
+    return isinstance(result, LoginTokenSuccess)
+
+async def complete_telegram_login(client: TelegramClient, user_id: str) -> dict:
+    """Save the authorized session on the user and create their storage channel
+    The connected client is then kept in user_clients for the channel setup calls that follow
+    """
+    me = await client.get_me()
+    
+    # Save session
+    session_string = StringSession.save(client.session)
+    
+    # Create private channel
+    result = await client(CreateChannelRequest(
+        title='TeleStore Files',
+        about='Private storage for TeleStore',
+        megagroup=False
+    ))
+    
+    # Get the channel ID (Telegram uses -100 prefix for channel IDs)
+    channel = result.chats[0]
+    channel_id = -1000000000000 - channel.id  # Convert to proper channel ID format
+    
+    # Try to export invite link
+    invite_link = None
+    try:
+        invite_result = await client(ExportChatInviteRequest(
+            peer=channel,
+            legacy_revoke_permanent=False
+        ))
+        invite_link = invite_result.link
+    except Exception as e:
+        logger.warning(f"Failed to export invite link: {str(e)}")
+        # Continue without invite link
+    
+    # Update user
+    await db.users.update_one(
+        {"id": user_id},
+        {"$set": {
+            "telegram_session": session_string,
+            "telegram_user_id": me.id,
+            "telegram_channel_id": channel_id,
+            "telegram_channel_invite": invite_link
+        }}
+    )
+    await user_clients.adopt(user_id, client, session_string)
+    
+    return {
+        "success": True,
+        "telegram_user_id": me.id,
+        "channel_id": channel_id,
+        "channel_invite": invite_link
+    }
+
+
+# ========== TELEGRAM USER CLIENTS ==========
+# Channel and bot administration talks to Telegram as the user. Rather than connect a
+# client from users.telegram_session for every call, user_clients keeps one connected
+# client per user: opened on first use, shared by concurrent calls, disconnected after
+# USER_CLIENT_IDLE seconds unused, with at most USER_CLIENT_LIMIT connected per process
+# (the least recently used idle one makes room).
+
+USER_CLIENT_LIMIT = int(os.environ.get('USER_CLIENT_LIMIT', 50))
+USER_CLIENT_IDLE = int(os.environ.get('USER_CLIENT_IDLE', 300))  # Seconds
+
+class UserClientManager:
+    """Connected TelegramClient per user, in least recently used order"""
+    
+    def __init__(self, limit: int, idle_timeout: int):
+        self.limit = limit
+        self.idle_timeout = idle_timeout
+        self.clients = OrderedDict()  # user_id -> {'client', 'session', 'in_use', 'last_used', 'retired'}
+        self.locks = {}  # user_id -> lock held while connecting
+    
+    @asynccontextmanager
+    async def session(self, user_id: str, session_string: str):
+        """Borrow the user's connected client, connecting it on first use"""
+        entry = await self._checkout(user_id, session_string)
+        try:
+            yield entry['client']
+        finally:
+            entry['in_use'] -= 1
+            entry['last_used'] = time.monotonic()
+            if entry['retired'] and entry['in_use'] == 0:
+                # Replaced or dropped while borrowed; the last borrower disconnects it
+                await self._disconnect(user_id, entry)
+    
+    async def _checkout(self, user_id: str, session_string: str) -> dict:
+        async with self.locks.setdefault(user_id, asyncio.Lock()):
+            entry = self.clients.get(user_id)
+            if entry and (entry['session'] != session_string or not entry['client'].is_connected()):
+                # Logged in again elsewhere, or the connection dropped for good
+                await self._drop(user_id)
+                entry = None
+            if entry is None:
+                client = new_login_client(session_string)
+                await client.connect()
+                entry = self._add(user_id, client, session_string)
+            self.clients.move_to_end(user_id)
+            entry['in_use'] += 1
+            entry['last_used'] = time.monotonic()
+        await self._evict()
+        return entry
+    
+    async def adopt(self, user_id: str, client: TelegramClient, session_string: str):
+        """Keep a client that just logged in instead of disconnecting it"""
+        if user_id in self.clients:
+            await self._drop(user_id)
+        self._add(user_id, client, session_string)
+        await self._evict()
+    
+    def _add(self, user_id: str, client: TelegramClient, session_string: str) -> dict:
+        entry = {'client': client, 'session': session_string, 'in_use': 0, 'last_used': time.monotonic(), 'retired': False}
+        self.clients[user_id] = entry
+        return entry
+    
+    async def _evict(self):
+        """Disconnect least recently used idle clients until within the limit"""
+        over = len(self.clients) - self.limit
+        for user_id in [uid for uid, e in self.clients.items() if e['in_use'] == 0][:max(over, 0)]:
+            await self._drop(user_id)
+    
+    async def _drop(self, user_id: str):
+        """Forget the user's client; one still borrowed is disconnected when its last borrower is done"""
+        entry = self.clients.pop(user_id, None)
+        lock = self.locks.get(user_id)
+        if lock and not lock.locked():
+            # A held lock stays so concurrent checkouts of this user keep queueing on it
+            del self.locks[user_id]
+        if entry:
+            if entry['in_use']:
+                entry['retired'] = True
+            else:
+                await self._disconnect(user_id, entry)
+    
+    @staticmethod
+    async def _disconnect(user_id: str, entry: dict):
+        try:
+            await entry['client'].disconnect()
+        except Exception as e:
+            logger.warning(f"Failed to disconnect Telegram client of user {user_id}: {str(e)}")
+    
+    async def discard(self, user_id: str):
+        """Forget the user's client, e.g. after they disconnect Telegram"""
+        await self._drop(user_id)
+    
+    async def sweep(self):
+        """Disconnect clients unused for longer than the idle timeout"""
+        cutoff = time.monotonic() - self.idle_timeout
+        for user_id in [uid for uid, e in self.clients.items() if e['in_use'] == 0 and e['last_used'] < cutoff]:
+            await self._drop(user_id)
+    
+    async def close(self):
+        for user_id in list(self.clients):
+            await self._drop(user_id)
+
+user_clients = UserClientManager(USER_CLIENT_LIMIT, USER_CLIENT_IDLE)
+
+
 # ========== TELEGRAM ROUTES ==========
 
 @api_router.post("/telegram/request-qr")
 async def request_qr_code(current_user: User = Depends(get_current_user)):
     """Generate QR code for Telegram login"""
+    client = None
     try:
-        # Create a temporary session
-        session_id = str(uuid.uuid4())
-        client = TelegramClient(
-            StringSession(),
-            int(os.environ.get('TELEGRAM_API_ID', '0')),
-            os.environ.get('TELEGRAM_API_HASH', '')
-        )
-        
-        await client.connect()
+        client = await login_client_pool.acquire()
         qr_login = await client.qr_login()
+        qr_image = await asyncio.to_thread(render_qr_png, qr_login.url)
         
-        # Generate QR code image
-        qr = qrcode.QRCode(version=1, box_size=10, border=5)
-        qr.add_data(qr_login.url)
-        qr.make(fit=True)
-        
-        img = qr.make_image(fill_color="black", back_color="white")
-        buffer = io.BytesIO()
-        img.save(buffer, format='PNG')
-        qr_image = base64.b64encode(buffer.getvalue()).decode()
-        
-        # Store client temporarily
-        telegram_clients[session_id] = {
-            'client': client,
-            'qr_login': qr_login,
-            'user_id': current_user.id
-        }
+        session_id = await login_sessions.start(
+            current_user.id, "qr", client, qr_login=qr_login, qr_expires_at=qr_login.expires
+        )
         
         return {
             "session_id": session_id,
@@ -314,97 +925,63 @@ async def request_qr_code(current_user: User = Depends(get_current_user)):
             "url": qr_login.url
         }
     except Exception as e:
+        if client:
+            await client.disconnect()
         logger.error(f"QR generation error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to generate QR code: {str(e)}")
 
 @api_router.post("/telegram/verify-qr")
-async def verify_qr_login(request: TelegramQRRequest, current_user: User = Depends(get_current_user)):
-    """Check if QR code was scanned and complete login"""
-    session_data = telegram_clients.get(request.session_id)
-    if not session_data:
+async def verify_qr_login(request: TelegramQRRequest, http_request: Request, current_user: User = Depends(get_current_user)):
+    """Wait up to request.wait seconds for the QR code to be scanned and return the login result"""
+    query = {"id": request.session_id, "user_id": current_user.id, "kind": "qr",
+             "expires_at": {"$gt": datetime.now(timezone.utc)}}
+    login = await db.telegram_logins.find_one(query, {"_id": 0})
+    if not login:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    try:
-        client = session_data['client']
-        qr_login = session_data['qr_login']
-        
-        # Wait for QR login
-        await qr_login.wait(timeout=5)
-        me = await client.get_me()
-        
-        # Save session
-        session_string = StringSession.save(client.session)
-        
-        # Create private channel
-        result = await client(CreateChannelRequest(
-            title='TeleStore Files',
-            about='Private storage for TeleStore',
-            megagroup=False
-        ))
-        
-        # Get the channel ID (Telegram uses -100 prefix for channel IDs)
-        channel = result.chats[0]
-        channel_id = -1000000000000 - channel.id  # Convert to proper channel ID format
+    if not any(login.get(key) for key in ("result", "expired", "error")):
+        entry = login_sessions.get(login['id'])
+        if not entry:
+            forwarded = await forward_login_request(login, "/telegram/verify-qr", request.model_dump(), http_request)
+            if forwarded:
+                return forwarded
+            # The watching process is gone; take the login over with a polling watcher
+            try:
+                entry = await login_sessions.restore(login)
+            except Exception as e:
+                logger.error(f"QR verification error: {str(e)}")
+                raise HTTPException(status_code=500, detail=str(e))
         
-        # Try to export invite link
-        invite_link = None
+        # Long-poll the watcher; shield it so a timed out request does not cancel it
         try:
-            invite_result = await client(ExportChatInviteRequest(
-                peer=channel,
-                legacy_revoke_permanent=False
-            ))
-            invite_link = invite_result.link
-        except Exception as e:
-            logger.warning(f"Failed to export invite link: {str(e)}")
-            # Continue without invite link
-        
-        # Update user
-        await db.users.update_one(
-            {"id": current_user.id},
-            {"$set": {
-                "telegram_session": session_string,
-                "telegram_user_id": me.id,
-                "telegram_channel_id": channel_id,
-                "telegram_channel_invite": invite_link
-            }}
-        )
-        
-        # Cleanup
-        await client.disconnect()
-        del telegram_clients[request.session_id]
-        
-        return {
-            "success": True,
-            "telegram_user_id": me.id,
-            "channel_id": channel_id,
-            "channel_invite": invite_link
-        }
-    except asyncio.TimeoutError:
-        return {"success": False, "message": "QR code not scanned yet"}
-    except Exception as e:
-        logger.error(f"QR verification error: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+            await asyncio.wait_for(asyncio.shield(entry['watcher']), timeout=request.wait)
+        except asyncio.TimeoutError:
+            return {"success": False, "message": "QR code not scanned yet"}
+        login = await db.telegram_logins.find_one(query, {"_id": 0}) or login
+    
+    if login.get('result'):
+        await login_sessions.close(login['id'])
+        return login['result']
+    if login.get('expired'):
+        await login_sessions.close(login['id'])
+        return {"success": False, "expired": True, "message": "QR code expired"}
+    if login.get('error'):
+        await login_sessions.close(login['id'])
+        raise HTTPException(status_code=500, detail=login['error'])
+    return {"success": False, "message": "QR code not scanned yet"}
 
 @api_router.post("/telegram/request-code")
 async def request_phone_code(request: TelegramLoginRequest, current_user: User = Depends(get_current_user)):
     """Request verification code for phone login"""
+    client = None
     try:
-        session_id = str(uuid.uuid4())
-        client = TelegramClient(
-            StringSession(),
-            int(os.environ.get('TELEGRAM_API_ID', '0')),
-            os.environ.get('TELEGRAM_API_HASH', '')
-        )
-        
-        await client.connect()
+        client = await login_client_pool.acquire()
         result = await client.send_code_request(request.phone)
         
-        telegram_clients[session_id] = {
-            'client': client,
-            'phone': request.phone,
-            'phone_code_hash': result.phone_code_hash,
-            'user_id': current_user.id
-        }
+        session_id = await login_sessions.start(
+            current_user.id, "phone", client,
+            phone=request.phone, phone_code_hash=result.phone_code_hash
+        )
         
         return {
             "session_id": session_id,
@@ -412,78 +989,39 @@ async def request_phone_code(request: TelegramLoginRequest, current_user: User =
             "message": "Code sent to your Telegram"
         }
     except Exception as e:
+        if client:
+            await client.disconnect()
         logger.error(f"Phone code request error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @api_router.post("/telegram/verify-code")
-async def verify_phone_code(request: TelegramCodeVerify, current_user: User = Depends(get_current_user)):
+async def verify_phone_code(request: TelegramCodeVerify, http_request: Request, current_user: User = Depends(get_current_user)):
     """Verify phone code and complete login"""
     # Find session by phone and phone_code_hash
-    session_data = None
-    session_id = None
-    for sid, data in telegram_clients.items():
-        if data.get('phone') == request.phone and data.get('phone_code_hash') == request.phone_code_hash:
-            session_data = data
-            session_id = sid
-            break
-    
-    if not session_data:
+    login = await db.telegram_logins.find_one(
+        {"user_id": current_user.id, "phone": request.phone, "phone_code_hash": request.phone_code_hash,
+         "expires_at": {"$gt": datetime.now(timezone.utc)}},
+        {"_id": 0}
+    )
+    if not login:
         raise HTTPException(status_code=404, detail="Session not found")
     
+    entry = login_sessions.get(login['id'])
+    if not entry:
+        forwarded = await forward_login_request(login, "/telegram/verify-code", request.model_dump(), http_request)
+        if forwarded:
+            return forwarded
+    
     try:
-        client = session_data['client']
+        if not entry:
+            # The code is bound to the auth key, which the stored session carries
+            entry = await login_sessions.restore(login)
         
         # Sign in with code
-        await client.sign_in(request.phone, request.code, phone_code_hash=request.phone_code_hash)
-        me = await client.get_me()
-        
-        # Save session
-        session_string = StringSession.save(client.session)
-        
-        # Create private channel
-        result = await client(CreateChannelRequest(
-            title='TeleStore Files',
-            about='Private storage for TeleStore',
-            megagroup=False
-        ))
-        
-        # Get the channel ID (Telegram uses -100 prefix for channel IDs)
-        channel = result.chats[0]
-        channel_id = -1000000000000 - channel.id  # Convert to proper channel ID format
-        
-        # Try to export invite link
-        invite_link = None
-        try:
-            invite_result = await client(ExportChatInviteRequest(
-                peer=channel,
-                legacy_revoke_permanent=False
-            ))
-            invite_link = invite_result.link
-        except Exception as e:
-            logger.warning(f"Failed to export invite link: {str(e)}")
-            # Continue without invite link
-        
-        # Update user
-        await db.users.update_one(
-            {"id": current_user.id},
-            {"$set": {
-                "telegram_session": session_string,
-                "telegram_user_id": me.id,
-                "telegram_channel_id": channel_id,
-                "telegram_channel_invite": invite_link
-            }}
-        )
-        
-        # Cleanup
-        await client.disconnect()
-        del telegram_clients[session_id]
-        
-        return {
-            "success": True,
-            "telegram_user_id": me.id,
-            "channel_id": channel_id,
-            "channel_invite": invite_link
-        }
+        await entry['client'].sign_in(request.phone, request.code, phone_code_hash=request.phone_code_hash)
+        result = await complete_telegram_login(entry['client'], current_user.id)
+        await login_sessions.close(login['id'], keep_client=True)
+        return result
     except Exception as e:
         logger.error(f"Code verification error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -500,6 +1038,7 @@ async def disconnect_telegram(current_user: User = Depends(get_current_user)):
             "telegram_channel_invite": None
         }}
     )
+    await user_clients.discard(current_user.id)
     return {"success": True}
 
 @api_router.post("/telegram/update-channel")
@@ -540,9 +1079,15 @@ async def update_bot_token(data: BotTokenUpdate, current_user: User = Depends(ge
     """Save Telegram bot token and add bot to channel"""
     try:
         # Verify bot token is valid
-        import requests
-        bot_response = requests.get(f"https://api.telegram.org/bot{data.bot_token}/getMe")
-        bot_data = bot_response.json()
+        try:
+            bot_response = await asyncio.to_thread(
+                telegram_http.get, f"https://api.telegram.org/bot{data.bot_token}/getMe", timeout=30
+            )
+            bot_data = bot_response.json()
+        except (requests.RequestException, ValueError) as e:
+            # The exception text can contain the URL, and with it the token
+            logger.error(f"Bot token check failed: {type(e).__name__}")
+            raise HTTPException(status_code=502, detail="Could not reach Telegram to check the bot token")
         
         if not bot_data.get('ok'):
             raise HTTPException(status_code=400, detail="Invalid bot token")
@@ -552,43 +1097,36 @@ async def update_bot_token(data: BotTokenUpdate, current_user: User = Depends(ge
         # If user has telegram session, add bot as admin to channel
         if current_user.telegram_session and current_user.telegram_channel_id:
             try:
-                client = TelegramClient(
-                    StringSession(current_user.telegram_session),
-                    int(os.environ.get('TELEGRAM_API_ID', '0')),
-                    os.environ.get('TELEGRAM_API_HASH', '')
-                )
-                await client.connect()
-                
                 # Add bot to channel as admin
+                from telethon.errors import RPCError
                 from telethon.tl.functions.channels import InviteToChannelRequest, EditAdminRequest
                 from telethon.tl.types import ChatAdminRights
                 
-                # Get bot user
-                bot_user = await client.get_entity(bot_username)
-                
-                # Invite bot to channel
-                try:
-                    await client(InviteToChannelRequest(
+                async with user_clients.session(current_user.id, current_user.telegram_session) as client:
+                    # Get bot user
+                    bot_user = await client.get_entity(bot_username)
+                    
+                    # Invite bot to channel
+                    try:
+                        await client(InviteToChannelRequest(
+                            current_user.telegram_channel_id,
+                            [bot_user]
+                        ))
+                    except RPCError as e:
+                        logger.info(f"Bot not invited to channel (might already be in it): {str(e)}")
+                    
+                    # Make bot admin
+                    rights = ChatAdminRights(
+                        post_messages=True,
+                        edit_messages=True,
+                        delete_messages=True,
+                    )
+                    await client(EditAdminRequest(
                         current_user.telegram_channel_id,
-                        [bot_user]
+                        bot_user,
+                        rights,
+                        "TeleStore Bot"
                     ))
-                except:
-                    pass  # Bot might already be in channel
-                
-                # Make bot admin
-                rights = ChatAdminRights(
-                    post_messages=True,
-                    edit_messages=True,
-                    delete_messages=True,
-                )
-                await client(EditAdminRequest(
-                    current_user.telegram_channel_id,
-                    bot_user,
-                    rights,
-                    "TeleStore Bot"
-                ))
-                
-                await client.disconnect()
             except Exception as e:
                 logger.error(f"Failed to add bot to channel: {str(e)}")
                 # Continue anyway, user can add manually
@@ -677,35 +1215,44 @@ async def create_file(file: FileCreate, current_user: User = Depends(get_current
     """Create file metadata after upload"""
     file_obj = FileMetadata(user_id=current_user.id, **file.model_dump())
     file_dict = file_obj.model_dump()
-    file_dict['created_at'] = file_dict['created_at'].isoformat()
     
     await db.files.insert_one(file_dict)
     return file_obj
 
 @api_router.get("/files", response_model=List[FileMetadata])
-async def list_files(folder_id: Optional[str] = None, current_user: User = Depends(get_current_user)):
-    """List files in folder or root"""
+async def list_files(
+    folder_id: Optional[str] = None,
+    view: Optional[str] = None,
+    fields: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """List files in folder or root
+    Pass view=grid or fields=name,size,... to get slim rows
+    Pass limit (and cursor) to paginate; the next cursor is returned in X-Next-Cursor
+    """
     query = {"user_id": current_user.id, "is_trashed": False}
     if folder_id:
         query["folder_id"] = folder_id
     else:
         query["folder_id"] = None
     
-    files = await db.files.find(query, {"_id": 0}).to_list(1000)
-    for f in files:
-        if isinstance(f['created_at'], str):
-            f['created_at'] = datetime.fromisoformat(f['created_at'])
-    return files
+    projection = resolve_projection(FileMetadata, view, fields, FILE_LIST_VIEWS) or model_projection(FileMetadata)
+    if limit is None and cursor is None:
+        return stream_rows_response(db.files.find(query, projection).sort(FILE_SORT).limit(FILE_PAGE_MAX))
+    
+    files, next_cursor = await fetch_file_page(query, projection, limit or FILE_PAGE_MAX, cursor)
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return FastJSONResponse(files, headers=headers)
 
 @api_router.get("/files/{file_id}", response_model=FileMetadata)
 async def get_file(file_id: str, current_user: User = Depends(get_current_user)):
     """Get file details"""
-    file = await db.files.find_one({"id": file_id, "user_id": current_user.id}, {"_id": 0})
+    file = await db.files.find_one({"id": file_id, "user_id": current_user.id}, model_projection(FileMetadata))
     if not file:
         raise HTTPException(status_code=404, detail="File not found")
-    if isinstance(file['created_at'], str):
-        file['created_at'] = datetime.fromisoformat(file['created_at'])
-    return FileMetadata(**file)
+    return FastJSONResponse(file)
 
 @api_router.put("/files/{file_id}")
 async def update_file(file_id: str, update: FileUpdate, current_user: User = Depends(get_current_user)):
@@ -727,19 +1274,18 @@ async def delete_file(file_id: str, permanent: bool = False, current_user: User
     """Delete file (move to trash or permanent)"""
     if permanent:
         # Get file info before deleting
-        file = await db.files.find_one({"id": file_id, "user_id": current_user.id})
+        file = await db.files.find_one({"id": file_id, "user_id": current_user.id}, PURGE_FILE_FIELDS)
         if not file:
             raise HTTPException(status_code=404, detail="File not found")
         
-        # Permanently delete file
-        await permanently_delete_file(file, current_user)
-        result = await db.files.delete_one({"id": file_id, "user_id": current_user.id})
-        if result.deleted_count == 0:
+        # Permanently delete file (the row goes even if Telegram refuses)
+        result = await purge_files(current_user, [file], keep_failed=False)
+        if result["deleted"] == 0:
             raise HTTPException(status_code=404, detail="File not found")
     else:
         result = await db.files.update_one(
             {"id": file_id, "user_id": current_user.id},
-            {"$set": {"is_trashed": True, "trashed_at": datetime.now(timezone.utc).isoformat()}}
+            {"$set": trash_fields(datetime.now(timezone.utc))}
         )
         if result.matched_count == 0:
             raise HTTPException(status_code=404, detail="File not found")
@@ -749,22 +1295,36 @@ async def delete_file(file_id: str, permanent: bool = False, current_user: User
 @api_router.post("/files/{file_id}/restore")
 async def restore_file(file_id: str, current_user: User = Depends(get_current_user)):
     """Restore file from trash"""
-    result = await db.files.update_one(
+    file = await db.files.find_one({"id": file_id, "user_id": current_user.id}, {"_id": 0, "folder_id": 1})
+    if not file:
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    update_data = dict(UNTRASH_FIELDS)
+    if file.get('folder_id'):
+        # Put the file back at root if its folder is gone or still in trash
+        folder = await db.folders.find_one(
+            {"id": file['folder_id'], "user_id": current_user.id, "is_trashed": {"$ne": True}},
+            {"_id": 0, "id": 1}
+        )
+        if not folder:
+            update_data["folder_id"] = None
+    
+    await db.files.update_one(
         {"id": file_id, "user_id": current_user.id},
-        {"$set": {"is_trashed": False, "trashed_at": None}}
+        {"$set": update_data, "$unset": {"trashed_by_folder": ""}}
     )
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="File not found")
     return {"success": True}
 
 @api_router.get("/files/trash/list", response_model=List[FileMetadata])
-async def list_trash(current_user: User = Depends(get_current_user)):
+async def list_trash(
+    view: Optional[str] = None,
+    fields: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
     """List trashed files"""
-    files = await db.files.find({"user_id": current_user.id, "is_trashed": True}, {"_id": 0}).to_list(1000)
-    for f in files:
-        if isinstance(f['created_at'], str):
-            f['created_at'] = datetime.fromisoformat(f['created_at'])
-    return files
+    query = {"user_id": current_user.id, "is_trashed": True}
+    projection = resolve_projection(FileMetadata, view, fields, FILE_LIST_VIEWS) or model_projection(FileMetadata)
+    return stream_rows_response(db.files.find(query, projection).limit(1000))
 
 @api_router.post("/files/{file_id}/share")
 async def share_file(file_id: str, current_user: User = Depends(get_current_user)):
@@ -792,12 +1352,10 @@ async def unshare_file(file_id: str, current_user: User = Depends(get_current_us
 @api_router.get("/share/{share_token}", response_model=FileMetadata)
 async def get_shared_file(share_token: str):
     """Get shared file by token"""
-    file = await db.files.find_one({"share_token": share_token, "is_public": True}, {"_id": 0})
+    file = await db.files.find_one({"share_token": share_token, "is_public": True}, model_projection(FileMetadata))
     if not file:
         raise HTTPException(status_code=404, detail="File not found")
-    if isinstance(file['created_at'], str):
-        file['created_at'] = datetime.fromisoformat(file['created_at'])
-    return FileMetadata(**file)
+    return FastJSONResponse(file)
 
 @api_router.get("/files/{file_id}/download-url")
 async def get_file_download_url(file_id: str, current_user: User = Depends(get_current_user)):
@@ -844,9 +1402,8 @@ async def get_file_download_url(file_id: str, current_user: User = Depends(get_c
     
     # For small files (<20MB), use direct Bot API
     try:
-        import requests
         # Get file info from Telegram
-        response = requests.get(
+        response = telegram_http.get(
             f"https://api.telegram.org/bot{current_user.telegram_bot_token}/getFile",
             params={"file_id": file.get('telegram_file_id', '')} if file.get('telegram_file_id') else {}
         )
@@ -921,10 +1478,9 @@ async def get_shared_file_download_url(share_token: str):
     
     # For small files (<20MB), use direct Bot API
     try:
-        import requests
         # Get file info from Telegram using telegram_file_id if available
         if file.get('telegram_file_id'):
-            response = requests.get(
+            response = telegram_http.get(
                 f"https://api.telegram.org/bot{user['telegram_bot_token']}/getFile",
                 params={"file_id": file['telegram_file_id']}
             )
@@ -959,7 +1515,7 @@ async def get_shared_collection(share_token: str):
     """Get shared collection with all files"""
     collection = await db.shared_collections.find_one(
         {"share_token": share_token}, 
-        {"_id": 0}
+        model_projection(SharedCollection)
     )
     if not collection:
         raise HTTPException(status_code=404, detail="Collection not found")
@@ -967,19 +1523,14 @@ async def get_shared_collection(share_token: str):
     # Get all files in the collection
     files = await db.files.find(
         {"id": {"$in": collection['file_ids']}, "is_public": True},
-        {"_id": 0}
+        model_projection(FileMetadata)
     ).to_list(None)
     
-    # Parse dates for serialization
-    for file in files:
-        if isinstance(file.get('created_at'), str):
-            file['created_at'] = datetime.fromisoformat(file['created_at'])
-    
-    return {
+    return FastJSONResponse({
         "collection": collection,
         "files": files,
         "file_count": len(files)
-    }
+    })
 
 @api_router.get("/share/collection/{share_token}/file/{file_id}/download-url")
 async def get_collection_file_download_url(share_token: str, file_id: str):
@@ -1044,9 +1595,8 @@ async def get_collection_file_download_url(share_token: str, file_id: str):
     
     # For small files (<20MB), use direct Bot API
     try:
-        import requests
         if file.get('telegram_file_id'):
-            response = requests.get(
+            response = telegram_http.get(
                 f"https://api.telegram.org/bot{user['telegram_bot_token']}/getFile",
                 params={"file_id": file['telegram_file_id']}
             )
@@ -1075,67 +1625,606 @@ async def get_collection_file_download_url(share_token: str, file_id: str):
 
 # ========== FOLDER ROUTES ==========
 
+async def get_folder_ancestors(parent_id: Optional[str], user_id: str) -> List[str]:
+    """Ancestor list for a folder placed under parent_id"""
+    if not parent_id:
+        return []
+    parent = await db.folders.find_one(
+        {"id": parent_id, "user_id": user_id, "is_trashed": {"$ne": True}},
+        {"_id": 0, "ancestors": 1}
+    )
+    if not parent:
+        raise HTTPException(status_code=404, detail="Parent folder not found")
+    return parent.get('ancestors', []) + [parent_id]
+
+async def rewrite_descendant_paths(user_id: str, folder_id: str, new_ancestors: List[str]):
+    """Rewrite the path prefix of every descendant in one batched update:
+    new ancestors + [folder_id] + whatever followed folder_id before
+    """
+    await db.folders.update_many(
+        {"user_id": user_id, "ancestors": folder_id},
+        [{"$set": {"ancestors": {"$concatArrays": [
+            new_ancestors,
+            {"$slice": [
+                "$ancestors",
+                {"$indexOfArray": ["$ancestors", folder_id]},
+                {"$size": "$ancestors"}
+            ]}
+        ]}}}]
+    )
+
 @api_router.post("/folders", response_model=Folder)
 async def create_folder(folder: FolderCreate, current_user: User = Depends(get_current_user)):
     """Create new folder"""
-    folder_obj = Folder(user_id=current_user.id, **folder.model_dump())
+    ancestors = await get_folder_ancestors(folder.parent_id, current_user.id)
+    folder_obj = Folder(user_id=current_user.id, ancestors=ancestors, **folder.model_dump())
     folder_dict = folder_obj.model_dump()
-    folder_dict['created_at'] = folder_dict['created_at'].isoformat()
     
     await db.folders.insert_one(folder_dict)
     return folder_obj
 
 @api_router.get("/folders", response_model=List[Folder])
-async def list_folders(parent_id: Optional[str] = None, current_user: User = Depends(get_current_user)):
+async def list_folders(
+    parent_id: Optional[str] = None,
+    fields: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
     """List folders"""
-    query = {"user_id": current_user.id}
+    query = {"user_id": current_user.id, "is_trashed": {"$ne": True}}
     if parent_id:
         query["parent_id"] = parent_id
     else:
         query["parent_id"] = None
     
-    folders = await db.folders.find(query, {"_id": 0}).to_list(1000)
-    for f in folders:
-        if isinstance(f['created_at'], str):
-            f['created_at'] = datetime.fromisoformat(f['created_at'])
-    return folders
+    projection = resolve_projection(Folder, fields=fields) or model_projection(Folder)
+    return stream_rows_response(db.folders.find(query, projection).limit(1000))
+
+@api_router.get("/folders/view")
+async def get_folder_view(
+    folder_id: Optional[str] = None,
+    view: Optional[str] = None,
+    fields: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Folder contents in one round trip: child folders with item counts and sizes, plus a page of files
+    Uses the same limit/cursor pagination as GET /files (cursor pages files only)
+    """
+    parent_id = folder_id or None
+    
+    # Child folders with direct file count/size and subfolder count, in one aggregation
+    folders_pipeline = [
+        {"$match": {"user_id": current_user.id, "parent_id": parent_id, "is_trashed": {"$ne": True}}},
+        {"$lookup": {
+            "from": "files",
+            "localField": "id",
+            "foreignField": "folder_id",
+            "pipeline": [
+                {"$match": {"user_id": current_user.id, "is_trashed": False}},
+                {"$group": {"_id": None, "count": {"$sum": 1}, "size": {"$sum": "$size"}}}
+            ],
+            "as": "file_stats"
+        }},
+        {"$lookup": {
+            "from": "folders",
+            "localField": "id",
+            "foreignField": "parent_id",
+            "pipeline": [
+                {"$match": {"user_id": current_user.id, "is_trashed": {"$ne": True}}},
+                {"$count": "count"}
+            ],
+            "as": "folder_stats"
+        }},
+        {"$project": {
+            "_id": 0,
+            "id": 1,
+            "user_id": 1,
+            "name": 1,
+            "parent_id": 1,
+            "created_at": 1,
+            "file_count": {"$ifNull": [{"$first": "$file_stats.count"}, 0]},
+            "folder_count": {"$ifNull": [{"$first": "$folder_stats.count"}, 0]},
+            "total_size": {"$ifNull": [{"$first": "$file_stats.size"}, 0]}
+        }},
+        {"$addFields": {"item_count": {"$add": ["$file_count", "$folder_count"]}}},
+        {"$limit": 1000}
+    ]
+    
+    files_query = {"user_id": current_user.id, "is_trashed": False, "folder_id": parent_id}
+    projection = resolve_projection(FileMetadata, view, fields, FILE_LIST_VIEWS) or model_projection(FileMetadata)
+    
+    folders, (files, next_cursor) = await asyncio.gather(
+        db.folders.aggregate(folders_pipeline).to_list(1000),
+        fetch_file_page(files_query, projection, limit or FILE_PAGE_MAX, cursor)
+    )
+    
+    return FastJSONResponse({
+        "folder_id": parent_id,
+        "folders": folders,
+        "files": files,
+        "next_cursor": next_cursor
+    })
+
+@api_router.get("/folders/{folder_id}/breadcrumbs")
+async def get_folder_breadcrumbs(folder_id: str, current_user: User = Depends(get_current_user)):
+    """Path from root to this folder, resolved from the stored ancestors in one aggregation"""
+    result = await db.folders.aggregate([
+        {"$match": {"id": folder_id, "user_id": current_user.id}},
+        {"$lookup": {
+            "from": "folders",
+            "localField": "ancestors",
+            "foreignField": "id",
+            "as": "chain"
+        }},
+        {"$project": {"_id": 0, "id": 1, "name": 1, "ancestors": 1, "chain.id": 1, "chain.name": 1}}
+    ]).to_list(1)
+    if not result:
+        raise HTTPException(status_code=404, detail="Folder not found")
+    
+    folder = result[0]
+    names = {f['id']: f['name'] for f in folder['chain']}
+    breadcrumbs = [{"id": fid, "name": names[fid]} for fid in folder.get('ancestors', []) if fid in names]
+    breadcrumbs.append({"id": folder['id'], "name": folder['name']})
+    return breadcrumbs
+
+@api_router.get("/folders/{folder_id}/subtree", response_model=List[Folder])
+async def list_folder_subtree(folder_id: str, fields: Optional[str] = None, current_user: User = Depends(get_current_user)):
+    """All folders below this one, at any depth"""
+    projection = resolve_projection(Folder, fields=fields) or model_projection(Folder)
+    return stream_rows_response(db.folders.find(
+        {"user_id": current_user.id, "ancestors": folder_id, "is_trashed": {"$ne": True}},
+        projection
+    ))
 
 @api_router.put("/folders/{folder_id}")
-async def update_folder(folder_id: str, update: FolderCreate, current_user: User = Depends(get_current_user)):
-    """Update folder (rename)"""
-    result = await db.folders.update_one(
-        {"id": folder_id, "user_id": current_user.id},
-        {"$set": {"name": update.name}}
-    )
-    if result.matched_count == 0:
+async def update_folder(folder_id: str, update: FolderUpdate, current_user: User = Depends(get_current_user)):
+    """Update folder (rename, move)"""
+    folder = await db.folders.find_one({"id": folder_id, "user_id": current_user.id}, {"_id": 0})
+    if not folder:
         raise HTTPException(status_code=404, detail="Folder not found")
+    
+    update_data = {}
+    if update.name is not None:
+        update_data["name"] = update.name
+    
+    moving = "parent_id" in update.model_fields_set and update.parent_id != folder.get('parent_id')
+    if moving:
+        ancestors = await get_folder_ancestors(update.parent_id, current_user.id)
+        if update.parent_id == folder_id or folder_id in ancestors:
+            raise HTTPException(status_code=400, detail="Cannot move a folder into itself")
+        update_data["parent_id"] = update.parent_id
+        update_data["ancestors"] = ancestors
+    
+    if update_data:
+        await db.folders.update_one({"id": folder_id, "user_id": current_user.id}, {"$set": update_data})
+    
+    if moving:
+        await rewrite_descendant_paths(current_user.id, folder_id, update_data["ancestors"])
+    
     return {"success": True}
 
 @api_router.delete("/folders/{folder_id}")
 async def delete_folder(folder_id: str, current_user: User = Depends(get_current_user)):
-    """Delete folder and its contents"""
-    # Delete folder
-    result = await db.folders.delete_one({"id": folder_id, "user_id": current_user.id})
-    if result.deleted_count == 0:
+    """Move folder and everything below it to trash
+    The folder disappears immediately; descendants are trashed by a background operation
+    """
+    now = datetime.now(timezone.utc)
+    result = await db.folders.update_one(
+        {"id": folder_id, "user_id": current_user.id, "is_trashed": {"$ne": True}},
+        {"$set": {**trash_fields(now), "trashed_by_folder": folder_id}}
+    )
+    if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Folder not found")
     
-    # Move files to trash
-    await db.files.update_many(
-        {"user_id": current_user.id, "folder_id": folder_id},
-        {"$set": {"is_trashed": True, "folder_id": None}}
+    operation, job = await start_folder_operation(current_user.id, folder_id, "delete")
+    return {"success": True, "operation_id": operation.id, "job_id": job.id}
+
+@api_router.post("/folders/{folder_id}/restore")
+async def restore_folder(folder_id: str, current_user: User = Depends(get_current_user)):
+    """Restore a trashed folder and everything that was trashed with it"""
+    folder = await db.folders.find_one(
+        {"id": folder_id, "user_id": current_user.id, "trashed_by_folder": folder_id},
+        {"_id": 0}
     )
+    if not folder:
+        raise HTTPException(status_code=404, detail="Folder not found in trash")
     
-    return {"success": True}
-
-
-# ========== WORKER WEBHOOK ==========
-
-@api_router.post("/webhook/upload")
-async def worker_upload_webhook(data: dict):
-    """Receive upload confirmation from worker"""
-    # This endpoint will be called by the worker after successful upload
-    logger.info(f"Upload webhook received: {data}")
-    return {"success": True}
+    update_data = dict(UNTRASH_FIELDS)
+    if folder.get('parent_id'):
+        # Fall back to root if the original parent is gone or still in trash
+        parent = await db.folders.find_one(
+            {"id": folder['parent_id'], "user_id": current_user.id, "is_trashed": {"$ne": True}},
+            {"_id": 0, "id": 1}
+        )
+        if not parent:
+            update_data["parent_id"] = None
+            update_data["ancestors"] = []
+    
+    await db.folders.update_one(
+        {"id": folder_id, "user_id": current_user.id},
+        {"$set": update_data, "$unset": {"trashed_by_folder": ""}}
+    )
+    if "ancestors" in update_data:
+        await rewrite_descendant_paths(current_user.id, folder_id, [])
+    
+    operation, job = await start_folder_operation(current_user.id, folder_id, "restore")
+    return {"success": True, "operation_id": operation.id, "job_id": job.id}
+
+@api_router.get("/folders/trash/list", response_model=List[Folder])
+async def list_trashed_folders(current_user: User = Depends(get_current_user)):
+    """List folders that were deleted directly (not the subfolders trashed along with them)"""
+    query = {"user_id": current_user.id, "is_trashed": True, "$expr": {"$eq": ["$trashed_by_folder", "$id"]}}
+    return stream_rows_response(db.folders.find(query, model_projection(Folder)).limit(1000))
+
+@api_router.get("/folders/operations/{operation_id}")
+async def get_folder_operation(operation_id: str, current_user: User = Depends(get_current_user)):
+    """Progress of a background folder delete/restore"""
+    operation = await db.folder_operations.find_one({"id": operation_id, "user_id": current_user.id}, {"_id": 0})
+    if not operation:
+        raise HTTPException(status_code=404, detail="Operation not found")
+    return FastJSONResponse(operation)
+
+
+# ========== FOLDER TREE OPERATIONS ==========
+
+FOLDER_TREE_BATCH_SIZE = 500
+
+async def start_folder_operation(user_id: str, folder_id: str, action: str) -> tuple:
+    """Record a folder operation and queue it; returns (operation, job)"""
+    operation = FolderOperation(user_id=user_id, folder_id=folder_id, action=action)
+    await db.folder_operations.insert_one(operation.model_dump())
+    job = await enqueue_job(user_id, "folder_operation", {"operation_id": operation.id}, priority=JOB_PRIORITY_HIGH)
+    return operation, job
+
+async def run_folder_operation(operation: FolderOperation):
+    """Trash or restore the subtree below operation.folder_id in batches of folder ids
+    The subtree is selected through the stored ancestors, so a retry after a partial run
+    finds every folder that still needs work and picks up where the last attempt stopped
+    """
+    async def set_status(state: str, **extra):
+        await db.folder_operations.update_one(
+            {"id": operation.id},
+            {"$set": {"status": state, "updated_at": datetime.now(timezone.utc), **extra}}
+        )
+    
+    try:
+        # Counters restart with each attempt so retries do not count twice
+        await set_status("running", folders_processed=0, files_processed=0)
+        user_id = operation.user_id
+        root_id = operation.folder_id
+        now = datetime.now(timezone.utc)
+        
+        if operation.action == "delete":
+            trash_set = {**trash_fields(now), "trashed_by_folder": root_id}
+            subtree_filter = {"ancestors": root_id}
+            file_filter = {"is_trashed": False}
+            folder_filter = {"is_trashed": {"$ne": True}}
+            file_update = {"$set": trash_set}
+            folder_update = {"$set": trash_set}
+        else:
+            # Only bring back what this folder's delete trashed
+            subtree_filter = {"ancestors": root_id, "trashed_by_folder": root_id}
+            file_filter = {"trashed_by_folder": root_id}
+            folder_filter = {"trashed_by_folder": root_id}
+            restore_update = {"$set": UNTRASH_FIELDS, "$unset": {"trashed_by_folder": ""}}
+            file_update = restore_update
+            folder_update = restore_update
+        
+        folders_processed = 0
+        files_processed = 0
+        batch = [root_id]  # The root folder itself was handled by the endpoint; its files were not
+        last_id = None
+        while batch:
+            # Files first: a restored folder drops out of subtree_filter, so its files must be done before it
+            files_result = await db.files.update_many(
+                {"user_id": user_id, "folder_id": {"$in": batch}, **file_filter},
+                file_update
+            )
+            folder_ids = [fid for fid in batch if fid != root_id]
+            if folder_ids:
+                await db.folders.update_many({"user_id": user_id, "id": {"$in": folder_ids}, **folder_filter}, folder_update)
+            
+            folders_processed += len(batch)
+            files_processed += files_result.modified_count
+            await set_status("running", folders_processed=folders_processed, files_processed=files_processed)
+            
+            page_filter = {"user_id": user_id, **subtree_filter}
+            if last_id is not None:
+                page_filter["id"] = {"$gt": last_id}
+            rows = await db.folders.find(page_filter, {"_id": 0, "id": 1}).sort("id", 1).limit(FOLDER_TREE_BATCH_SIZE).to_list(None)
+            batch = [row['id'] for row in rows]
+            if batch:
+                last_id = batch[-1]
+        
+        await set_status("completed")
+        logger.info(f"Folder {operation.action} {root_id} completed")
+    except Exception as e:
+        logger.error(f"Folder {operation.action} error for {operation.folder_id}: {str(e)}")
+        await set_status("failed", error=str(e))
+        raise  # Let the job queue retry; the subtree query finds the remaining work again
+
+
+# ========== WORKER WEBHOOK ==========
+
+@api_router.post("/webhook/upload")
+async def worker_upload_webhook(data: dict):
+    """Receive upload confirmation from worker"""
+    # This endpoint will be called by the worker after successful upload
+    logger.info(f"Upload webhook received: {data}")
+    return {"success": True}
+
+
+# ========== FACE MATCHING ==========
+
+# Multi-tier matching thresholds for better accuracy with accessories
+# Primary threshold: strict matching for clear cases
+FACE_PRIMARY_THRESHOLD = 0.5
+# Secondary threshold: more lenient for accessories like glasses
+FACE_SECONDARY_THRESHOLD = 0.58
+FACE_MATRIX_CACHE_USERS = 100
+FACE_BATCH_MAX_DETECTIONS = 5000
+
+# Index backend: 'exact' (brute force), 'ivf' (approximate), or 'auto' (ivf above FACE_IVF_MIN_FACES)
+FACE_INDEX_BACKEND = os.environ.get('FACE_INDEX_BACKEND', 'auto')
+FACE_IVF_MIN_FACES = int(os.environ.get('FACE_IVF_MIN_FACES', '20000'))
+FACE_IVF_NPROBE = int(os.environ.get('FACE_IVF_NPROBE', '8'))
+FACE_INDEX_DIR = Path(os.environ.get('FACE_INDEX_DIR', str(ROOT_DIR / 'face_index_data')))
+
+# user_id -> FaceMatrix/IVFFaceIndex, least recently used first
+face_matrices: "OrderedDict[str, FaceMatrix]" = OrderedDict()
+face_matrix_locks: dict = {}  # user_id -> load lock, only kept for cached or loading users
+
+async def get_faces_version(user_id: str) -> int:
+    user = await db.users.find_one({"id": user_id}, {"_id": 0, "faces_version": 1})
+    return (user or {}).get('faces_version', 0)
+
+FACE_IVF_MIN_TRAIN = 1000  # Below this an IVF index stays untrained and searches exactly
+
+def use_ivf_index(face_count: int) -> bool:
+    if FACE_INDEX_BACKEND == 'ivf':
+        return True
+    return FACE_INDEX_BACKEND == 'auto' and face_count >= FACE_IVF_MIN_FACES
+
+def index_outgrown(index: FaceMatrix) -> bool:
+    """Exact (or untrained IVF) index that has grown enough to be rebuilt as a trained IVF index"""
+    if isinstance(index, IVFFaceIndex) and index.centroids is not None:
+        return False
+    return use_ivf_index(index.live) and index.live >= FACE_IVF_MIN_TRAIN
+
+async def load_face_index(user_id: str, version: int) -> FaceMatrix:
+    """Build a user's face index, reusing the on-disk IVF index or its centroids when possible"""
+    index_dir = FACE_INDEX_DIR / user_id
+    if FACE_INDEX_BACKEND != 'exact' and index_dir.exists():
+        saved = await asyncio.to_thread(IVFFaceIndex.load, index_dir)
+        if saved and saved.version == version:
+            saved.nprobe = FACE_IVF_NPROBE
+            return saved
+
+    face_ids, person_ids, descriptors = [], [], []
+    async for face in db.faces.find(
+        {"user_id": user_id, "person_id": {"$ne": None}},
+        {"_id": 0, "id": 1, "person_id": 1, "descriptor": 1}
+    ):
+        face_ids.append(face['id'])
+        person_ids.append(face['person_id'])
+        descriptors.append(face['descriptor'])
+    descriptors = stack_descriptors(descriptors)
+
+    if not use_ivf_index(len(face_ids)):
+        return FaceMatrix.from_rows(version, face_ids, person_ids, descriptors)
+
+    if len(face_ids) < FACE_IVF_MIN_TRAIN:
+        index = IVFFaceIndex(version, FACE_IVF_NPROBE)
+        index.add_many(face_ids, person_ids, descriptors)
+        return index
+    
+    # Training and disk writes are CPU/IO heavy, keep them off the event loop
+    centroids = await asyncio.to_thread(IVFFaceIndex.load_centroids, index_dir)
+    index = await asyncio.to_thread(
+        IVFFaceIndex.build, version, face_ids, person_ids, descriptors,
+        centroids=centroids, nprobe=FACE_IVF_NPROBE
+    )
+    await asyncio.to_thread(index.save, index_dir)
+    return index
+
+async def get_face_matrix(user_id: str) -> FaceMatrix:
+    """Cached face index for a user, reloaded when faces_version moved on (e.g. in another process)"""
+    version = await get_faces_version(user_id)
+    cached = face_matrices.get(user_id)
+    if cached and cached.version == version and not index_outgrown(cached):
+        face_matrices.move_to_end(user_id)
+        return cached
+
+    lock = face_matrix_locks.setdefault(user_id, asyncio.Lock())
+    async with lock:
+        cached = face_matrices.get(user_id)
+        if cached and cached.version == version and not index_outgrown(cached):
+            return cached
+
+        try:
+            matrix = await load_face_index(user_id, version)
+        except Exception:
+            drop_face_matrix_lock(user_id, lock)
+            raise
+        face_matrices[user_id] = matrix
+        face_matrices.move_to_end(user_id)
+        while len(face_matrices) > FACE_MATRIX_CACHE_USERS:
+            evicted_user_id, evicted = face_matrices.popitem(last=False)
+            drop_face_matrix_lock(evicted_user_id)
+            await save_face_index(evicted_user_id, evicted)
+        return matrix
+
+def drop_face_matrix_lock(user_id: str, holder: Optional[asyncio.Lock] = None):
+    """Forget a user's load lock along with their cache entry, unless a load is using it
+    (holder is the lock the caller itself holds). Worst case a later load runs twice
+    """
+    lock = face_matrix_locks.get(user_id)
+    if lock and (lock is holder or not lock.locked()):
+        del face_matrix_locks[user_id]
+
+async def update_face_matrix(user_id: str, change=None):
+    """Bump faces_version and apply change(index) to the cached index if it was current,
+    otherwise (or with no change, for bulk rewrites) drop it so the next match reloads
+    """
+    user = await db.users.find_one_and_update(
+        {"id": user_id},
+        {"$inc": {"faces_version": 1}},
+        projection={"faces_version": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    version = (user or {}).get('faces_version', 0)
+    cached = face_matrices.get(user_id)
+    if change and cached and cached.version == version - 1:
+        change(cached)
+        cached.version = version
+    else:
+        face_matrices.pop(user_id, None)
+        drop_face_matrix_lock(user_id)
+
+async def save_face_index(user_id: str, index: FaceMatrix):
+    """Persist an approximate index that changed since it was built or loaded"""
+    if isinstance(index, IVFFaceIndex) and index.dirty:
+        try:
+            await asyncio.to_thread(index.save, FACE_INDEX_DIR / user_id)
+        except Exception as e:
+            logger.error(f"Failed to save face index for {user_id}: {str(e)}")
+
+
+# ========== PERSON MEMBERSHIP ==========
+# db.person_files holds one document per (person_id, file_id) with the number of that
+# person's faces in the file and the file's created_at (file_created_at), so person
+# galleries page through an index instead of faces. people.photo_count is the number of memberships a person
+# has and is moved with $inc as memberships appear and disappear, instead of being
+# recounted from faces. reconcile_person_files rebuilds both from faces to repair drift.
+
+async def bump_photo_counts(deltas: Counter, touched: List[str] = ()):
+    """$inc photo_count by the given per-person deltas (touched people only get updated_at)"""
+    now = datetime.now(timezone.utc)
+    ops = [
+        UpdateOne({"id": person_id}, {"$inc": {"photo_count": deltas.get(person_id, 0)}, "$set": {"updated_at": now}})
+        for person_id in dict.fromkeys(list(deltas) + list(touched))
+    ]
+    if ops:
+        await db.people.bulk_write(ops, ordered=False)
+
+
+async def add_person_files(user_id: str, pairs: Counter, file_dates: dict):
+    """Add face counts to (person_id, file_id) memberships, creating missing ones
+    file_dates maps file_id to the file's created_at; only memberships created by the
+    upsert count as new photos for the person
+    """
+    keys = list(pairs)
+    if not keys:
+        return
+    result = await db.person_files.bulk_write([
+        UpdateOne(
+            {"person_id": person_id, "file_id": file_id},
+            {
+                "$inc": {"face_count": pairs[(person_id, file_id)]},
+                "$setOnInsert": {"user_id": user_id, "file_created_at": file_dates.get(file_id)}
+            },
+            upsert=True
+        )
+        for person_id, file_id in keys
+    ], ordered=False)
+    added = Counter(keys[i][0] for i in result.upserted_ids)
+    await bump_photo_counts(added, [person_id for person_id, _ in keys])
+
+
+async def move_person_files(user_id: str, from_person_ids: List[str], to_person_id: str):
+    """Fold the memberships of merged people into the target person"""
+    cursor = db.person_files.find(
+        {"person_id": {"$in": from_person_ids}, "user_id": user_id},
+        {"_id": 0, "file_id": 1, "face_count": 1, "file_created_at": 1}
+    )
+    moved = Counter()
+    file_dates = {}
+    async for member in cursor:
+        moved[(to_person_id, member['file_id'])] += member.get('face_count', 1)
+        file_dates[member['file_id']] = member.get('file_created_at')
+        if len(moved) >= MIGRATION_BATCH_SIZE:
+            await add_person_files(user_id, moved, file_dates)
+            moved = Counter()
+            file_dates = {}
+    await add_person_files(user_id, moved, file_dates)
+    await db.person_files.delete_many({"person_id": {"$in": from_person_ids}, "user_id": user_id})
+
+
+async def remove_file_memberships(user_id: str, file_ids: List[str]):
+    """Drop deleted files from every person they appear in"""
+    members = await db.person_files.find(
+        {"file_id": {"$in": file_ids}, "user_id": user_id}, {"_id": 0, "person_id": 1}
+    ).to_list(None)
+    if not members:
+        return
+    result = await db.person_files.delete_many({"file_id": {"$in": file_ids}, "user_id": user_id})
+    if result.deleted_count == len(members):
+        removed = Counter(member['person_id'] for member in members)
+        await bump_photo_counts(Counter({person_id: -n for person_id, n in removed.items()}))
+    else:
+        # Memberships changed underneath us; recount from faces rather than guess
+        await reconcile_person_files(user_id)
+
+
+async def reconcile_person_files(user_id: str) -> int:
+    """Rebuild a user's memberships and photo counts from their faces
+    Returns how many people had a wrong photo_count
+    """
+    actual = {}
+    async for row in db.faces.aggregate([
+        {"$match": {"user_id": user_id, "person_id": {"$ne": None}}},
+        {"$group": {"_id": {"person_id": "$person_id", "file_id": "$file_id"}, "face_count": {"$sum": 1}}}
+    ], allowDiskUse=True):
+        actual[(row['_id']['person_id'], row['_id']['file_id'])] = row['face_count']
+    
+    files = await db.files.find({"user_id": user_id}, {"_id": 0, "id": 1, "created_at": 1}).to_list(None)
+    file_dates = {f['id']: f.get('created_at') for f in files}
+    
+    stored = {}
+    async for member in db.person_files.find(
+        {"user_id": user_id}, {"_id": 0, "person_id": 1, "file_id": 1, "face_count": 1, "file_created_at": 1}
+    ):
+        stored[(member['person_id'], member['file_id'])] = (member.get('face_count'), member.get('file_created_at'))
+    
+    ops = [
+        UpdateOne(
+            {"person_id": person_id, "file_id": file_id},
+            {"$set": {"face_count": count, "file_created_at": file_dates.get(file_id)}, "$setOnInsert": {"user_id": user_id}},
+            upsert=True
+        )
+        for (person_id, file_id), count in actual.items()
+        if stored.get((person_id, file_id)) != (count, file_dates.get(file_id))
+    ]
+    ops += [
+        DeleteOne({"person_id": person_id, "file_id": file_id})
+        for person_id, file_id in stored if (person_id, file_id) not in actual
+    ]
+    for i in range(0, len(ops), MIGRATION_BATCH_SIZE):
+        await db.person_files.bulk_write(ops[i:i + MIGRATION_BATCH_SIZE], ordered=False)
+        await asyncio.sleep(0)
+    
+    counts = Counter(person_id for person_id, _ in actual)
+    people = await db.people.find({"user_id": user_id}, {"_id": 0, "id": 1, "photo_count": 1}).to_list(None)
+    fixes = [
+        UpdateOne({"id": person['id']}, {"$set": {"photo_count": counts.get(person['id'], 0)}})
+        for person in people if person.get('photo_count') != counts.get(person['id'], 0)
+    ]
+    if fixes:
+        await db.people.bulk_write(fixes, ordered=False)
+    return len(fixes)
+
+
+async def reconcile_all_person_files():
+    """Background job repairing membership/photo count drift for every user with people"""
+    try:
+        user_ids = await db.people.distinct("user_id")
+        repaired = 0
+        for user_id in user_ids:
+            repaired += await reconcile_person_files(user_id)
+        logger.info(f"Person count reconciliation: {len(user_ids)} users, {repaired} people repaired")
+    except Exception as e:
+        logger.error(f"Person count reconciliation error: {str(e)}")
 
 
 # ========== FACE RECOGNITION ROUTES ==========
@@ -1144,175 +2233,195 @@ async def worker_upload_webhook(data: dict):
 async def store_face_data(face_data: FaceDataCreate, current_user: User = Depends(get_current_user)):
     """Store face detection data for a file and auto-group into people"""
     try:
-        # Verify the file belongs to the user
-        file = await db.files.find_one({"id": face_data.file_id, "user_id": current_user.id})
-        if not file:
-            raise HTTPException(status_code=404, detail="File not found")
-        
         logger.info(f"Processing {len(face_data.detections)} face(s) for file {face_data.file_id}")
-        
-        # Store each detected face and track which people got new photos
-        stored_faces = []
-        people_with_new_photos = set()
-        
-        for detection in face_data.detections:
-            # Find matching person by comparing descriptors
-            person_id, is_new_person = await find_or_create_person(
-                current_user.id,
-                detection.descriptor,
-                file.get('thumbnail_url'),
-                face_data.file_id
-            )
-            
-            # Track people who got a face in this file
-            people_with_new_photos.add(person_id)
-            
-            face = FaceData(
-                file_id=face_data.file_id,
-                user_id=current_user.id,
-                person_id=person_id,
-                descriptor=detection.descriptor,
-                box=detection.box,
-                confidence=detection.confidence
-            )
-            
-            face_dict = face.model_dump()
-            face_dict['created_at'] = face_dict['created_at'].isoformat()
-            await db.faces.insert_one(face_dict)
-            stored_faces.append(face.id)
-        
-        # Update photo counts only once per person per file
-        # Count unique files for each person
-        for person_id in people_with_new_photos:
-            unique_files = await db.faces.aggregate([
-                {"$match": {"person_id": person_id, "user_id": current_user.id}},
-                {"$group": {"_id": "$file_id"}},
-                {"$count": "total"}
-            ]).to_list(1)
-            
-            photo_count = unique_files[0]['total'] if unique_files else 0
-            await db.people.update_one(
-                {"id": person_id},
-                {"$set": {
-                    "photo_count": photo_count,
-                    "updated_at": datetime.now(timezone.utc).isoformat()
-                }}
-            )
-        
-        return {"success": True, "face_ids": stored_faces}
+        result = await ingest_faces(current_user.id, [face_data])
+        if result["missing_file_ids"]:
+            raise HTTPException(status_code=404, detail="File not found")
+        return {"success": True, "face_ids": result["face_ids"]}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Face storage error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
-async def find_or_create_person(user_id: str, descriptor: List[float], sample_photo_url: Optional[str], file_id: str) -> tuple[str, bool]:
-    """Find existing person by face similarity or create new person
-    Handles variations like glasses, lighting, angles
-    Returns: (person_id, is_new_person)
+@api_router.post("/faces/batch")
+async def store_face_data_batch(batch: FaceBatchCreate, current_user: User = Depends(get_current_user)):
+    """Store face detections for many files at once (initial library indexing)"""
+    detection_count = sum(len(item.detections) for item in batch.items)
+    if detection_count > FACE_BATCH_MAX_DETECTIONS:
+        raise HTTPException(status_code=400, detail=f"Too many detections in one batch (max {FACE_BATCH_MAX_DETECTIONS})")
+    
+    try:
+        logger.info(f"Processing {detection_count} face(s) across {len(batch.items)} file(s)")
+        result = await ingest_faces(current_user.id, batch.items)
+        return {"success": True, **result}
+    except Exception as e:
+        logger.error(f"Batch face storage error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@api_router.post("/faces/search")
+async def search_similar_faces(
+    request: FaceSearchRequest,
+    view: Optional[str] = None,
+    fields: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Nearest stored faces to a face or descriptor, with the files they appear in
+    Searches the in-memory face index; faces not assigned to a person are not indexed
     """
-    import numpy as np
+    if (request.face_id is None) == (request.descriptor is None):
+        raise HTTPException(status_code=400, detail="Provide exactly one of face_id or descriptor")
     
-    # Get all existing people for this user
-    people = await db.people.find({"user_id": user_id}).to_list(1000)
+    matrix = await get_face_matrix(current_user.id)
+    if request.face_id:
+        row = matrix.face_rows.get(request.face_id)
+        if row is not None:
+            query = matrix.vectors(np.array([row]))[0]
+        else:
+            face = await db.faces.find_one({"id": request.face_id, "user_id": current_user.id}, {"_id": 0, "descriptor": 1})
+            if not face:
+                raise HTTPException(status_code=404, detail="Face not found")
+            query = unpack_descriptor(face['descriptor'])
+    else:
+        query = unpack_descriptor(request.descriptor)
     
-    # Multi-tier matching thresholds for better accuracy with accessories
-    # Primary threshold: strict matching for clear cases
-    primary_threshold = 0.5
-    # Secondary threshold: more lenient for accessories like glasses
-    secondary_threshold = 0.58
+    hits = matrix.search(query, request.k, exclude_face_id=request.face_id)
+    if request.max_distance is not None:
+        hits = [hit for hit in hits if hit[2] <= request.max_distance]
+    if not hits:
+        return {"results": []}
     
-    new_descriptor = np.array(descriptor)
+    faces = await db.faces.find(
+        {"id": {"$in": [hit[0] for hit in hits]}, "user_id": current_user.id},
+        {"_id": 0, "id": 1, "file_id": 1, "box": 1}
+    ).to_list(None)
+    faces_by_id = {f['id']: f for f in faces}
+    projection = resolve_projection(FileMetadata, view, fields, FILE_LIST_VIEWS) or model_projection(FileMetadata)
+    files = await db.files.find(
+        {"id": {"$in": list({f['file_id'] for f in faces})}, "user_id": current_user.id, "is_trashed": False},
+        projection
+    ).to_list(None)
+    files_by_id = {f['id']: f for f in files}
     
-    logger.info(f"Comparing face against {len(people)} existing people")
+    results = []
+    for face_id, person_id, distance in hits:
+        face = faces_by_id.get(face_id)
+        if not face or face['file_id'] not in files_by_id:
+            continue
+        results.append({
+            "face_id": face_id,
+            "person_id": person_id,
+            "distance": distance,
+            "box": face.get('box'),
+            "file": files_by_id[face['file_id']]
+        })
+    return FastJSONResponse({"results": results})
+
+
+def is_face_match(match: Optional[tuple]) -> bool:
+    """Tiered threshold check on a (person_id, distance, match_quality) result"""
+    if not match:
+        return False
+    _, distance, quality = match
+    # Primary threshold: strict matching
+    if distance < FACE_PRIMARY_THRESHOLD:
+        return True
+    # Secondary threshold: for cases with accessories (glasses, etc)
+    return distance < FACE_SECONDARY_THRESHOLD and quality in ["high_confidence", "medium_confidence"]
+
+
+async def assign_people(user_id: str, descriptors: np.ndarray, sample_files: List[tuple]) -> tuple:
+    """Person id for every descriptor, plus how many people were created: existing people are matched in one vectorized pass,
+    and faces that match nobody are clustered among themselves into new people
+    sample_files holds (file_id, thumbnail_url) per descriptor, used for new people
+    """
+    matrix = await get_face_matrix(user_id)
+    logger.info(f"Matching {len(descriptors)} face(s) against {len(matrix.person_ids)} people ({matrix.live} faces)")
+    matches = matrix.match_many(descriptors)
     
-    best_match = None
-    best_distance = float('inf')
-    best_match_quality = None
+    # Same tiered rule, applied against the people created so far in this batch
+    batch_people = FaceMatrix()
+    person_ids = []
+    new_people = []
+    for i, match in enumerate(matches):
+        if is_face_match(match):
+            person_ids.append(match[0])
+            continue
+        
+        local = batch_people.match(descriptors[i])
+        if is_face_match(local):
+            person_id = local[0]
+        else:
+            file_id, thumbnail_url = sample_files[i]
+            person = Person(
+                user_id=user_id,
+                photo_count=0,  # Incremented as its memberships are added
+                sample_photo_url=thumbnail_url,
+                sample_file_id=file_id
+            )
+            new_people.append(person.model_dump())
+            person_id = person.id
+        batch_people.add(str(i), person_id, descriptors[i])
+        person_ids.append(person_id)
     
-    for person in people:
-        # Get ALL faces from this person to compare against
-        existing_faces = await db.faces.find({"person_id": person['id'], "user_id": user_id}).to_list(None)
-        
-        if existing_faces:
-            # Compare new face against ALL existing faces of this person
-            distances = []
-            
-            for existing_face in existing_faces:
-                # Calculate Euclidean distance between descriptors
-                existing_descriptor = np.array(existing_face['descriptor'])
-                distance = np.linalg.norm(new_descriptor - existing_descriptor)
-                distances.append(distance)
-            
-            # Use multiple distance metrics for robustness
-            min_distance = min(distances)
-            
-            # Calculate match quality based on multiple factors
-            if len(distances) >= 3:
-                # If 3+ faces: use average of best 3 matches
-                distances_sorted = sorted(distances)
-                avg_top3 = sum(distances_sorted[:3]) / 3
-                final_distance = (min_distance * 0.6 + avg_top3 * 0.4)  # Weighted average
-                match_quality = "high_confidence"
-            elif len(distances) >= 2:
-                # If 2 faces: use average of both
-                avg_top2 = sum(sorted(distances)[:2]) / 2
-                final_distance = (min_distance * 0.7 + avg_top2 * 0.3)
-                match_quality = "medium_confidence"
-            else:
-                # Single face: use minimum distance but be more lenient
-                final_distance = min_distance
-                match_quality = "low_confidence"
-            
-            logger.info(f"Person {person.get('name', person['id'][:8])}: distance = {final_distance:.4f}, min = {min_distance:.4f}, quality = {match_quality}")
-            
-            # Track best overall match
-            if final_distance < best_distance:
-                best_distance = final_distance
-                best_match = person
-                best_match_quality = match_quality
-    
-    # Use tiered threshold approach
-    matched = False
-    if best_match:
-        # Primary threshold: strict matching
-        if best_distance < primary_threshold:
-            matched = True
-            logger.info(f"✅ PRIMARY MATCH! Person {best_match.get('name', best_match['id'][:8])} with distance {best_distance:.4f}")
-        # Secondary threshold: for cases with accessories (glasses, etc)
-        elif best_distance < secondary_threshold and best_match_quality in ["high_confidence", "medium_confidence"]:
-            matched = True
-            logger.info(f"✅ SECONDARY MATCH (accessories/variation)! Person {best_match.get('name', best_match['id'][:8])} with distance {best_distance:.4f}")
-    
-    if matched:
-        return best_match['id'], False
-    
-    # No match found, create new person
-    logger.info(f"❌ No match found (best distance: {best_distance:.4f}, primary threshold: {primary_threshold}, secondary: {secondary_threshold}), creating new person")
-    person = Person(
-        user_id=user_id,
-        photo_count=0,  # Will be calculated properly in the calling function
-        sample_photo_url=sample_photo_url,
-        sample_file_id=file_id
-    )
-    person_dict = person.model_dump()
-    person_dict['created_at'] = person_dict['created_at'].isoformat()
-    person_dict['updated_at'] = person_dict['updated_at'].isoformat()
-    await db.people.insert_one(person_dict)
+    if new_people:
+        await db.people.insert_many(new_people, ordered=False)
+        logger.info(f"Created {len(new_people)} new people")
+    return person_ids, len(new_people)
+
+
+async def ingest_faces(user_id: str, items: List[FaceDataCreate]) -> dict:
+    """Match, store and count the detections of one or more files in a single pass"""
+    file_ids = list(dict.fromkeys(item.file_id for item in items))
+    files = await db.files.find(
+        {"id": {"$in": file_ids}, "user_id": user_id},
+        {"_id": 0, "id": 1, "thumbnail_url": 1, "created_at": 1}
+    ).to_list(None)
+    thumbnails = {f['id']: f.get('thumbnail_url') for f in files}
+    file_dates = {f['id']: f.get('created_at') for f in files}
+    missing_file_ids = [fid for fid in file_ids if fid not in thumbnails]
+    
+    detections = [(item.file_id, d) for item in items if item.file_id in thumbnails for d in item.detections]
+    result = {"face_ids": [], "files": {}, "missing_file_ids": missing_file_ids, "people_created": 0}
+    if not detections:
+        return result
     
-    logger.info(f"Created new person {person.id}")
-    return person.id, True
+    # Packed descriptors are joined and viewed as one matrix; float lists are converted per row
+    descriptors = stack_descriptors([d.descriptor for _, d in detections])
+    person_ids, people_created = await assign_people(user_id, descriptors, [(fid, thumbnails[fid]) for fid, _ in detections])
+    
+    faces = []
+    for (file_id, detection), person_id, vector in zip(detections, person_ids, descriptors):
+        face = FaceData(
+            file_id=file_id,
+            user_id=user_id,
+            person_id=person_id,
+            descriptor=pack_descriptor(vector),
+            box=detection.box,
+            confidence=detection.confidence
+        )
+        faces.append(face.model_dump())
+        result["files"].setdefault(file_id, []).append(face.id)
+    await db.faces.insert_many(faces, ordered=False)
+    
+    face_ids = [f['id'] for f in faces]
+    await update_face_matrix(user_id, lambda m: m.add_many(face_ids, person_ids, descriptors))
+    
+    # One membership upsert per (person, file) in the batch; counters move only for new files
+    await add_person_files(user_id, Counter(zip(person_ids, (file_id for file_id, _ in detections))), file_dates)
+    
+    result["face_ids"] = face_ids
+    result["people_created"] = people_created
+    return result
 
 
 @api_router.get("/people", response_model=List[Person])
-async def list_people(current_user: User = Depends(get_current_user)):
+async def list_people(fields: Optional[str] = None, current_user: User = Depends(get_current_user)):
     """List all detected people"""
-    people = await db.people.find({"user_id": current_user.id}, {"_id": 0}).to_list(1000)
-    for person in people:
-        if isinstance(person.get('created_at'), str):
-            person['created_at'] = datetime.fromisoformat(person['created_at'])
-        if isinstance(person.get('updated_at'), str):
-            person['updated_at'] = datetime.fromisoformat(person['updated_at'])
-    return people
+    projection = resolve_projection(Person, fields=fields) or model_projection(Person)
+    return stream_rows_response(db.people.find({"user_id": current_user.id}, projection).limit(1000))
 
 
 @api_router.put("/people/{person_id}/name")
@@ -1322,7 +2431,7 @@ async def update_person_name(person_id: str, update: PersonUpdate, current_user:
         {"id": person_id, "user_id": current_user.id},
         {"$set": {
             "name": update.name,
-            "updated_at": datetime.now(timezone.utc).isoformat()
+            "updated_at": datetime.now(timezone.utc)
         }}
     )
     if result.matched_count == 0:
@@ -1331,30 +2440,66 @@ async def update_person_name(person_id: str, update: PersonUpdate, current_user:
 
 
 @api_router.get("/people/{person_id}/photos")
-async def get_person_photos(person_id: str, current_user: User = Depends(get_current_user)):
-    """Get all photos containing this person"""
+async def get_person_photos(
+    person_id: str,
+    view: Optional[str] = None,
+    fields: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    order: str = "desc",
+    current_user: User = Depends(get_current_user)
+):
+    """Get photos containing this person, newest first (order=asc for oldest first)
+    Pages through the person's memberships; the next cursor is returned in X-Next-Cursor
+    """
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="order must be asc or desc")
     # Verify person belongs to user
-    person = await db.people.find_one({"id": person_id, "user_id": current_user.id})
+    person = await db.people.find_one({"id": person_id, "user_id": current_user.id}, {"_id": 0, "id": 1})
     if not person:
         raise HTTPException(status_code=404, detail="Person not found")
     
-    # Get all face detections for this person
-    faces = await db.faces.find({"person_id": person_id, "user_id": current_user.id}, {"_id": 0}).to_list(1000)
+    # Memberships get date file_created_at values from the membership migration (see fetch_file_page)
+    paged = await migration_completed(PERSON_FILES_MIGRATION_ID)
+    limit = max(1, min(limit or FILE_PAGE_MAX, FILE_PAGE_MAX)) if paged else FILE_PAGE_MAX
+    direction = -1 if order == "desc" else 1
+    query = {"person_id": person_id, "user_id": current_user.id}
+    if cursor and paged:
+        created_at, last_id = decode_file_cursor(cursor)
+        after = "$lt" if direction == -1 else "$gt"
+        query["$or"] = [
+            {"file_created_at": {after: created_at}},
+            {"file_created_at": created_at, "file_id": {after: last_id}}
+        ]
     
-    # Get unique file IDs
-    file_ids = list(set([face['file_id'] for face in faces]))
-    
-    # Get file metadata for these files
-    files = await db.files.find(
-        {"id": {"$in": file_ids}, "user_id": current_user.id, "is_trashed": False},
-        {"_id": 0}
-    ).to_list(1000)
+    projection = resolve_projection(FileMetadata, view, fields, FILE_LIST_VIEWS) or model_projection(FileMetadata)
+    # Walk the (person_id, file_created_at, file_id) index and join each membership to its file;
+    # trashed files drop out before the limit so pages stay full
+    rows = await db.person_files.aggregate([
+        {"$match": query},
+        {"$sort": {"file_created_at": direction, "file_id": direction}},
+        {"$lookup": {
+            "from": "files",
+            "localField": "file_id",
+            "foreignField": "id",
+            "pipeline": [
+                {"$match": {"user_id": current_user.id, "is_trashed": False}},
+                {"$project": projection}
+            ],
+            "as": "file"
+        }},
+        {"$unwind": "$file"},
+        {"$limit": limit + 1},
+        {"$project": {"_id": 0, "file_id": 1, "file_created_at": 1, "file": 1}}
+    ]).to_list(limit + 1)
     
-    for f in files:
-        if isinstance(f['created_at'], str):
-            f['created_at'] = datetime.fromisoformat(f['created_at'])
-    
-    return files
+    headers = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        if paged:
+            headers = {"X-Next-Cursor": encode_file_cursor({"created_at": last['file_created_at'], "id": last['file_id']})}
+    return FastJSONResponse([row['file'] for row in rows], headers=headers)
 
 
 @api_router.post("/people/merge")
@@ -1368,26 +2513,33 @@ async def merge_people(merge: PersonMerge, current_user: User = Depends(get_curr
     if len(people) != len(merge.person_ids) + 1:
         raise HTTPException(status_code=404, detail="One or more people not found")
     
+    job = await enqueue_job(current_user.id, "merge_people", merge.model_dump(), priority=JOB_PRIORITY_HIGH)
+    return {"success": True, "job_id": job.id}
+
+async def merge_people_job(job: "JobContext", user_id: str, params: dict) -> dict:
+    """Move faces and memberships of the source people to the target, then delete the sources
+    Moving memberships adds face counts before dropping the source rows, so a retry after a
+    crash in between recounts the user's memberships from faces
+    """
+    person_ids, target_id = params['person_ids'], params['target_person_id']
+    
     # Update all faces from source people to target person
     await db.faces.update_many(
-        {"person_id": {"$in": merge.person_ids}, "user_id": current_user.id},
-        {"$set": {"person_id": merge.target_person_id}}
+        {"person_id": {"$in": person_ids}, "user_id": user_id},
+        {"$set": {"person_id": target_id}}
     )
+    await job.progress(0.4)
     
-    # Recalculate photo count for target person
-    face_count = await db.faces.count_documents({"person_id": merge.target_person_id, "user_id": current_user.id})
-    await db.people.update_one(
-        {"id": merge.target_person_id},
-        {"$set": {
-            "photo_count": face_count,
-            "updated_at": datetime.now(timezone.utc).isoformat()
-        }}
-    )
+    # Move memberships; the target only gains files it did not already appear in
+    await move_person_files(user_id, person_ids, target_id)
+    if job.attempt > 1:
+        await reconcile_person_files(user_id)
+    await job.progress(0.8)
     
     # Delete source people
-    await db.people.delete_many({"id": {"$in": merge.person_ids}, "user_id": current_user.id})
-    
-    return {"success": True}
+    result = await db.people.delete_many({"id": {"$in": person_ids}, "user_id": user_id})
+    await update_face_matrix(user_id, lambda m: m.relabel(person_ids, target_id))
+    return {"merged_count": result.deleted_count}
 
 
 @api_router.delete("/people/{person_id}")
@@ -1406,101 +2558,744 @@ async def delete_person(person_id: str, current_user: User = Depends(get_current
     
     # Delete person
     await db.people.delete_one({"id": person_id, "user_id": current_user.id})
+    await db.person_files.delete_many({"person_id": person_id, "user_id": current_user.id})
+    await update_face_matrix(current_user.id, lambda m: m.remove_person(person_id))
     
     return {"success": True}
 
 
-# ========== HELPER FUNCTIONS FOR FILE DELETION ==========
+# ========== FACE RE-CLUSTERING ==========
+# Online matching is order dependent and leaves duplicate people behind. A re-clustering
+# job clusters all of a user's faces at once (see face_cluster.py) in a process pool and
+# either records the proposed moves or applies them. Named people keep all their faces.
+# Runs go through the job queue; while one is pending or running its document carries
+# active_user_id, which a unique index limits to one per user.
+
+FACE_CLUSTER_WORKERS = int(os.environ.get('FACE_CLUSTER_WORKERS', os.cpu_count() or 1))
+FACE_CLUSTER_CHUNKS = 64  # Neighbour search tasks per job, also the progress granularity
+FACE_CLUSTER_PROPOSALS = 500
+
+cluster_pool: Optional[ProcessPoolExecutor] = None
+
+def get_cluster_pool() -> ProcessPoolExecutor:
+    global cluster_pool
+    if cluster_pool is None:
+        # Spawned workers only import face_cluster, never this app or its open connections
+        cluster_pool = ProcessPoolExecutor(
+            max_workers=FACE_CLUSTER_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return cluster_pool
 
-async def permanently_delete_file(file: dict, user: User):
-    """Permanently delete file from Telegram and thumbnail storage"""
+async def run_cluster_job(job: FaceClusterJob, final_attempt: bool = True):
+    """Cluster the user's faces and record (and optionally apply) the resulting person moves
+    Failures are raised for the job queue; the document stays pending while a retry is due
+    """
+    async def set_status(state: str, **extra):
+        update = {"$set": {"status": state, "updated_at": datetime.now(timezone.utc), **extra}}
+        if state in ("completed", "failed"):
+            update["$unset"] = {"active_user_id": ""}
+        await db.face_cluster_jobs.update_one({"id": job.id}, update)
+    
+    path = None
     try:
-        # Delete from Telegram
-        if user.telegram_bot_token and file.get('telegram_msg_id'):
-            try:
-                response = requests.post(
-                    f"https://api.telegram.org/bot{user.telegram_bot_token}/deleteMessage",
-                    json={
-                        "chat_id": user.telegram_channel_id,
-                        "message_id": file['telegram_msg_id']
-                    }
-                )
-                if response.json().get('ok'):
-                    logger.info(f"Deleted Telegram message {file['telegram_msg_id']}")
-                else:
-                    logger.warning(f"Failed to delete Telegram message: {response.json()}")
-            except Exception as e:
-                logger.error(f"Error deleting from Telegram: {str(e)}")
-        
-        # Delete from ImgBB (if applicable)
-        # Note: ImgBB doesn't provide a delete API for free tier
-        # Thumbnail will remain but won't be accessible from our app
+        user_id = job.user_id
+        await set_status("running", stage="loading", progress=0.0)
+        matrix = await get_face_matrix(user_id)
+        rows = np.flatnonzero(matrix.alive[:matrix.size])
+        face_ids = [matrix.face_ids[r] for r in rows.tolist()]
+        labels = matrix.labels[rows].astype(np.int64)
+        person_ids = list(matrix.person_ids)
+        
+        named_people = await db.people.find(
+            {"user_id": user_id, "name": {"$nin": [None, ""]}}, {"_id": 0, "id": 1}
+        ).to_list(None)
+        named_ids = {p['id'] for p in named_people}
+        named = np.array([pid in named_ids for pid in person_ids], dtype=bool)
+        
+        count = len(rows)
+        if count < 2:
+            await set_status("completed", stage=None, progress=1.0, face_count=count)
+            return
+        
+        fd, path = tempfile.mkstemp(suffix=".npy")
+        os.close(fd)
+        await asyncio.to_thread(np.save, path, matrix.vectors(rows))
+        
+        loop = asyncio.get_running_loop()
+        pool = get_cluster_pool()
+        chunk = -(-count // FACE_CLUSTER_CHUNKS)
+        await set_status("running", stage="neighbours", face_count=count)
+        futures = [
+            loop.run_in_executor(pool, knn_rows, path, lo, min(lo + chunk, count), KNN_NEIGHBOURS, FACE_PRIMARY_THRESHOLD)
+            for lo in range(0, count, chunk)
+        ]
+        parts = []
+        for future in asyncio.as_completed(futures):
+            parts.append(await future)
+            await set_status("running", progress=len(parts) / len(futures))
+        
+        await set_status("running", stage="clustering", progress=0.0)
+        sources = np.concatenate([p[0] for p in parts])
+        targets = np.concatenate([p[1] for p in parts])
+        clusters = await loop.run_in_executor(pool, chinese_whispers, count, sources, targets)
+        
+        await set_status("running", stage="planning", progress=0.0)
+        planned = plan_assignments(clusters, labels, named)
+        moved = np.flatnonzero(planned != labels)
+        
+        # Summarise per (from, to) person; new people are negative labels
+        moves = Counter(zip(labels[moved].tolist(), planned[moved].tolist()))
+        moved_from = Counter(labels[moved].tolist())
+        totals = Counter(labels.tolist())
+        merged = [person_ids[p] for p, n in moved_from.items() if n == totals[p]]
+        new_labels = sorted({t for t in planned[moved].tolist() if t < 0}, reverse=True)
+        summary = {
+            "cluster_count": int(clusters.max()) + 1,
+            "faces_moved": len(moved),
+            "people_merged": len(merged),
+            "people_split": len(moved_from) - len(merged),
+            "people_created": len(new_labels),
+            "proposals": [
+                {
+                    "from_person_id": person_ids[src],
+                    "to_person_id": person_ids[dst] if dst >= 0 else None,
+                    "new_person": -1 - dst if dst < 0 else None,
+                    "face_count": n
+                }
+                for (src, dst), n in moves.most_common(FACE_CLUSTER_PROPOSALS)
+            ]
+        }
         
-        # Delete face data associated with this file
-        await db.faces.delete_many({"file_id": file['id']})
+        if job.apply and len(moved):
+            await set_status("running", stage="applying", progress=0.0, **summary)
+            await apply_cluster_moves(job, face_ids, labels, planned, moved, person_ids, new_labels, merged)
         
+        await set_status("completed", stage=None, progress=1.0, **summary)
+        logger.info(f"Face re-clustering for {user_id}: {count} faces, {len(moved)} moved (apply={job.apply})")
+    except asyncio.CancelledError:
+        # Shutting down; the job queue hands the job to another worker
+        await set_status("pending", stage=None)
+        raise
     except Exception as e:
-        logger.error(f"Error in permanently_delete_file: {str(e)}")
-
+        logger.error(f"Face re-clustering error for {job.user_id}: {str(e)}")
+        await set_status("failed" if final_attempt else "pending", error=str(e))
+        raise
+    finally:
+        if path:
+            os.unlink(path)
+
+async def apply_cluster_moves(job: FaceClusterJob, face_ids: List[str], labels: np.ndarray, planned: np.ndarray,
+                              moved: np.ndarray, person_ids: List[str], new_labels: List[int], merged: List[str]):
+    """Create split-off people, move faces, drop emptied people and rebuild counts"""
+    user_id = job.user_id
+    target_ids = {}
+    if new_labels:
+        # First face of each new person supplies its sample photo
+        samples = {}
+        for row in moved.tolist():
+            if planned[row] < 0:
+                samples.setdefault(int(planned[row]), face_ids[row])
+        faces = await db.faces.find(
+            {"id": {"$in": list(samples.values())}}, {"_id": 0, "id": 1, "file_id": 1}
+        ).to_list(None)
+        face_files = {f['id']: f['file_id'] for f in faces}
+        files = await db.files.find(
+            {"id": {"$in": list(face_files.values())}, "user_id": user_id}, {"_id": 0, "id": 1, "thumbnail_url": 1}
+        ).to_list(None)
+        thumbnails = {f['id']: f.get('thumbnail_url') for f in files}
+        
+        new_people = []
+        for label in new_labels:
+            file_id = face_files.get(samples[label])
+            person = Person(user_id=user_id, sample_file_id=file_id, sample_photo_url=thumbnails.get(file_id))
+            new_people.append(person.model_dump())
+            target_ids[label] = person.id
+        await db.people.insert_many(new_people, ordered=False)
+    
+    groups = {}
+    for row in moved.tolist():
+        src, dst = int(labels[row]), int(planned[row])
+        groups.setdefault((person_ids[src], target_ids[dst] if dst < 0 else person_ids[dst]), []).append(face_ids[row])
+    
+    done = 0
+    for (from_id, to_id), group in groups.items():
+        for i in range(0, len(group), MIGRATION_BATCH_SIZE):
+            batch = group[i:i + MIGRATION_BATCH_SIZE]
+            # Faces changed since the snapshot (merged, deleted) are left alone
+            await db.faces.update_many(
+                {"id": {"$in": batch}, "user_id": user_id, "person_id": from_id},
+                {"$set": {"person_id": to_id}}
+            )
+            done += len(batch)
+            await db.face_cluster_jobs.update_one(
+                {"id": job.id},
+                {"$set": {"progress": done / len(moved), "updated_at": datetime.now(timezone.utc)}}
+            )
+    
+    if merged:
+        # Only people that really ended up without faces
+        remaining = set(await db.faces.distinct("person_id", {"user_id": user_id, "person_id": {"$in": merged}}))
+        emptied = [pid for pid in merged if pid not in remaining]
+        await db.people.delete_many({"id": {"$in": emptied}, "user_id": user_id, "name": {"$in": [None, ""]}})
+    
+    await update_face_matrix(user_id)
+    await reconcile_person_files(user_id)
+
+
+async def recluster_job(job: "JobContext", user_id: str, params: dict) -> dict:
+    """Job queue handler; progress stays on the re-clustering document"""
+    doc = await db.face_cluster_jobs.find_one({"id": params['cluster_job_id'], "user_id": user_id}, {"_id": 0})
+    if not doc:
+        raise ValueError("Re-clustering job not found")
+    if doc['status'] not in ("pending", "running"):
+        return {"cluster_job_id": doc['id'], "skipped": True}
+    await run_cluster_job(FaceClusterJob(**doc), final_attempt=job.final_attempt)
+    doc = await db.face_cluster_jobs.find_one({"id": params['cluster_job_id']}, {"_id": 0})
+    return {"cluster_job_id": doc['id'], "faces_moved": doc['faces_moved']}
+
+async def fail_stale_cluster_job(user_id: str):
+    """Mark the user's active re-clustering failed when no queued or running job is left to finish it"""
+    active = await db.face_cluster_jobs.find_one({"active_user_id": user_id}, {"_id": 0, "id": 1})
+    if not active:
+        return
+    queued = await db.jobs.find_one(
+        {"type": "recluster", "params.cluster_job_id": active['id'], "status": {"$in": ["queued", "running"]}},
+        {"_id": 0, "id": 1}
+    )
+    if queued:
+        return
+    await db.face_cluster_jobs.update_one(
+        {"id": active['id'], "active_user_id": user_id},
+        {
+            "$set": {"status": "failed", "error": "Re-clustering stopped without finishing", "updated_at": datetime.now(timezone.utc)},
+            "$unset": {"active_user_id": ""}
+        }
+    )
+    logger.warning(f"Re-clustering job {active['id']} for {user_id} had no live job left, marked failed")
 
-async def cleanup_old_trash():
-    """Background task to cleanup files in trash for more than 10 days"""
+@api_router.post("/people/recluster")
+async def start_recluster(request: ReclusterRequest, current_user: User = Depends(get_current_user)):
+    """Queue a re-clustering of all faces (proposal only unless apply is set)"""
+    await fail_stale_cluster_job(current_user.id)
+    
+    job = FaceClusterJob(user_id=current_user.id, apply=request.apply)
     try:
-        logger.info("Running trash cleanup task...")
-        cutoff_date = datetime.now(timezone.utc) - timedelta(days=10)
-        
-        # Find all files trashed more than 10 days ago
-        cursor = db.files.find({
-            "is_trashed": True,
-            "trashed_at": {"$ne": None, "$lt": cutoff_date.isoformat()}
-        })
-        
-        files_to_delete = await cursor.to_list(None)
-        
-        if files_to_delete:
-            logger.info(f"Found {len(files_to_delete)} files to permanently delete")
+        await db.face_cluster_jobs.insert_one({**job.model_dump(), "active_user_id": current_user.id})
+    except DuplicateKeyError:
+        running = await db.face_cluster_jobs.find_one({"active_user_id": current_user.id}, {"_id": 0, "id": 1})
+        raise HTTPException(status_code=409, detail=f"Re-clustering already in progress: {(running or {}).get('id')}")
+    
+    queued = await enqueue_job(current_user.id, "recluster", {"cluster_job_id": job.id})
+    return {"success": True, "job_id": job.id, "queue_job_id": queued.id}
+
+
+@api_router.get("/people/recluster/{job_id}", response_model=FaceClusterJob)
+async def get_recluster_job(job_id: str, current_user: User = Depends(get_current_user)):
+    """Progress and result of a re-clustering job"""
+    job = await db.face_cluster_jobs.find_one({"id": job_id, "user_id": current_user.id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Re-clustering job not found")
+    return job
+
+
+# ========== HELPER FUNCTIONS FOR FILE DELETION ==========
+# Permanent deletes go through purge_files: Telegram messages are removed with the Bot API
+# deleteMessages call (up to 100 ids) under a per-bot rate limit, and faces, memberships
+# and file rows are removed with batched delete_many. Files whose messages could not be
+# deleted stay in trash with purge_attempts bumped and purge_at pushed back for a retry.
+
+TELEGRAM_DELETE_BATCH = 100  # deleteMessages limit
+TELEGRAM_BOT_RATE = float(os.environ.get('TELEGRAM_BOT_RATE', 5))  # Bot API calls per second per bot
+TELEGRAM_DELETE_RETRIES = 3
+TRASH_PURGE_BATCH = 500
+TRASH_PURGE_MAX_ATTEMPTS = 5  # After this many failed runs the file row is dropped anyway
+
+class RateLimiter:
+    """Async token bucket: at most `rate` acquisitions per second, bursts up to `burst`"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated: Optional[float] = None  # Loop time of the last refill
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            loop = asyncio.get_running_loop()
+            now = loop.time()
+            if self.updated is not None:
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self.tokens = 1
+                self.updated = loop.time()
+            self.tokens -= 1
+
+bot_rate_limiters = {}
+telegram_http = TelegramSession()  # Records Bot API latency per method
+
+async def delete_telegram_messages(user: User, message_ids: List[int]) -> List[int]:
+    """Delete messages from the user's channel in batches; returns the ids that could not be deleted"""
+    if not message_ids:
+        return []
+    if not user.telegram_bot_token or not user.telegram_channel_id:
+        return list(message_ids)
+    
+    limiter = bot_rate_limiters.setdefault(user.telegram_bot_token, RateLimiter(TELEGRAM_BOT_RATE))
+    url = f"https://api.telegram.org/bot{user.telegram_bot_token}/deleteMessages"
+    failed = []
+    for i in range(0, len(message_ids), TELEGRAM_DELETE_BATCH):
+        batch = message_ids[i:i + TELEGRAM_DELETE_BATCH]
+        attempt = 0
+        while True:
+            await limiter.acquire()
+            try:
+                response = await asyncio.to_thread(
+                    telegram_http.post, url,
+                    json={"chat_id": user.telegram_channel_id, "message_ids": batch},
+                    timeout=30
+                )
+                data = response.json()
+            except Exception as e:
+                data = {"ok": False, "description": str(e)}
             
-            for file in files_to_delete:
-                try:
-                    # Get user info
-                    user = await db.users.find_one({"id": file['user_id']})
-                    if user:
-                        user_obj = User(**user)
-                        await permanently_delete_file(file, user_obj)
-                    
-                    # Delete from database
-                    await db.files.delete_one({"id": file['id']})
-                    logger.info(f"Permanently deleted file {file['id']}")
-                except Exception as e:
-                    logger.error(f"Error deleting file {file['id']}: {str(e)}")
+            if data.get('ok'):
+                logger.info(f"Deleted {len(batch)} Telegram messages for user {user.id}")
+                break
+            retry_after = (data.get('parameters') or {}).get('retry_after')
+            if retry_after:
+                # Flood control does not count as a failed attempt
+                await asyncio.sleep(retry_after)
+                continue
+            attempt += 1
+            if attempt >= TELEGRAM_DELETE_RETRIES:
+                logger.warning(f"Failed to delete {len(batch)} Telegram messages: {data.get('description')}")
+                failed.extend(batch)
+                break
+            await asyncio.sleep(2 ** attempt)
+    return failed
+
+async def delete_file_records(user_id: str, file_ids: List[str]):
+    """Remove file rows and everything derived from them (faces, memberships, face index)"""
+    faces = await db.faces.find({"file_id": {"$in": file_ids}, "user_id": user_id}, {"_id": 0, "id": 1}).to_list(None)
+    if faces:
+        face_ids = [f['id'] for f in faces]
+        await db.faces.delete_many({"file_id": {"$in": file_ids}, "user_id": user_id})
+        await update_face_matrix(user_id, lambda m: m.remove_faces(face_ids))
+        await remove_file_memberships(user_id, file_ids)
+    result = await db.files.delete_many({"id": {"$in": file_ids}, "user_id": user_id})
+    return result.deleted_count
+
+async def purge_files(user: User, files: List[dict], keep_failed: bool = True) -> dict:
+    """Permanently delete one user's files from Telegram and the database
+    With keep_failed, files whose message could not be deleted stay in trash for a later retry
+    Thumbnails stay on ImgBB, which has no delete API on the free tier
+    """
+    message_ids = [f['telegram_msg_id'] for f in files if f.get('telegram_msg_id')]
+    failed_ids = set(await delete_telegram_messages(user, message_ids))
+    
+    retry = []
+    deletable = []
+    for f in files:
+        if keep_failed and f.get('telegram_msg_id') in failed_ids \
+                and f.get('purge_attempts', 0) + 1 < TRASH_PURGE_MAX_ATTEMPTS:
+            retry.append(f['id'])
         else:
-            logger.info("No files to cleanup")
+            deletable.append(f['id'])
+    
+    if retry:
+        await db.files.update_many(
+            {"id": {"$in": retry}, "user_id": user.id},
+            {"$inc": {"purge_attempts": 1}, "$set": {"purge_at": datetime.now(timezone.utc) + TRASH_RETRY_DELAY}}
+        )
+    deleted = 0
+    for i in range(0, len(deletable), TRASH_PURGE_BATCH):
+        deleted += await delete_file_records(user.id, deletable[i:i + TRASH_PURGE_BATCH])
+        await asyncio.sleep(0)
+    return {"deleted": deleted, "failed": len(retry)}
+
+PURGE_FILE_FIELDS = {"_id": 0, "id": 1, "user_id": 1, "telegram_msg_id": 1, "purge_attempts": 1}
+
+async def purge_trashed_files(query: dict) -> dict:
+    """Purge every file matching query, grouped by user so each bot gets bulk calls"""
+    totals = {"deleted": 0, "failed": 0}
+    user_ids = await db.files.distinct("user_id", query)
+    users = await db.users.find({"id": {"$in": user_ids}}, {"_id": 0}).to_list(None)
+    users_by_id = {u['id']: User(**u) for u in users}
+    for user_id in user_ids:
+        files = await db.files.find({**query, "user_id": user_id}, PURGE_FILE_FIELDS).to_list(None)
+        user = users_by_id.get(user_id)
+        if user is None:
+            # Owner is gone; nothing on Telegram we can reach
+            user = User(id=user_id, email="deleted@example.com")
+        result = await purge_files(user, files)
+        totals["deleted"] += result["deleted"]
+        totals["failed"] += result["failed"]
+    return totals
+
+
+# ========== TRASH EXPIRY ==========
+# Trashed files and folders carry purge_at (trashed_at + TRASH_RETENTION) under a partial
+# index. The trash scheduler sleeps until the earliest purge_at, purges only what is due,
+# and looks again; TRASH_SCHEDULER_MAX_SLEEP bounds the sleep so rows trashed by other
+# processes or restored meanwhile are picked up.
+
+TRASH_RETENTION = timedelta(days=10)
+TRASH_RETRY_DELAY = timedelta(hours=1)
+TRASH_SCHEDULER_MAX_SLEEP = 3600  # Seconds
+DUE = {"$type": "date"}  # Matches the partial purge_at indexes
+
+UNTRASH_FIELDS = {"is_trashed": False, "trashed_at": None, "purge_at": None}
+
+def trash_fields(now: datetime) -> dict:
+    return {"is_trashed": True, "trashed_at": now, "purge_at": now + TRASH_RETENTION}
+
+async def next_purge_at() -> Optional[datetime]:
+    """Earliest purge_at over trashed files and folders"""
+    times = []
+    for collection in (db.files, db.folders):
+        # Same filter as purge_due_trash, or a stray purge_at on a live row would never be consumed
+        row = await collection.find_one(
+            {"purge_at": DUE, "is_trashed": True}, {"_id": 0, "purge_at": 1}, sort=[("purge_at", 1)]
+        )
+        if row:
+            times.append(row['purge_at'])
+    return min(times) if times else None
+
+async def purge_due_trash(now: datetime):
+    """Permanently delete files and folders whose purge_at has passed"""
+    due = {"purge_at": {**DUE, "$lte": now}, "is_trashed": True}
+    result = await purge_trashed_files(due)
+    if result['deleted'] or result['failed']:
+        logger.info(f"Trash expiry: deleted {result['deleted']} files, {result['failed']} left for retry")
+    
+    # Trashed folders carry no Telegram data, so they can go in one batch
+    folders_result = await db.folders.delete_many(due)
+    if folders_result.deleted_count:
+        logger.info(f"Permanently deleted {folders_result.deleted_count} trashed folders")
+
+trash_wakeup = asyncio.Event()
+
+async def run_trash_scheduler():
+    """Sleep until the next purge_at, purge what is due, repeat"""
+    logger.info("Trash expiry scheduler started")
+    while True:
+        try:
+            now = datetime.now(timezone.utc)
+            next_at = await next_purge_at()
+            if next_at is not None and next_at <= now:
+                await purge_due_trash(now)
+                continue
             
+            delay = TRASH_SCHEDULER_MAX_SLEEP
+            if next_at is not None:
+                delay = min(delay, (next_at - now).total_seconds())
+            trash_wakeup.clear()
+            try:
+                await asyncio.wait_for(trash_wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Trash expiry scheduler error: {str(e)}")
+            await asyncio.sleep(60)
+
+
+# ========== TIMESTAMP MIGRATION ==========
+
+# Fields that used to be written as ISO strings, per collection
+TIMESTAMP_FIELDS = {
+    "users": ["created_at"],
+    "files": ["created_at", "trashed_at"],
+    "folders": ["created_at"],
+    "faces": ["created_at"],
+    "people": ["created_at", "updated_at"],
+    "shared_collections": ["created_at"],
+}
+MIGRATION_BATCH_SIZE = 500
+TIMESTAMP_MIGRATION_ID = "timestamps_to_dates"
+
+async def migrate_collection_timestamps(collection_name: str, fields: List[str]) -> int:
+    """Convert ISO string timestamps in one collection to native dates, batch by batch
+    Progress is checkpointed by _id in db.migrations so a restart resumes where it stopped
+    """
+    collection = db[collection_name]
+    state = await db.migrations.find_one({"_id": TIMESTAMP_MIGRATION_ID}) or {}
+    last_id = state.get("checkpoints", {}).get(collection_name)
+
+    converted = 0
+    while True:
+        query = {"$or": [{f: {"$type": "string"}} for f in fields]}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        projection = {f: 1 for f in fields}
+        batch = await collection.find(query, projection).sort("_id", 1).limit(MIGRATION_BATCH_SIZE).to_list(MIGRATION_BATCH_SIZE)
+        if not batch:
+            break
+
+        ops = []
+        for doc in batch:
+            update = {}
+            for f in fields:
+                value = doc.get(f)
+                if isinstance(value, str):
+                    try:
+                        update[f] = datetime.fromisoformat(value)
+                    except ValueError:
+                        logger.warning(f"Unparseable {collection_name}.{f} on {doc['_id']}: {value}")
+            if update:
+                ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": update}))
+        if ops:
+            await collection.bulk_write(ops, ordered=False)
+        converted += len(ops)
+
+        last_id = batch[-1]["_id"]
+        await db.migrations.update_one(
+            {"_id": TIMESTAMP_MIGRATION_ID},
+            {"$set": {f"checkpoints.{collection_name}": last_id}},
+            upsert=True
+        )
+        # Yield to request handlers between batches
+        await asyncio.sleep(0)
+
+    return converted
+
+async def migrate_timestamps():
+    """Background migration of all string timestamps to native BSON dates"""
+    try:
+        state = await db.migrations.find_one({"_id": TIMESTAMP_MIGRATION_ID})
+        if state and state.get("completed"):
+            return
+
+        logger.info("Starting timestamp migration...")
+        for collection_name, fields in TIMESTAMP_FIELDS.items():
+            converted = await migrate_collection_timestamps(collection_name, fields)
+            logger.info(f"Timestamp migration: converted {converted} {collection_name} documents")
+
+        await db.migrations.update_one(
+            {"_id": TIMESTAMP_MIGRATION_ID},
+            {"$set": {"completed": True, "completed_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+        completed_migrations.add(TIMESTAMP_MIGRATION_ID)
+        logger.info("Timestamp migration complete")
     except Exception as e:
-        logger.error(f"Error in cleanup_old_trash: {str(e)}")
+        logger.error(f"Timestamp migration error: {str(e)}")
+
+
+FOLDER_PATHS_MIGRATION_ID = "folder_ancestors"
+
+async def migrate_folder_paths():
+    """Backfill the ancestors array on folders created before paths were stored
+    Works one user at a time; users that still have folders without ancestors are redone on restart
+    """
+    try:
+        state = await db.migrations.find_one({"_id": FOLDER_PATHS_MIGRATION_ID})
+        if state and state.get("completed"):
+            return
+
+        user_ids = await db.folders.distinct("user_id", {"ancestors": {"$exists": False}})
+        logger.info(f"Folder path migration: {len(user_ids)} users to backfill")
+        for user_id in user_ids:
+            folders = await db.folders.find({"user_id": user_id}, {"_id": 0, "id": 1, "parent_id": 1}).to_list(None)
+            parents = {f['id']: f.get('parent_id') for f in folders}
+
+            ops = []
+            for folder_id in parents:
+                ancestors = []
+                seen = {folder_id}
+                current = parents.get(folder_id)
+                # Walk up until root, a missing parent, or a cycle
+                while current and current in parents and current not in seen:
+                    ancestors.append(current)
+                    seen.add(current)
+                    current = parents.get(current)
+                ancestors.reverse()
+                ops.append(UpdateOne({"id": folder_id, "user_id": user_id}, {"$set": {"ancestors": ancestors}}))
+
+            for i in range(0, len(ops), MIGRATION_BATCH_SIZE):
+                await db.folders.bulk_write(ops[i:i + MIGRATION_BATCH_SIZE], ordered=False)
+                await asyncio.sleep(0)
+
+        await db.migrations.update_one(
+            {"_id": FOLDER_PATHS_MIGRATION_ID},
+            {"$set": {"completed": True, "completed_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+        logger.info("Folder path migration complete")
+    except Exception as e:
+        logger.error(f"Folder path migration error: {str(e)}")
+
+FACE_DESCRIPTOR_MIGRATION_ID = "face_descriptors_f32"
+
+async def migrate_face_descriptors():
+    """Rewrite list-of-doubles descriptors as packed float32 bytes (FaceData schema 2)
+    Checkpointed by _id like the timestamp migration
+    """
+    try:
+        state = await db.migrations.find_one({"_id": FACE_DESCRIPTOR_MIGRATION_ID}) or {}
+        if state.get("completed"):
+            return
+
+        last_id = state.get("checkpoint")
+        converted = 0
+        while True:
+            query = {"schema_version": {"$ne": FACE_SCHEMA_VERSION}}
+            if last_id is not None:
+                query["_id"] = {"$gt": last_id}
+            batch = await db.faces.find(query, {"descriptor": 1}).sort("_id", 1).limit(MIGRATION_BATCH_SIZE).to_list(MIGRATION_BATCH_SIZE)
+            if not batch:
+                break
+
+            ops = [
+                UpdateOne(
+                    {"_id": face["_id"], "schema_version": {"$ne": FACE_SCHEMA_VERSION}},
+                    {"$set": {
+                        "descriptor": pack_descriptor(unpack_descriptor(face["descriptor"])),
+                        "schema_version": FACE_SCHEMA_VERSION
+                    }}
+                )
+                for face in batch if face.get("descriptor") is not None
+            ]
+            if ops:
+                await db.faces.bulk_write(ops, ordered=False)
+            converted += len(ops)
+
+            last_id = batch[-1]["_id"]
+            await db.migrations.update_one(
+                {"_id": FACE_DESCRIPTOR_MIGRATION_ID},
+                {"$set": {"checkpoint": last_id}},
+                upsert=True
+            )
+            await asyncio.sleep(0)
+
+        await db.migrations.update_one(
+            {"_id": FACE_DESCRIPTOR_MIGRATION_ID},
+            {"$set": {"completed": True, "completed_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+        logger.info(f"Face descriptor migration complete: converted {converted} faces")
+    except Exception as e:
+        logger.error(f"Face descriptor migration error: {str(e)}")
+
+# v2: memberships carry file_created_at for paginated person galleries
+PERSON_FILES_MIGRATION_ID = "person_files_v2"
+
+async def migrate_person_files():
+    """Build person_files memberships for faces stored before they existed"""
+    try:
+        state = await db.migrations.find_one({"_id": PERSON_FILES_MIGRATION_ID})
+        if state and state.get("completed"):
+            return
+
+        logger.info("Starting person membership migration...")
+        await reconcile_all_person_files()
+        await db.migrations.update_one(
+            {"_id": PERSON_FILES_MIGRATION_ID},
+            {"$set": {"completed": True, "completed_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+        completed_migrations.add(PERSON_FILES_MIGRATION_ID)
+        logger.info("Person membership migration complete")
+    except Exception as e:
+        logger.error(f"Person membership migration error: {str(e)}")
+
+TRASH_EXPIRY_MIGRATION_ID = "trash_purge_at"
+
+async def migrate_trash_expiry():
+    """Give trashed files and folders from before purge_at existed their expiry time
+    Runs after the timestamp migration so trashed_at is a date
+    """
+    try:
+        state = await db.migrations.find_one({"_id": TRASH_EXPIRY_MIGRATION_ID})
+        if state and state.get("completed"):
+            return
+
+        retention_ms = int(TRASH_RETENTION.total_seconds() * 1000)
+        for collection in (db.files, db.folders):
+            await collection.update_many(
+                {"is_trashed": True, "purge_at": None, "trashed_at": {"$type": "date"}},
+                [{"$set": {"purge_at": {"$add": ["$trashed_at", retention_ms]}}}]
+            )
+            # No usable trashed_at: start the retention period now
+            await collection.update_many(
+                {"is_trashed": True, "purge_at": None},
+                {"$set": {"purge_at": datetime.now(timezone.utc) + TRASH_RETENTION}}
+            )
+        await db.migrations.update_one(
+            {"_id": TRASH_EXPIRY_MIGRATION_ID},
+            {"$set": {"completed": True, "completed_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+        trash_wakeup.set()
+        logger.info("Trash expiry migration complete")
+    except Exception as e:
+        logger.error(f"Trash expiry migration error: {str(e)}")
+
+async def run_migrations():
+    """Run all background data migrations in order"""
+    await migrate_timestamps()
+    await migrate_folder_paths()
+    await migrate_face_descriptors()
+    await migrate_person_files()
+    await migrate_trash_expiry()
+
+
+async def ensure_indexes():
+    """Create the indexes listing and cleanup queries rely on"""
+    await db.files.create_index([("user_id", 1), ("is_trashed", 1), ("folder_id", 1), ("created_at", -1)])
+    await db.files.create_index([("purge_at", 1)], partialFilterExpression={"purge_at": DUE})
+    await db.folders.create_index([("user_id", 1), ("parent_id", 1)])
+    await db.folders.create_index([("user_id", 1), ("ancestors", 1)])
+    await db.folders.create_index([("purge_at", 1)], partialFilterExpression={"purge_at": DUE})
+    await db.people.create_index([("user_id", 1), ("updated_at", -1)])
+    await db.faces.create_index([("user_id", 1), ("person_id", 1), ("file_id", 1)])
+    await db.faces.create_index([("file_id", 1)])
+    await db.faces.create_index([("id", 1)])
+    await db.person_files.create_index([("person_id", 1), ("file_id", 1)], unique=True)
+    await db.person_files.create_index([("user_id", 1), ("person_id", 1)])
+    await db.person_files.create_index([("person_id", 1), ("file_created_at", -1), ("file_id", -1)])
+    await db.files.create_index([("id", 1)])
+    await db.person_files.create_index([("file_id", 1)])
+    await db.face_cluster_jobs.create_index([("user_id", 1), ("status", 1)])
+    await db.face_cluster_jobs.create_index("active_user_id", unique=True, sparse=True)
+    await db.telegram_logins.create_index("id", unique=True)
+    await db.telegram_logins.create_index([("user_id", 1), ("phone", 1), ("phone_code_hash", 1)])
+    await db.telegram_logins.create_index("expires_at", expireAfterSeconds=0)
+    await db.jobs.create_index("id", unique=True)
+    await db.jobs.create_index([("status", 1), ("priority", -1), ("created_at", 1)])
+    await db.jobs.create_index([("user_id", 1), ("status", 1), ("started_at", 1)])
+    await db.jobs.create_index([("user_id", 1), ("created_at", -1)])
+    await db.jobs.create_index("finished_at", expireAfterSeconds=int(JOB_HISTORY.total_seconds()))
 
 
 # ========== BULK OPERATIONS ENDPOINTS ==========
 
 @api_router.post("/files/bulk-delete")
 async def bulk_delete_files(request: BulkDeleteRequest, current_user: User = Depends(get_current_user)):
-    """Move multiple files to trash"""
+    """Move multiple files to trash
+    A single indexed update, so it runs inline rather than waiting behind the user's queued jobs
+    """
     if not request.file_ids:
         raise HTTPException(status_code=400, detail="No file IDs provided")
     
-    try:
-        result = await db.files.update_many(
-            {"id": {"$in": request.file_ids}, "user_id": current_user.id},
-            {"$set": {"is_trashed": True, "trashed_at": datetime.now(timezone.utc).isoformat()}}
-        )
-        
-        return {
-            "success": True,
-            "deleted_count": result.modified_count
-        }
-    except Exception as e:
-        logger.error(f"Bulk delete error: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+    deleted = await trash_files(current_user.id, request.file_ids)
+    return {"success": True, "deleted_count": deleted}
+
+async def trash_files(user_id: str, file_ids: List[str]) -> int:
+    result = await db.files.update_many(
+        {"id": {"$in": file_ids}, "user_id": user_id, "is_trashed": {"$ne": True}},
+        {"$set": trash_fields(datetime.now(timezone.utc))}
+    )
+    return result.modified_count
+
+async def bulk_delete_job(job: "JobContext", user_id: str, params: dict) -> dict:
+    """Bulk deletes queued before they ran inline"""
+    return {"deleted_count": await trash_files(user_id, params['file_ids'])}
 
 
 @api_router.post("/files/bulk-share")
@@ -1542,7 +3337,6 @@ async def bulk_share_files(request: BulkShareRequest, current_user: User = Depen
         )
         
         collection_dict = collection.model_dump()
-        collection_dict['created_at'] = collection_dict['created_at'].isoformat()
         await db.shared_collections.insert_one(collection_dict)
         
         # Mark all files as public
@@ -1568,36 +3362,363 @@ async def bulk_share_files(request: BulkShareRequest, current_user: User = Depen
 @api_router.post("/files/trash/clear-all")
 async def clear_all_trash(current_user: User = Depends(get_current_user)):
     """Permanently delete all files in trash"""
+    logger.info(f"Clear trash requested by user {current_user.id}")
+    job = await enqueue_job(current_user.id, "clear_trash", {})
+    return {"success": True, "job_id": job.id}
+
+async def clear_trash_job(job: "JobContext", user_id: str, params: dict) -> dict:
+    """Purge the user's trash in batches; files already purged by an earlier attempt are gone from the query"""
+    user_doc = await db.users.find_one({"id": user_id}, {"_id": 0})
+    if not user_doc:
+        raise ValueError("User not found")
+    user = User(**user_doc)
+    
+    trashed_files = await db.files.find({"user_id": user_id, "is_trashed": True}, PURGE_FILE_FIELDS).to_list(None)
+    logger.info(f"Found {len(trashed_files)} files in trash")
+    deleted = failed = 0
+    for i in range(0, len(trashed_files), TRASH_PURGE_BATCH):
+        result = await purge_files(user, trashed_files[i:i + TRASH_PURGE_BATCH])
+        deleted += result["deleted"]
+        failed += result["failed"]
+        await job.progress(min(i + TRASH_PURGE_BATCH, len(trashed_files)) / len(trashed_files),
+                           deleted_count=deleted, failed_count=failed)
+    
+    # Trashed folders carry no Telegram data, so they go in one batch as in the expiry purge
+    folders_result = await db.folders.delete_many({"user_id": user_id, "is_trashed": True})
+    logger.info(f"Successfully deleted {deleted} files and {folders_result.deleted_count} folders, {failed} files left for retry")
+    return {"deleted_count": deleted, "failed_count": failed, "folders_deleted_count": folders_result.deleted_count}
+
+
+# ========== JOB LEASES ==========
+# Every backend process schedules the same background jobs; a lease in db.job_leases
+# decides which process actually runs each one. The holder renews it every
+# JOB_LEASE_TTL / 3 seconds, and when it dies the lease expires and another process takes
+# over. Expiry uses each host's clock, so clocks must agree to well within the TTL.
+
+JOB_LEASE_TTL = int(os.environ.get('JOB_LEASE_TTL', 30))  # Seconds
+LEASED_JOBS = ["trash_expiry", "person_count_reconcile"]
+PROCESS_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+held_leases = set()
+
+async def acquire_lease(name: str) -> bool:
+    """Take or renew the lease for a job; False when another live process holds it"""
+    now = datetime.now(timezone.utc)
     try:
-        logger.info(f"Clear trash requested by user {current_user.id}")
-        
-        # Get all trashed files
-        trashed_files = await db.files.find({
-            "user_id": current_user.id,
-            "is_trashed": True
-        }).to_list(None)
-        
-        logger.info(f"Found {len(trashed_files)} files in trash")
-        
-        deleted_count = 0
-        for file in trashed_files:
+        before = await db.job_leases.find_one_and_update(
+            {"_id": name, "$or": [{"holder": PROCESS_ID}, {"expires_at": {"$lte": now}}]},
+            {"$set": {
+                "holder": PROCESS_ID,
+                "host": socket.gethostname(),
+                "pid": os.getpid(),
+                "renewed_at": now,
+                "expires_at": now + timedelta(seconds=JOB_LEASE_TTL)
+            }},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE
+        )
+    except DuplicateKeyError:
+        # Lease exists and is held by someone else, so the upsert collided with it
+        return False
+    if not before or before.get('holder') != PROCESS_ID:
+        await db.job_leases.update_one({"_id": name, "holder": PROCESS_ID}, {"$set": {"acquired_at": now}})
+        logger.info(f"Acquired job lease {name} as {PROCESS_ID}")
+    return True
+
+async def release_leases():
+    """Expire our leases so another process can take over without waiting for the TTL"""
+    if held_leases:
+        await db.job_leases.update_many(
+            {"_id": {"$in": list(held_leases)}, "holder": PROCESS_ID},
+            {"$set": {"expires_at": datetime.now(timezone.utc)}}
+        )
+        held_leases.clear()
+
+def leased(name: str, func):
+    """Wrap a scheduled job so only the lease holder runs it"""
+    async def run():
+        if name in held_leases:
+            await func()
+    return run
+
+async def run_lease_keeper():
+    """Acquire/renew job leases and start or stop lease-bound tasks to match"""
+    global trash_scheduler_task
+    while True:
+        for name in LEASED_JOBS:
             try:
-                logger.info(f"Deleting file {file['id']}: {file.get('name', 'Unknown')}")
-                await permanently_delete_file(file, current_user)
-                await db.files.delete_one({"id": file['id']})
-                deleted_count += 1
+                held = await acquire_lease(name)
             except Exception as e:
-                logger.error(f"Error deleting file {file['id']}: {str(e)}")
-        
-        logger.info(f"Successfully deleted {deleted_count} files")
-        
-        return {
-            "success": True,
-            "deleted_count": deleted_count
-        }
+                # Cannot prove we still hold it; stop acting as leader
+                logger.error(f"Job lease {name} renewal failed: {str(e)}")
+                held = False
+            if held:
+                held_leases.add(name)
+            elif name in held_leases:
+                held_leases.discard(name)
+                logger.warning(f"Lost job lease {name}")
+        
+        trash_running = trash_scheduler_task is not None and not trash_scheduler_task.done()
+        if "trash_expiry" in held_leases and not trash_running:
+            trash_scheduler_task = asyncio.create_task(run_trash_scheduler())
+        elif "trash_expiry" not in held_leases and trash_running:
+            trash_scheduler_task.cancel()
+        await asyncio.sleep(JOB_LEASE_TTL / 3)
+
+@api_router.get("/jobs/leases")
+async def get_job_leases(current_user: User = Depends(get_current_user)):
+    """Which backend process runs each scheduled job"""
+    now = datetime.now(timezone.utc)
+    leases = await db.job_leases.find({"_id": {"$in": LEASED_JOBS}}).to_list(None)
+    by_name = {lease.pop('_id'): lease for lease in leases}
+    jobs = []
+    for name in LEASED_JOBS:
+        lease = by_name.get(name, {})
+        expires_at = lease.get('expires_at')
+        jobs.append({
+            "job": name,
+            "holder": lease.get('holder'),
+            "host": lease.get('host'),
+            "pid": lease.get('pid'),
+            "acquired_at": lease.get('acquired_at'),
+            "renewed_at": lease.get('renewed_at'),
+            "expires_at": expires_at,
+            "active": bool(expires_at and expires_at > now),
+            "held_by_this_process": name in held_leases
+        })
+    return {"process_id": PROCESS_ID, "jobs": jobs}
+
+
+# ========== JOB QUEUE ==========
+# Long user operations run as documents in db.jobs so the request returns at once and
+# the work survives restarts. Every process runs JOB_WORKERS workers on its event loop;
+# a worker claims the highest priority due job atomically, renews the job's lease while
+# the handler runs, and a job whose lease expires (its process died) is requeued.
+# Handlers must be idempotent since an attempt can be repeated after a crash.
+
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_USER_CONCURRENCY = int(os.environ.get('JOB_USER_CONCURRENCY', 1))  # Running jobs per user
+JOB_POLL_INTERVAL = 5  # Seconds; enqueue in this process wakes workers straight away
+JOB_RETRY_DELAY = 10  # Seconds before the first retry, doubled for each further attempt
+JOB_PRIORITY_HIGH = 10  # Operations the user is watching in the UI
+JOB_HISTORY = timedelta(days=7)
+
+job_wakeup = asyncio.Event()
+job_worker_tasks = []
+
+class JobContext:
+    """Handed to job handlers to report progress; each report also renews the job's lease"""
+    
+    def __init__(self, job: dict):
+        self.id = job['id']
+        self.attempt = job['attempts']
+        self.final_attempt = job['attempts'] >= job['max_attempts']  # A failure now is not retried
+    
+    async def progress(self, fraction: float, **result):
+        now = datetime.now(timezone.utc)
+        await db.jobs.update_one(
+            {"id": self.id, "worker": PROCESS_ID, "status": "running"},
+            {"$set": {
+                "progress": round(min(max(fraction, 0.0), 1.0), 4),
+                "lease_expires_at": now + timedelta(seconds=JOB_LEASE_TTL),
+                "updated_at": now,
+                **{f"result.{key}": value for key, value in result.items()}
+            }}
+        )
+
+async def enqueue_job(user_id: str, job_type: str, params: dict, priority: int = 0) -> Job:
+    """Store a job for the workers and wake the ones in this process"""
+    job = Job(user_id=user_id, type=job_type, params=params, priority=priority)
+    await db.jobs.insert_one(job.model_dump())
+    job_wakeup.set()
+    return job
+
+async def claim_job() -> Optional[dict]:
+    """Atomically take the best due job of a user below the concurrency limit"""
+    now = datetime.now(timezone.utc)
+    busy = await db.jobs.aggregate([
+        {"$match": {"status": "running"}},
+        {"$group": {"_id": "$user_id", "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gte": JOB_USER_CONCURRENCY}}}
+    ]).to_list(None)
+    
+    job = await db.jobs.find_one_and_update(
+        {"status": "queued", "run_after": {"$lte": now}, "user_id": {"$nin": [b['_id'] for b in busy]}},
+        {
+            "$set": {
+                "status": "running",
+                "worker": PROCESS_ID,
+                "started_at": now,
+                "updated_at": now,
+                "lease_expires_at": now + timedelta(seconds=JOB_LEASE_TTL)
+            },
+            "$inc": {"attempts": 1}
+        },
+        sort=[("priority", -1), ("created_at", 1)],
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if not job:
+        return None
+    
+    # Two workers can claim jobs of the same user at once; the earliest started keep their slots
+    running = await db.jobs.find(
+        {"user_id": job['user_id'], "status": "running"}, {"_id": 0, "id": 1}
+    ).sort([("started_at", 1), ("id", 1)]).to_list(None)
+    if job['id'] not in [r['id'] for r in running[:JOB_USER_CONCURRENCY]]:
+        await db.jobs.update_one(
+            {"id": job['id'], "worker": PROCESS_ID},
+            {"$set": {"status": "queued", "worker": None, "lease_expires_at": None}, "$inc": {"attempts": -1}}
+        )
+        return None
+    return job
+
+async def finish_job(job: dict, error: Optional[str] = None, result: Optional[dict] = None):
+    """Complete the job, or schedule a retry with exponential backoff until attempts run out"""
+    now = datetime.now(timezone.utc)
+    if error is None:
+        update = {"status": "completed", "progress": 1.0, "result": result or {}, "error": None, "finished_at": now}
+    elif job['attempts'] < job['max_attempts']:
+        delay = JOB_RETRY_DELAY * 2 ** (job['attempts'] - 1)
+        update = {"status": "queued", "run_after": now + timedelta(seconds=delay), "error": error}
+        logger.warning(f"Job {job['id']} ({job['type']}) attempt {job['attempts']} failed, retrying in {delay}s: {error}")
+    else:
+        update = {"status": "failed", "error": error, "finished_at": now}
+        logger.error(f"Job {job['id']} ({job['type']}) failed after {job['attempts']} attempts: {error}")
+    await db.jobs.update_one(
+        {"id": job['id'], "worker": PROCESS_ID, "status": "running"},
+        {"$set": {**update, "worker": None, "lease_expires_at": None, "updated_at": now}}
+    )
+
+async def run_job(job: dict):
+    """Run one claimed job, renewing its lease in the background"""
+    async def heartbeat():
+        while True:
+            await asyncio.sleep(JOB_LEASE_TTL / 3)
+            await db.jobs.update_one(
+                {"id": job['id'], "worker": PROCESS_ID, "status": "running"},
+                {"$set": {"lease_expires_at": datetime.now(timezone.utc) + timedelta(seconds=JOB_LEASE_TTL)}}
+            )
+    
+    handler = JOB_HANDLERS.get(job['type'])
+    keeper = asyncio.create_task(heartbeat())
+    try:
+        if handler is None:
+            raise ValueError(f"Unknown job type {job['type']}")
+        result = await handler(JobContext(job), job['user_id'], job['params'])
+        await finish_job(job, result=result)
+    except asyncio.CancelledError:
+        # Shutting down; hand the job back without spending an attempt
+        await db.jobs.update_one(
+            {"id": job['id'], "worker": PROCESS_ID, "status": "running"},
+            {"$set": {"status": "queued", "worker": None, "lease_expires_at": None}, "$inc": {"attempts": -1}}
+        )
+        raise
     except Exception as e:
-        logger.error(f"Clear trash error: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+        await finish_job(job, error=str(e))
+    finally:
+        keeper.cancel()
+
+async def requeue_stale_jobs():
+    """Return running jobs whose worker stopped renewing the lease to the queue"""
+    now = datetime.now(timezone.utc)
+    stale = await db.jobs.find(
+        {"status": "running", "lease_expires_at": {"$lt": now}}, {"_id": 0}
+    ).to_list(None)
+    for job in stale:
+        exhausted = job['attempts'] >= job['max_attempts']
+        await db.jobs.update_one(
+            {"id": job['id'], "status": "running", "lease_expires_at": job['lease_expires_at']},
+            {"$set": {
+                "status": "failed" if exhausted else "queued",
+                "error": f"Worker {job.get('worker')} stopped responding",
+                "worker": None,
+                "lease_expires_at": None,
+                "run_after": now,
+                "updated_at": now,
+                **({"finished_at": now} if exhausted else {})
+            }}
+        )
+        logger.warning(f"Job {job['id']} ({job['type']}) lost its worker {job.get('worker')}")
+    if stale:
+        job_wakeup.set()
+
+async def run_job_worker(index: int):
+    """Claim and run jobs until cancelled; worker 0 also requeues jobs of dead processes"""
+    next_reap = 0.0
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            if index == 0 and loop.time() >= next_reap:
+                await requeue_stale_jobs()
+                next_reap = loop.time() + JOB_LEASE_TTL
+            job = await claim_job()
+            if job:
+                await run_job(job)
+                continue
+            job_wakeup.clear()
+            try:
+                await asyncio.wait_for(job_wakeup.wait(), JOB_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Job worker {index} error: {str(e)}")
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+
+async def folder_operation_job(job: JobContext, user_id: str, params: dict) -> dict:
+    """Run a recorded folder delete/restore; progress stays on the folder operation document"""
+    doc = await db.folder_operations.find_one({"id": params['operation_id'], "user_id": user_id}, {"_id": 0})
+    if not doc:
+        raise ValueError("Folder operation not found")
+    await run_folder_operation(FolderOperation(**doc))
+    doc = await db.folder_operations.find_one({"id": params['operation_id']}, {"_id": 0})
+    return {
+        "operation_id": doc['id'],
+        "folders_processed": doc['folders_processed'],
+        "files_processed": doc['files_processed']
+    }
+
+JOB_HANDLERS = {
+    "clear_trash": clear_trash_job,
+    "bulk_delete": bulk_delete_job,
+    "merge_people": merge_people_job,
+    "folder_operation": folder_operation_job,
+    "recluster": recluster_job,
+}
+
+JOB_FIELDS = {"_id": 0, "params": 0, "worker": 0, "lease_expires_at": 0}
+
+@api_router.get("/jobs")
+async def list_jobs(state: Optional[str] = None, limit: int = 50, current_user: User = Depends(get_current_user)):
+    """The user's most recent jobs, optionally only those in one state (queued, running, ...)"""
+    limit = max(1, min(limit, 200))
+    query = {"user_id": current_user.id}
+    if state:
+        query["status"] = state
+    jobs = await db.jobs.find(query, JOB_FIELDS).sort("created_at", -1).limit(limit).to_list(limit)
+    return FastJSONResponse(jobs)
+
+@api_router.get("/jobs/{job_id}")
+async def get_job(job_id: str, current_user: User = Depends(get_current_user)):
+    """Status, progress and result of a background job"""
+    job = await db.jobs.find_one({"id": job_id, "user_id": current_user.id}, JOB_FIELDS)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return FastJSONResponse(job)
+
+
+# ========== METRICS ==========
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint(request: Request):
+    """Prometheus scrape endpoint; set METRICS_TOKEN to require it as a bearer token"""
+    token = os.environ.get('METRICS_TOKEN')
+    if token and request.headers.get("authorization") != f"Bearer {token}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
 
 
 # Include router
@@ -1609,37 +3730,98 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
+# Outermost, so it times everything including CORS preflights
+app.add_middleware(MetricsMiddleware)
 
-# Initialize background scheduler for trash cleanup
+# Initialize background scheduler for periodic maintenance
 scheduler = AsyncIOScheduler()
+trash_scheduler_task = None
+lease_keeper_task = None
+login_sweeper_task = None
+loop_lag_task = None
+loop_watchdog = None
 
 @app.on_event("startup")
 async def startup_scheduler():
-    """Start background scheduler for trash cleanup"""
+    """Start the job lease keeper and periodic maintenance jobs
+    Every process schedules the jobs; only the lease holder runs each one
+    """
+    global lease_keeper_task, login_sweeper_task, loop_lag_task, loop_watchdog
+    lease_keeper_task = asyncio.create_task(run_lease_keeper())
+    loop_lag_task = asyncio.create_task(monitor_loop_lag())
+    loop_watchdog = watchdog_from_env(on_stall=record_loop_stall, logger=logger)
+    login_sweeper_task = asyncio.create_task(login_sessions.run_sweeper())
+    if os.environ.get('TELEGRAM_API_ID'):
+        login_client_pool.refill()
+    job_worker_tasks.extend(asyncio.create_task(run_job_worker(i)) for i in range(JOB_WORKERS))
     try:
-        # Run cleanup every hour
         scheduler.add_job(
-            cleanup_old_trash,
-            trigger=IntervalTrigger(hours=1),
-            id='trash_cleanup',
-            name='Clean up old trash files',
+            user_clients.sweep,
+            trigger=IntervalTrigger(seconds=60),
+            id='user_client_sweep',
+            name='Disconnect idle Telegram clients',
+            replace_existing=True
+        )
+        scheduler.add_job(
+            leased("person_count_reconcile", reconcile_all_person_files),
+            trigger=IntervalTrigger(hours=24),
+            id='person_count_reconcile',
+            name='Repair person photo counts',
             replace_existing=True
         )
         scheduler.start()
-        logger.info("Background scheduler started - trash cleanup will run every hour")
+        logger.info("Background scheduler started")
     except Exception as e:
         logger.error(f"Failed to start scheduler: {str(e)}")
 
+migration_task = None
+
+@app.on_event("startup")
+async def startup_migrations():
+    """Create indexes and run data migrations in the background"""
+    global migration_task
+    try:
+        await ensure_indexes()
+    except Exception as e:
+        logger.error(f"Failed to create indexes: {str(e)}")
+    migration_task = asyncio.create_task(run_migrations())
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for user_id, index in list(face_matrices.items()):
+        await save_face_index(user_id, index)
+    if migration_task and not migration_task.done():
+        migration_task.cancel()
+    if lease_keeper_task:
+        lease_keeper_task.cancel()
+    if loop_lag_task:
+        loop_lag_task.cancel()
+    if loop_watchdog:
+        loop_watchdog.stop()
+    if trash_scheduler_task:
+        trash_scheduler_task.cancel()
+    # Running jobs go back to the queue for another process
+    for task in job_worker_tasks:
+        task.cancel()
+    await asyncio.gather(*job_worker_tasks, return_exceptions=True)
+    try:
+        await release_leases()
+    except Exception as e:
+        logger.error(f"Failed to release job leases: {str(e)}")
+    if cluster_pool:
+        cluster_pool.shutdown(wait=False, cancel_futures=True)
+    # Disconnect pending Telegram logins and warm user clients
+    if login_sweeper_task:
+        login_sweeper_task.cancel()
+    try:
+        await login_client_pool.close()
+        await login_sessions.shutdown()
+        await user_clients.close()
+    except Exception as e:
+        logger.error(f"Failed to close Telegram clients: {str(e)}")
     client.close()
     # Shutdown scheduler
     if scheduler.running:
         scheduler.shutdown()
-    # Cleanup telegram clients
-    for session_data in telegram_clients.values():
-        try:
-            await session_data['client'].disconnect()
-        except:
-            pass
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Benchmark for offline face re-clustering (face_cluster.py)
+Builds a synthetic library where every real person was split into up to three
+duplicate people, as online matching tends to do, then times the neighbour
+search in a process pool, Chinese whispers and planning, and reports how many
+people remain after the planned moves.
+
+Usage: python benchmarks/bench_face_cluster.py [people] [faces_per_person] [workers]
+"""
+
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+from face_cluster import KNN_NEIGHBOURS, chinese_whispers, knn_rows, plan_assignments  # noqa: E402
+from bench_face_index import make_library  # noqa: E402
+
+THRESHOLD = 0.5  # FACE_PRIMARY_THRESHOLD
+
+
+def main():
+    people = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    per_person = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else (os.cpu_count() or 1)
+
+    _, _, vectors, _ = make_library(people, per_person)
+    truth = np.repeat(np.arange(people), per_person)
+    rng = np.random.default_rng(2)
+    # Duplicate people: each face lands on one of up to three labels of its real person
+    labels = truth * 3 + rng.integers(0, rng.integers(1, 4, people)[truth])
+    _, labels = np.unique(labels, return_inverse=True)
+    named = rng.random(labels.max() + 1) < 0.1
+    print(f"{len(vectors)} faces, {people} real people stored as {labels.max() + 1} people, {workers} workers")
+
+    with tempfile.TemporaryDirectory() as tmp, ProcessPoolExecutor(workers) as pool:
+        path = os.path.join(tmp, 'descriptors.npy')
+        np.save(path, vectors)
+        count = len(vectors)
+        chunk = -(-count // 64)
+        spans = [(lo, min(lo + chunk, count)) for lo in range(0, count, chunk)]
+
+        start = time.perf_counter()
+        parts = list(pool.map(knn_rows, *zip(*[(path, lo, hi, KNN_NEIGHBOURS, THRESHOLD) for lo, hi in spans])))
+        sources = np.concatenate([p[0] for p in parts])
+        targets = np.concatenate([p[1] for p in parts])
+        print(f"neighbours  {time.perf_counter() - start:7.2f} s ({len(sources)} edges)")
+
+    start = time.perf_counter()
+    clusters = chinese_whispers(count, sources, targets)
+    print(f"clustering  {time.perf_counter() - start:7.2f} s ({clusters.max() + 1} clusters)")
+
+    start = time.perf_counter()
+    planned = plan_assignments(clusters, labels, named)
+    print(f"planning    {time.perf_counter() - start:7.2f} s ({int((planned != labels).sum())} faces moved)")
+
+    purity = sum(np.bincount(truth[clusters == c]).max() for c in np.unique(clusters)) / count
+    print(f"cluster purity {purity:.3f}, people after moves {len(np.unique(planned))}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Recall/latency benchmark for the approximate face index
+Builds a synthetic library of clustered 128-d descriptors, then compares
+IVFFaceIndex at several nprobe values against the exact FaceMatrix.
+Recall is the share of queries where the approximate index picks the same
+person as exact search.
+
+Usage: python benchmarks/bench_face_index.py [people] [faces_per_person] [queries]
+"""
+
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+from face_index import DESCRIPTOR_DIM, FaceMatrix, IVFFaceIndex  # noqa: E402
+
+
+def make_library(people, per_person, seed=0):
+    """Person centres spread like face embeddings, faces jittered around them"""
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(scale=0.04, size=(people, DESCRIPTOR_DIM)).astype(np.float32)
+    labels = np.repeat(np.arange(people), per_person)
+    vectors = centres[labels] + rng.normal(scale=0.025, size=(len(labels), DESCRIPTOR_DIM)).astype(np.float32)
+    person_ids = [f"person-{p}" for p in labels]
+    face_ids = [f"face-{i}" for i in range(len(labels))]
+    return face_ids, person_ids, vectors, centres
+
+
+def timed_queries(index, queries):
+    results, timings = [], []
+    for q in queries:
+        start = time.perf_counter()
+        results.append(index.match(q))
+        timings.append(time.perf_counter() - start)
+    timings = np.array(timings) * 1000
+    return results, np.percentile(timings, 50), np.percentile(timings, 95)
+
+
+def main():
+    people = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    per_person = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    query_count = int(sys.argv[3]) if len(sys.argv) > 3 else 300
+
+    face_ids, person_ids, vectors, centres = make_library(people, per_person)
+    rng = np.random.default_rng(1)
+    query_people = rng.integers(0, people, query_count)
+    queries = centres[query_people] + rng.normal(scale=0.025, size=(query_count, DESCRIPTOR_DIM)).astype(np.float32)
+    print(f"{len(face_ids)} faces, {people} people, {query_count} queries")
+
+    exact = FaceMatrix.from_rows(0, face_ids, person_ids, vectors)
+    exact_results, p50, p95 = timed_queries(exact, queries)
+    print(f"{'exact':<14} p50 {p50:7.2f} ms   p95 {p95:7.2f} ms")
+
+    start = time.perf_counter()
+    ivf = IVFFaceIndex.build(0, face_ids, person_ids, vectors)
+    print(f"ivf build      {time.perf_counter() - start:7.2f} s ({len(ivf.centroids)} lists)")
+
+    for nprobe in (1, 4, 8, 16, 32):
+        ivf.nprobe = nprobe
+        results, p50, p95 = timed_queries(ivf, queries)
+        recall = np.mean([a is not None and b is not None and a[0] == b[0] for a, b in zip(exact_results, results)])
+        print(f"ivf nprobe={nprobe:<3} p50 {p50:7.2f} ms   p95 {p95:7.2f} ms   recall {recall:.3f}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        ivf.save(tmp)
+        saved = time.perf_counter() - start
+        start = time.perf_counter()
+        loaded = IVFFaceIndex.load(tmp)
+        print(f"save {saved:.2f} s, mmap load {time.perf_counter() - start:.2f} s")
+        loaded.nprobe = 8
+        results, p50, p95 = timed_queries(loaded, queries)
+        recall = np.mean([a[0] == b[0] for a, b in zip(exact_results, results)])
+        print(f"{'ivf (mmap)':<14} p50 {p50:7.2f} ms   p95 {p95:7.2f} ms   recall {recall:.3f}")
+
+
+if __name__ == '__main__':
+    main()
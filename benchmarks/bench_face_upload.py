@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Benchmark for POST /api/faces request decoding
+Compares JSON float lists against base64 packed float32 descriptors, from raw
+body bytes to the (n, 128) float32 matrix that face matching works on.
+
+Usage: python benchmarks/bench_face_upload.py [detections]
+"""
+
+import base64
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'telestore_bench')
+
+import server  # noqa: E402
+
+
+def make_body(count, packed):
+    rng = np.random.default_rng(0)
+    descriptors = rng.normal(scale=0.1, size=(count, server.DESCRIPTOR_DIM)).astype(np.float32)
+    detections = []
+    for vector in descriptors:
+        descriptor = base64.b64encode(vector.tobytes()).decode() if packed else vector.tolist()
+        detections.append({
+            "box": {"x": 10.5, "y": 20.25, "width": 80.0, "height": 96.0},
+            "descriptor": descriptor,
+            "confidence": 0.93,
+        })
+    return json.dumps({"file_id": "bench-file", "detections": detections}).encode()
+
+
+def decode(body):
+    # Same steps FastAPI + ingest_faces take: json parse, model validation, stacking
+    face_data = server.FaceDataCreate.model_validate(json.loads(body))
+    return server.stack_descriptors([d.descriptor for d in face_data.detections])
+
+
+def bench(label, body, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        matrix = decode(body)
+        timings.append(time.perf_counter() - start)
+    print(f"{label:<8} best {min(timings) * 1000:8.3f} ms   body {len(body) / 1024:8.1f} KiB")
+    return min(timings), matrix
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    repeat = 20
+    print(f"face upload decoding, {count} detections, {repeat} runs")
+
+    before, lists = bench("json", make_body(count, packed=False), repeat)
+    after, packed = bench("base64", make_body(count, packed=True), repeat)
+
+    assert np.allclose(lists, packed)
+    print(f"speedup  {before / after:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Benchmark for GET /api/files serialization
+Compares the old path (fromisoformat loop + response_model validation + stdlib JSON)
+against the trusted-row orjson stream used by list_files now.
+
+Usage: python benchmarks/bench_list_files.py [rows]
+"""
+
+import asyncio
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'telestore_bench')
+
+from pydantic import TypeAdapter  # noqa: E402
+import server  # noqa: E402
+
+
+def make_rows(count):
+    """Build rows shaped like db.files documents"""
+    now = datetime.now(timezone.utc)
+    rows = []
+    for i in range(count):
+        rows.append({
+            "id": str(uuid.uuid4()),
+            "user_id": "bench-user",
+            "name": f"IMG_{i:05d}.jpg",
+            "size": 1024 * (i + 1),
+            "mime_type": "image/jpeg",
+            "telegram_msg_id": i + 1,
+            "telegram_file_id": f"BQACAgUAAxkBAAI{i:08d}",
+            "thumbnail_url": f"https://i.ibb.co/bench/{i}.jpg",
+            "thumbnail_provider": "imgbb",
+            "folder_id": None,
+            "is_trashed": False,
+            "trashed_at": None,
+            "is_public": False,
+            "share_token": None,
+            "created_at": (now - timedelta(minutes=i)).isoformat(),
+        })
+    return rows
+
+
+class ListCursor:
+    """Async iterator standing in for a Motor cursor"""
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def __aiter__(self):
+        self._it = iter(self.rows)
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._it)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+adapter = TypeAdapter(List[server.FileMetadata])
+
+
+def old_path(rows):
+    files = [dict(r) for r in rows]
+    for f in files:
+        if isinstance(f['created_at'], str):
+            f['created_at'] = datetime.fromisoformat(f['created_at'])
+    validated = adapter.validate_python(files)
+    content = adapter.dump_python(validated, mode="json")
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+async def new_path(rows):
+    chunks = []
+    async for chunk in server.stream_json_rows(ListCursor(rows)):
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+
+def bench(label, fn, repeat):
+    timings = []
+    body = b''
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = fn()
+        timings.append(time.perf_counter() - start)
+    best = min(timings) * 1000
+    avg = sum(timings) / len(timings) * 1000
+    print(f"{label:<8} best {best:8.2f} ms   avg {avg:8.2f} ms   body {len(body) / 1024:8.1f} KiB")
+    return best
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    repeat = 10
+    rows = make_rows(count)
+    print(f"list_files serialization, {count} rows, {repeat} runs")
+
+    before = bench("before", lambda: old_path(rows), repeat)
+    after = bench("after", lambda: asyncio.run(new_path(rows)), repeat)
+
+    # Both paths must agree on content
+    assert len(json.loads(old_path(rows))) == len(json.loads(asyncio.run(new_path(rows))))
+    print(f"speedup  {before / after:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -47,6 +47,16 @@ import ImageGalleryModal from '../components/ImageGalleryModal';
 import UploadQueue from '../components/UploadQueue';
 import { ChunkedUploader, shouldUseChunkedUpload } from '../utils/chunkedUpload';
 
+// Face descriptor as base64 of its float32 bytes; much cheaper for the backend than 128 JSON floats
+const packDescriptor = (descriptor) => {
+  const bytes = new Uint8Array(Float32Array.from(descriptor).buffer);
+  let binary = '';
+  for (let i = 0; i < bytes.length; i++) {
+    binary += String.fromCharCode(bytes[i]);
+  }
+  return btoa(binary);
+};
+
 export default function Dashboard({ user, onLogout }) {
   const navigate = useNavigate();
   const [files, setFiles] = useState([]);
@@ -99,12 +109,11 @@ export default function Dashboard({ user, onLogout }) {
   const loadData = async () => {
     try {
       setLoading(true);
-      const [filesRes, foldersRes] = await Promise.all([
-        axios.get(`${API}/files`, { params: { folder_id: currentFolder } }),
-        axios.get(`${API}/folders`, { params: { parent_id: currentFolder } }),
-      ]);
-      setFiles(filesRes.data);
-      setFolders(foldersRes.data);
+      const response = await axios.get(`${API}/folders/view`, {
+        params: { folder_id: currentFolder, view: 'grid' },
+      });
+      setFiles(response.data.files);
+      setFolders(response.data.folders);
     } catch (error) {
       toast.error('Failed to load files');
     } finally {
@@ -404,7 +413,7 @@ export default function Dashboard({ user, onLogout }) {
               width: detection.detection.box.width,
               height: detection.detection.box.height,
             },
-            descriptor: Array.from(detection.descriptor),
+            descriptor: packDescriptor(detection.descriptor),
             confidence: detection.detection.score,
           })),
       };
@@ -658,8 +667,8 @@ export default function Dashboard({ user, onLogout }) {
       const response = await axios.post(`${API}/files/bulk-delete`, {
         file_ids: selectedItems
       });
-      toast.success(`${response.data.deleted_count} items moved to trash`);
       setSelectedItems([]);
+      toast.success(`${response.data.deleted_count} items moved to trash`);
       loadData();
     } catch (error) {
       toast.error('Failed to delete items');
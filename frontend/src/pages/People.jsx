@@ -25,6 +25,8 @@ import {
 } from 'lucide-react';
 import ImageGalleryModal from '../components/ImageGalleryModal';
 
+const PHOTOS_PAGE_SIZE = 100;
+
 export default function People({ user, onLogout }) {
   const navigate = useNavigate();
   const [people, setPeople] = useState([]);
@@ -32,6 +34,7 @@ export default function People({ user, onLogout }) {
   const [personPhotos, setPersonPhotos] = useState([]);
   const [loading, setLoading] = useState(true);
   const [photosLoading, setPhotosLoading] = useState(false);
+  const [photosCursor, setPhotosCursor] = useState(null);
   const [renameDialog, setRenameDialog] = useState(false);
   const [renamePerson, setRenamePerson] = useState(null);
   const [newName, setNewName] = useState('');
@@ -59,8 +62,11 @@ export default function People({ user, onLogout }) {
     try {
       setSelectedPerson(person);
       setPhotosLoading(true);
-      const response = await axios.get(`${API}/people/${person.id}/photos`);
+      const response = await axios.get(`${API}/people/${person.id}/photos`, {
+        params: { limit: PHOTOS_PAGE_SIZE },
+      });
       setPersonPhotos(response.data);
+      setPhotosCursor(response.headers['x-next-cursor'] || null);
     } catch (error) {
       toast.error('Failed to load photos');
     } finally {
@@ -68,6 +74,19 @@ export default function People({ user, onLogout }) {
     }
   };
 
+  const loadMorePhotos = async () => {
+    if (!selectedPerson || !photosCursor) return;
+    try {
+      const response = await axios.get(`${API}/people/${selectedPerson.id}/photos`, {
+        params: { limit: PHOTOS_PAGE_SIZE, cursor: photosCursor },
+      });
+      setPersonPhotos((photos) => [...photos, ...response.data]);
+      setPhotosCursor(response.headers['x-next-cursor'] || null);
+    } catch (error) {
+      toast.error('Failed to load photos');
+    }
+  };
+
   const handleRename = async () => {
     if (!newName.trim()) return;
 
@@ -250,7 +269,7 @@ export default function People({ user, onLogout }) {
                         {getPersonDisplayName(selectedPerson, people.findIndex(p => p.id === selectedPerson.id))}
                       </h2>
                       <p className="text-sm text-gray-500">
-                        {personPhotos.length} {personPhotos.length === 1 ? 'photo' : 'photos'}
+                        {selectedPerson.photo_count} {selectedPerson.photo_count === 1 ? 'photo' : 'photos'}
                       </p>
                     </div>
                     <div className="flex space-x-2">
@@ -311,6 +330,14 @@ export default function People({ user, onLogout }) {
                       ))}
                     </div>
                   )}
+
+                  {!photosLoading && photosCursor && (
+                    <div className="flex justify-center mt-4">
+                      <Button variant="outline" size="sm" onClick={loadMorePhotos}>
+                        Load more
+                      </Button>
+                    </div>
+                  )}
                 </div>
               ) : (
                 <div className="bg-white rounded-lg shadow-sm p-8">
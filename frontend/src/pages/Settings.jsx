@@ -80,31 +80,34 @@ export default function Settings({ user, onLogout }) {
   };
 
   const pollQRVerification = async (sessionId) => {
-    const maxAttempts = 30;
-    let attempts = 0;
-
-    const poll = setInterval(async () => {
-      attempts++;
-      if (attempts > maxAttempts) {
-        clearInterval(poll);
-        toast.error('QR code expired');
-        setQrCode(null);
-        return;
-      }
+    // Each request is held open by the server until the QR is scanned or `wait` runs out
+    const wait = 25;
+    const deadline = Date.now() + 2 * 60 * 1000;
 
+    while (Date.now() < deadline) {
       try {
-        const response = await axios.post(`${API}/telegram/verify-qr`, { session_id: sessionId });
+        const started = Date.now();
+        const response = await axios.post(`${API}/telegram/verify-qr`, { session_id: sessionId, wait });
         if (response.data.success) {
-          clearInterval(poll);
           toast.success('Telegram connected successfully!');
           setTelegramConnected(true);
           setQrCode(null);
           window.location.reload();
+          return;
+        }
+        if (response.data.expired) break;
+        // Answered long before `wait` ran out, so the server did not hold the request; don't spin
+        if (Date.now() - started < (wait * 1000) / 2) {
+          await new Promise((resolve) => setTimeout(resolve, 3000));
         }
       } catch (error) {
-        // Continue polling
+        if (error.response?.status === 404) break;
+        // Network hiccup, back off briefly and keep waiting
+        await new Promise((resolve) => setTimeout(resolve, 2000));
       }
-    }, 2000);
+    }
+    toast.error('QR code expired');
+    setQrCode(null);
   };
 
   const handleRequestPhoneCode = async () => {
@@ -2,6 +2,7 @@ import { useState, useEffect } from 'react';
 import { useNavigate } from 'react-router-dom';
 import axios from 'axios';
 import { API } from '../App';
+import { waitForJob } from '../utils/jobs';
 import { Button } from '../components/ui/button';
 import { Card } from '../components/ui/card';
 import {
@@ -83,8 +84,9 @@ export default function TrashPage({ user, onLogout }) {
       console.log('Clearing trash...');
       const response = await axios.post(`${API}/files/trash/clear-all`);
       console.log('Clear trash response:', response.data);
-      toast.success(`${response.data.deleted_count} files permanently deleted`);
       setClearTrashDialog(false);
+      const result = await waitForJob(response.data.job_id);
+      toast.success(`${result.deleted_count} files permanently deleted`);
       loadTrashFiles();
     } catch (error) {
       console.error('Clear trash error:', error);
@@ -0,0 +1,26 @@
+/**
+ * Background Job Helper
+ * Long operations (clear trash, bulk delete, merge, folder delete) return a job id
+ * straight away; this polls GET /jobs/{id} until the job finishes
+ */
+
+import axios from 'axios';
+import { API } from '../App';
+
+const POLL_INTERVAL = 1000; // 1s
+
+/**
+ * Wait for a background job to complete
+ * @param {string} jobId - Id returned by the endpoint that queued the job
+ * @param {Function} onProgress - Optional callback (fraction 0..1, partial result)
+ * @returns {Promise<Object>} The job's result
+ */
+export async function waitForJob(jobId, onProgress) {
+  for (;;) {
+    const { data: job } = await axios.get(`${API}/jobs/${jobId}`);
+    if (job.status === 'completed') return job.result;
+    if (job.status === 'failed') throw new Error(job.error || 'Job failed');
+    if (onProgress) onProgress(job.progress, job.result);
+    await new Promise((resolve) => setTimeout(resolve, POLL_INTERVAL));
+  }
+}
@@ -0,0 +1,70 @@
+import numpy as np
+
+from face_cluster import chinese_whispers, plan_assignments
+
+
+def edges(*pairs) -> tuple:
+    sources, targets = zip(*pairs)
+    return np.array(sources, dtype=np.int64), np.array(targets, dtype=np.int64)
+
+
+def test_chinese_whispers_separates_components():
+    # Two triangles and an isolated node
+    sources, targets = edges((0, 1), (1, 2), (2, 0), (3, 4), (4, 5), (5, 3))
+    clusters = chinese_whispers(7, sources, targets)
+    assert len(set(clusters[:3])) == 1
+    assert len(set(clusters[3:6])) == 1
+    assert clusters[0] != clusters[3]
+    assert clusters[6] not in clusters[:6]
+    assert sorted(set(clusters.tolist())) == [0, 1, 2]
+
+
+def test_chinese_whispers_ignores_duplicate_and_reversed_edges():
+    sources, targets = edges((0, 1), (1, 0), (0, 1), (2, 3))
+    clusters = chinese_whispers(4, sources, targets)
+    assert clusters[0] == clusters[1]
+    assert clusters[2] == clusters[3]
+    assert clusters[0] != clusters[2]
+
+
+def test_chinese_whispers_is_deterministic_for_a_seed():
+    rng = np.random.default_rng(1)
+    sources = rng.integers(0, 50, 200)
+    targets = rng.integers(0, 50, 200)
+    np.testing.assert_array_equal(
+        chinese_whispers(50, sources, targets, seed=3),
+        chinese_whispers(50, sources, targets, seed=3)
+    )
+
+
+def test_plan_merges_duplicate_unnamed_people():
+    clusters = np.array([0, 0, 0, 0])
+    people = np.array([0, 0, 0, 1])
+    named = np.array([False, False])
+    np.testing.assert_array_equal(plan_assignments(clusters, people, named), [0, 0, 0, 0])
+
+
+def test_plan_never_moves_faces_of_named_people():
+    clusters = np.array([0, 0, 0, 0])
+    people = np.array([0, 1, 1, 1])
+    named = np.array([True, False])
+    # The cluster goes to the named person even though person 1 holds most of it
+    np.testing.assert_array_equal(plan_assignments(clusters, people, named), [0, 0, 0, 0])
+
+    named = np.array([False, True])
+    np.testing.assert_array_equal(plan_assignments(clusters, people, named), [1, 1, 1, 1])
+
+
+def test_plan_splits_an_unnamed_person_across_clusters():
+    clusters = np.array([0, 0, 0, 1, 1])
+    people = np.array([0, 0, 0, 0, 0])
+    named = np.array([False])
+    # Person 0 keeps its largest cluster; the other becomes the first new person (-1)
+    np.testing.assert_array_equal(plan_assignments(clusters, people, named), [0, 0, 0, -1, -1])
+
+
+def test_plan_leaves_small_clusters_alone():
+    clusters = np.array([0, 0, 1])
+    people = np.array([0, 0, 1])
+    named = np.array([False, False])
+    np.testing.assert_array_equal(plan_assignments(clusters, people, named, min_cluster_size=2), [0, 0, 1])
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from face_index import IVFFaceIndex
+
+
+def make_index(version: int = 1, people: int = 4, per_person: int = 30) -> tuple:
+    """IVF index over well separated people; returns (index, descriptors)"""
+    rng = np.random.default_rng(0)
+    centres = rng.normal(size=(people, 128)).astype(np.float32)
+    descriptors = np.concatenate([c + rng.normal(scale=0.01, size=(per_person, 128)) for c in centres]).astype(np.float32)
+    person_ids = [f"p{i // per_person}" for i in range(len(descriptors))]
+    face_ids = [f"f{i}" for i in range(len(descriptors))]
+    index = IVFFaceIndex.build(version, face_ids, person_ids, descriptors, nlist=4, nprobe=2)
+    return index, descriptors
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_save_load_round_trip(tmp_path, mmap):
+    index, descriptors = make_index()
+    index.remove_faces(["f0"])
+    index.save(tmp_path)
+
+    loaded = IVFFaceIndex.load(tmp_path, mmap=mmap)
+    assert loaded is not None
+    assert loaded.version == index.version
+    assert loaded.nprobe == index.nprobe
+    assert loaded.live == index.live == len(descriptors) - 1
+    assert "f0" not in loaded.face_rows
+    np.testing.assert_allclose(loaded.centroids, index.centroids)
+    for row in (1, 35, 70, 119):
+        assert loaded.match(descriptors[row]) == index.match(descriptors[row])
+        assert loaded.match(descriptors[row])[0] == f"p{row // 30}"
+
+
+def test_load_returns_none_when_nothing_was_saved(tmp_path):
+    assert IVFFaceIndex.load(tmp_path) is None
+    assert IVFFaceIndex.load_centroids(tmp_path) is None
+
+
+def test_load_returns_none_when_current_points_at_a_missing_directory(tmp_path):
+    (tmp_path / "CURRENT").write_text("v7-1")
+    assert IVFFaceIndex.load(tmp_path) is None
+
+
+def test_save_keeps_only_the_current_and_newer_directories(tmp_path):
+    index, _ = make_index(version=3)
+    index.save(tmp_path)
+    (tmp_path / "v9-12345").mkdir()  # Another process still writing a newer version
+    index.version = 4
+    index.save(tmp_path)
+
+    assert sorted(p.name for p in tmp_path.iterdir() if p.is_dir()) == [(tmp_path / "CURRENT").read_text(), "v9-12345"]
+    assert not list(tmp_path.glob("CURRENT*.tmp"))
+    assert IVFFaceIndex.load(tmp_path).version == 4
+
+
+def test_load_centroids_without_loading_the_index(tmp_path):
+    index, _ = make_index()
+    index.save(tmp_path)
+    np.testing.assert_allclose(IVFFaceIndex.load_centroids(tmp_path), index.centroids)
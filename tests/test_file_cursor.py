@@ -0,0 +1,49 @@
+from datetime import datetime, timezone
+
+import pytest
+from fastapi import HTTPException
+
+from server import apply_file_cursor, decode_file_cursor, encode_file_cursor
+
+
+def test_cursor_round_trip():
+    created_at = datetime(2024, 5, 1, 12, 30, 15, 250000, tzinfo=timezone.utc)
+    cursor = encode_file_cursor({"created_at": created_at, "id": "file-1", "name": "ignored"})
+    assert decode_file_cursor(cursor) == (created_at, "file-1")
+
+
+def test_naive_datetimes_are_read_back_as_utc():
+    cursor = encode_file_cursor({"created_at": datetime(2024, 5, 1, 12, 0), "id": "file-1"})
+    created_at, _ = decode_file_cursor(cursor)
+    assert created_at == datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def test_cursor_is_url_safe():
+    cursor = encode_file_cursor({"created_at": datetime.now(timezone.utc), "id": "a/b+c?d"})
+    assert all(c.isalnum() or c in "-_=" for c in cursor)
+
+
+@pytest.mark.parametrize("cursor", ["", "not-a-cursor", "bm90IGpzb24=", "WyJub3QgYSBkYXRlIiwgIngiXQ=="])
+def test_invalid_cursor_is_a_bad_request(cursor):
+    with pytest.raises(HTTPException) as excinfo:
+        decode_file_cursor(cursor)
+    assert excinfo.value.status_code == 400
+
+
+def test_apply_cursor_selects_rows_after_the_cursor():
+    created_at = datetime(2024, 5, 1, tzinfo=timezone.utc)
+    query = {"user_id": "u1", "is_trashed": False}
+    cursor = encode_file_cursor({"created_at": created_at, "id": "file-9"})
+    assert apply_file_cursor(query, cursor) == {
+        "user_id": "u1",
+        "is_trashed": False,
+        "$or": [
+            {"created_at": {"$gt": created_at}},
+            {"created_at": created_at, "id": {"$gt": "file-9"}},
+        ],
+    }
+
+
+def test_apply_without_cursor_leaves_query_alone():
+    query = {"user_id": "u1"}
+    assert apply_file_cursor(query, None) is query
@@ -0,0 +1,59 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from server import LoginSessionManager
+
+
+class FakeClient:
+    def __init__(self):
+        self.connected = True
+
+    async def disconnect(self):
+        self.connected = False
+
+
+def add_login(manager: LoginSessionManager, session_id: str, expires_in: timedelta) -> dict:
+    entry = {
+        'client': FakeClient(),
+        'qr_login': None,
+        'expires_at': datetime.now(timezone.utc) + expires_in,
+        'watcher': None,
+    }
+    manager.sessions[session_id] = entry
+    return entry
+
+
+def test_get_hides_expired_logins():
+    manager = LoginSessionManager()
+    live = add_login(manager, "live", timedelta(minutes=5))
+    add_login(manager, "expired", timedelta(seconds=-1))
+
+    assert manager.get("live") is live
+    assert manager.get("expired") is None
+    assert manager.get("unknown") is None
+
+
+def test_sweep_disconnects_only_expired_logins():
+    manager = LoginSessionManager()
+    live = add_login(manager, "live", timedelta(minutes=5))
+    expired = add_login(manager, "expired", timedelta(seconds=-1))
+
+    asyncio.run(manager.sweep())
+
+    assert list(manager.sessions) == ["live"]
+    assert live['client'].connected
+    assert not expired['client'].connected
+
+
+def test_sweep_cancels_the_watcher_of_an_expired_qr_login():
+    async def scenario():
+        manager = LoginSessionManager()
+        entry = add_login(manager, "qr", timedelta(seconds=-1))
+        entry['watcher'] = asyncio.create_task(asyncio.sleep(60))
+        await manager.sweep()
+        await asyncio.sleep(0)
+        return entry
+
+    entry = asyncio.run(scenario())
+    assert entry['watcher'].cancelled()
+    assert not entry['client'].connected
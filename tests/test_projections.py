@@ -0,0 +1,50 @@
+import pytest
+from fastapi import HTTPException
+
+import server
+from server import FILE_LIST_VIEWS, FileMetadata, model_projection, resolve_projection
+
+
+def test_no_view_or_fields_returns_full_document():
+    assert resolve_projection(FileMetadata) is None
+
+
+def test_fields_always_include_id_and_drop_mongo_id():
+    projection = resolve_projection(FileMetadata, fields="name, size")
+    assert projection == {"_id": 0, "id": 1, "name": 1, "size": 1}
+
+
+def test_fields_take_precedence_over_view():
+    projection = resolve_projection(FileMetadata, view="grid", fields="name", views=FILE_LIST_VIEWS)
+    assert projection == {"_id": 0, "id": 1, "name": 1}
+
+
+def test_named_view():
+    projection = resolve_projection(FileMetadata, view="grid", views=FILE_LIST_VIEWS)
+    assert projection["_id"] == 0
+    assert set(projection) - {"_id"} == {"id", *FILE_LIST_VIEWS["grid"]}
+
+
+def test_unknown_field_is_rejected():
+    with pytest.raises(HTTPException) as excinfo:
+        resolve_projection(FileMetadata, fields="name,telegram_session")
+    assert excinfo.value.status_code == 400
+    assert "telegram_session" in excinfo.value.detail
+
+
+def test_unknown_view_is_rejected():
+    with pytest.raises(HTTPException) as excinfo:
+        resolve_projection(FileMetadata, view="nope", views=FILE_LIST_VIEWS)
+    assert excinfo.value.status_code == 400
+
+
+def test_model_projection_lists_exactly_the_model_fields():
+    projection = model_projection(FileMetadata)
+    assert projection.pop("_id") == 0
+    assert set(projection) == set(FileMetadata.model_fields)
+    assert "trashed_by_folder" not in projection
+    assert "purge_attempts" not in projection
+
+
+def test_model_projection_for_shared_collections():
+    assert set(model_projection(server.SharedCollection)) == {"_id", *server.SharedCollection.model_fields}
@@ -3,6 +3,7 @@
 
 import multiprocessing
 import os
+import shutil
 
 # Server socket
 bind = f"0.0.0.0:{os.environ.get('PORT', '10000')}"
@@ -27,6 +28,20 @@ loglevel = 'info'
 # Process naming
 proc_name = 'telestore-worker'
 
+# Metrics
+# Each worker writes its metric samples here so /metrics and /stats can add them up
+# across workers. Set before the workers start, wiped when the server starts.
+metrics_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/telestore-metrics')
+
+def on_starting(server):
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+def child_exit(server, worker):
+    # Drop live gauges of the dead worker; its counters stay in the totals
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
 # Server mechanics
 daemon = False
 pidfile = None
@@ -1,5 +1,5 @@
 from fastapi import FastAPI, Request, HTTPException, Form, File, UploadFile
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import StreamingResponse, JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 import os
 import requests
@@ -11,15 +11,27 @@ import threading
 from telethon import TelegramClient
 from telethon.sessions import StringSession
 import asyncio
-from collections import defaultdict
-from contextlib import asynccontextmanager
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager, contextmanager
 import mimetypes
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+)
+from prometheus_client import multiprocess
+from prometheus_client.core import GaugeMetricFamily
+from loop_watchdog import watchdog_from_env
 
 # Lifespan for cleanup
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    sampler = asyncio.create_task(sample_throughput())
+    # Opt-in: LOOP_WATCHDOG_MS reports anything blocking the loop longer than that
+    watchdog = watchdog_from_env(on_stall=record_loop_stall)
     yield
     # Cleanup on shutdown if needed
+    sampler.cancel()
+    if watchdog:
+        watchdog.stop()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -45,8 +57,104 @@ credentials_cache = {}
 upload_progress = {}
 upload_locks = defaultdict(threading.Lock)
 
+# Metrics
+# Under gunicorn every worker process writes its samples to PROMETHEUS_MULTIPROC_DIR
+# (set in gunicorn_config.py), and /metrics and /stats add them up, so whichever
+# worker answers reports for all of them. Without it the metrics are per process.
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+THROUGHPUT_WINDOW = 10  # Seconds averaged by the bytes-per-second gauge
+
+download_bytes = Counter('worker_download_bytes_total', 'Bytes streamed to clients', ['kind'])
+downloads_total = Counter('worker_downloads_total', 'Download streams by outcome', ['kind', 'status'])
+download_ttfb = Histogram(
+    'worker_download_ttfb_seconds', 'Time from the download request to its first byte',
+    ['kind'], buckets=LATENCY_BUCKETS
+)
+active_downloads = Gauge('worker_active_downloads', 'Download streams in progress', ['kind'], multiprocess_mode='livesum')
+download_throughput = Gauge(
+    'worker_download_bytes_per_second', f'Bytes streamed per second over the last {THROUGHPUT_WINDOW}s',
+    multiprocess_mode='livesum'
+)
+telegram_latency = Histogram(
+    'worker_telegram_seconds', 'Latency of Telegram and backend calls by operation',
+    ['operation'], buckets=LATENCY_BUCKETS
+)
+active_uploads = Gauge('worker_active_uploads', 'Background uploads to Telegram in progress', ['api'], multiprocess_mode='livesum')
+uploads_total = Counter('worker_uploads_total', 'Background uploads by outcome', ['api', 'status'])
+upload_bytes = Counter('worker_upload_bytes_total', 'Bytes uploaded to Telegram', ['api'])
+credentials_lookups = Counter('worker_credentials_cache_total', 'Credential lookups by cache result', ['result'])
+loop_stalls = Counter('worker_loop_stalls_total', 'Event loop stalls over the watchdog threshold by blocking code site', ['site'])
+loop_stall_duration = Histogram(
+    'worker_loop_stall_seconds', 'How long the event loop was blocked', buckets=LATENCY_BUCKETS
+)
+
+# Process-local running totals the throughput sampler reads
+local_stats = {'bytes_streamed': 0}
+
+
+class TempDiskCollector:
+    """Reports the size of the temporary upload directory at scrape time"""
+    
+    def collect(self):
+        total = files = 0
+        for entry in os.scandir(CONFIG['UPLOAD_DIR']):
+            try:
+                if entry.is_file():
+                    total += entry.stat().st_size
+                    files += 1
+            except FileNotFoundError:
+                continue  # Removed by an upload's cleanup while we were scanning
+        yield GaugeMetricFamily('worker_temp_disk_bytes', 'Bytes held in the temporary upload directory', value=total)
+        yield GaugeMetricFamily('worker_temp_files', 'Files in the temporary upload directory', value=files)
+
+
+def metrics_registry():
+    """Registry to render: all gunicorn workers combined when PROMETHEUS_MULTIPROC_DIR is set"""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(TempDiskCollector())
+        return registry
+    return REGISTRY
+
+
+def check_metrics_token(request: Request):
+    """Metrics are public unless METRICS_TOKEN is set, then it must be sent as a bearer token"""
+    token = os.environ.get('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        raise HTTPException(status_code=401, detail='Invalid metrics token')
+
+
+@contextmanager
+def timed(operation):
+    """Record how long a Telegram or backend call took"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        telegram_latency.labels(operation).observe(time.perf_counter() - start)
+
+
+def record_loop_stall(duration, site, stack):
+    """on_stall callback for the loop watchdog"""
+    loop_stalls.labels(site).inc()
+    loop_stall_duration.observe(duration)
+
+
+async def sample_throughput():
+    """Keep the bytes-per-second gauge at this process's rate over the last THROUGHPUT_WINDOW seconds"""
+    history = deque(maxlen=THROUGHPUT_WINDOW + 1)
+    while True:
+        history.append((time.monotonic(), local_stats['bytes_streamed']))
+        (first_time, first_bytes), (last_time, last_bytes) = history[0], history[-1]
+        elapsed = last_time - first_time
+        download_throughput.set((last_bytes - first_bytes) / elapsed if elapsed > 0 else 0)
+        await asyncio.sleep(1)
+
 # Create upload directory if it doesn't exist
 os.makedirs(CONFIG['UPLOAD_DIR'], exist_ok=True)
+if not os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+    REGISTRY.register(TempDiskCollector())
 
 print(f"Worker started with BACKEND_URL: {CONFIG['BACKEND_URL']}")
 
@@ -67,15 +175,20 @@ def get_credentials(auth_token):
     if cache_key in credentials_cache:
         cached_data, cached_time = credentials_cache[cache_key]
         if time.time() - cached_time < 3600:  # 1 hour cache
+            credentials_lookups.labels('hit').inc()
             return cached_data
+        credentials_lookups.labels('expired').inc()
+    else:
+        credentials_lookups.labels('miss').inc()
     
     # Fetch from backend
     try:
-        response = requests.get(
-            f"{CONFIG['BACKEND_URL']}/api/worker/credentials",
-            headers={'Authorization': f'Bearer {auth_token}'},
-            timeout=10
-        )
+        with timed('fetch_credentials'):
+            response = requests.get(
+                f"{CONFIG['BACKEND_URL']}/api/worker/credentials",
+                headers={'Authorization': f'Bearer {auth_token}'},
+                timeout=10
+            )
         
         if response.status_code == 200:
             credentials = response.json()
@@ -95,6 +208,59 @@ async def health_check():
     return {"status": "ok", "timestamp": datetime.now().isoformat()}
 
 
+@app.get('/metrics')
+async def metrics(request: Request):
+    """Prometheus scrape endpoint"""
+    check_metrics_token(request)
+    return Response(content=generate_latest(metrics_registry()), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get('/stats')
+async def stats(request: Request):
+    """Live summary of the metrics across all workers, for humans and dashboards"""
+    check_metrics_token(request)
+    
+    # Sum every sample over its labels, except the ones named in `by`
+    totals = defaultdict(float)
+    for metric in metrics_registry().collect():
+        for sample in metric.samples:
+            by = sample.labels.get('operation') or sample.labels.get('status') or sample.labels.get('result')
+            if sample.name.endswith('_bucket'):
+                continue
+            totals[(sample.name, by)] += sample.value
+    
+    def total(name, by=None):
+        return totals.get((name, by), 0) if by is not None else sum(v for (n, _), v in totals.items() if n == name)
+    
+    def average(name, by=None):
+        count = total(f'{name}_count', by)
+        return round(total(f'{name}_sum', by) / count, 4) if count else None
+    
+    hits = total('worker_credentials_cache_total', 'hit')
+    lookups = total('worker_credentials_cache_total')
+    operations = sorted({by for (name, by) in totals if name == 'worker_telegram_seconds_count'})
+    return {
+        'active_downloads': int(total('worker_active_downloads')),
+        'active_uploads': int(total('worker_active_uploads')),
+        'bytes_per_second': round(total('worker_download_bytes_per_second')),
+        'bytes_streamed': int(total('worker_download_bytes_total')),
+        'downloads': {status: int(total('worker_downloads_total', status)) for status in ('completed', 'cancelled', 'failed')},
+        'ttfb_avg_seconds': average('worker_download_ttfb_seconds'),
+        'telegram_avg_seconds': {op: average('worker_telegram_seconds', op) for op in operations},
+        'uploads': {status: int(total('worker_uploads_total', status)) for status in ('completed', 'failed')},
+        'bytes_uploaded': int(total('worker_upload_bytes_total')),
+        'temp_disk_bytes': int(total('worker_temp_disk_bytes')),
+        'temp_files': int(total('worker_temp_files')),
+        'loop_stalls': int(total('worker_loop_stalls_total')),
+        'credentials_cache': {
+            'hits': int(hits),
+            'lookups': int(lookups),
+            'hit_rate': round(hits / lookups, 4) if lookups else None
+        },
+        'timestamp': datetime.now().isoformat()
+    }
+
+
 @app.post('/upload')
 async def upload_file(
     authToken: str = Form(...),
@@ -199,27 +365,33 @@ async def complete_upload(request: Request):
 
 def upload_to_telegram_background(upload_id):
     """Background function to upload file to Telegram"""
+    progress = upload_progress[upload_id]
+    file_path = progress['file_path']
+    file_size = progress['file_size']
+    api = 'bot' if file_size <= CONFIG['BOT_API_SIZE_LIMIT'] else 'client'
+    active_uploads.labels(api).inc()
     try:
-        progress = upload_progress[upload_id]
-        file_path = progress['file_path']
-        file_size = progress['file_size']
         credentials = progress['credentials']
         
         # Decide whether to use Bot API or Client API
-        if file_size <= CONFIG['BOT_API_SIZE_LIMIT']:
+        if api == 'bot':
             # Use Bot API for files <= 50MB
             upload_with_bot_api(upload_id, file_path, credentials)
         else:
             # Use Telethon Client API for files > 50MB
             upload_with_client_api(upload_id, file_path, credentials)
+        uploads_total.labels(api, 'completed').inc()
+        upload_bytes.labels(api).inc(file_size)
             
     except Exception as e:
         print(f"Background upload error for {upload_id}: {str(e)}")
         import traceback
         traceback.print_exc()
+        uploads_total.labels(api, 'failed').inc()
         upload_progress[upload_id]['status'] = 'failed'
         upload_progress[upload_id]['error'] = str(e)
     finally:
+        active_uploads.labels(api).dec()
         # Cleanup file after upload (success or failure)
         try:
             if os.path.exists(file_path):
@@ -247,12 +419,13 @@ def upload_with_bot_api(upload_id, file_path, credentials):
             files = {'document': (file_name, f)}
             data = {'chat_id': channel_id}
             
-            response = requests.post(
-                f'https://api.telegram.org/bot{bot_token}/sendDocument',
-                data=data,
-                files=files,
-                timeout=300  # 5 minutes timeout
-            )
+            with timed('send_document'):
+                response = requests.post(
+                    f'https://api.telegram.org/bot{bot_token}/sendDocument',
+                    data=data,
+                    files=files,
+                    timeout=300  # 5 minutes timeout
+                )
         
         result = response.json()
         
@@ -344,12 +517,14 @@ async def upload_to_telegram_client(file_path, file_name, credentials, upload_id
             credentials['telegram_api_hash']
         )
         
-        await client.connect()
+        with timed('connect'):
+            await client.connect()
         print("Telethon client connected")
         
         # Get channel entity
         channel_id = int(credentials['channel_id'])
-        channel = await client.get_entity(channel_id)
+        with timed('get_entity'):
+            channel = await client.get_entity(channel_id)
         print(f"Channel entity resolved: {channel.id}")
         
         # Progress callback
@@ -361,12 +536,13 @@ async def upload_to_telegram_client(file_path, file_name, credentials, upload_id
         
         # Upload file
         print(f"Starting Telethon upload: {file_name}")
-        message = await client.send_file(
-            channel,
-            file_path,
-            caption=file_name,
-            progress_callback=progress_callback
-        )
+        with timed('send_file'):
+            message = await client.send_file(
+                channel,
+                file_path,
+                caption=file_name,
+                progress_callback=progress_callback
+            )
         
         print(f"Telethon upload successful: message_id={message.id}")
         
@@ -419,17 +595,19 @@ async def get_upload_progress(upload_id: str):
 @app.get('/download')
 async def download_file(request: Request, messageId: str, token: str, fileName: str = 'file'):
     """Download files from Telegram with Range request support for chunked downloads"""
+    started = time.perf_counter()
     try:
         if not messageId or not token:
             raise HTTPException(status_code=400, detail='Missing messageId or token')
         
         # Verify token with backend
         try:
-            verify_response = requests.post(
-                f"{CONFIG['BACKEND_URL']}/api/worker/verify-download-token",
-                data={'token': token},
-                timeout=10
-            )
+            with timed('verify_token'):
+                verify_response = requests.post(
+                    f"{CONFIG['BACKEND_URL']}/api/worker/verify-download-token",
+                    data={'token': token},
+                    timeout=10
+                )
             
             if verify_response.status_code != 200:
                 raise HTTPException(status_code=401, detail='Invalid or expired token')
@@ -468,12 +646,13 @@ async def download_file(request: Request, messageId: str, token: str, fileName:
                 credentials, 
                 fileName, 
                 range_start, 
-                range_end
+                range_end,
+                started
             )
         else:
             # Full file download (for small files or legacy support)
             print(f"Full file download request: {fileName}")
-            return await stream_full_file(request, messageId, credentials, fileName)
+            return await stream_full_file(request, messageId, credentials, fileName, started)
         
     except HTTPException:
         raise
@@ -484,8 +663,45 @@ async def download_file(request: Request, messageId: str, token: str, fileName:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-async def stream_file_range(request: Request, message_id, credentials, file_name, range_start, range_end):
+async def stream_telegram_chunks(request: Request, chunks, kind, started):
+    """Relay chunks from Telegram to the client, recording bytes, time to first byte and fetch latency"""
+    active_downloads.labels(kind).inc()
+    status = 'failed'
+    downloaded = 0
+    try:
+        while True:
+            fetch_start = time.perf_counter()
+            try:
+                chunk = await chunks.__anext__()
+            except StopAsyncIteration:
+                break
+            telegram_latency.labels('download_chunk').observe(time.perf_counter() - fetch_start)
+            
+            # Check if client disconnected
+            if await request.is_disconnected():
+                print(f"Client disconnected during download, stopping...")
+                status = 'cancelled'
+                return
+            
+            if downloaded == 0:
+                download_ttfb.labels(kind).observe(time.perf_counter() - started)
+            downloaded += len(chunk)
+            download_bytes.labels(kind).inc(len(chunk))
+            local_stats['bytes_streamed'] += len(chunk)
+            yield chunk
+        status = 'completed'
+    except (GeneratorExit, asyncio.CancelledError):
+        # Starlette closes the generator when the client goes away
+        status = 'cancelled'
+        raise
+    finally:
+        active_downloads.labels(kind).dec()
+        downloads_total.labels(kind, status).inc()
+
+
+async def stream_file_range(request: Request, message_id, credentials, file_name, range_start, range_end, started=None):
     """Stream a specific byte range from Telegram file using pure async generator"""
+    started = started or time.perf_counter()
     
     # Get file size first for headers - single connection approach
     client = TelegramClient(
@@ -495,9 +711,12 @@ async def stream_file_range(request: Request, message_id, credentials, file_name
     )
     
     try:
-        await client.connect()
-        channel = await client.get_entity(int(credentials['channel_id']))
-        message = await client.get_messages(channel, ids=int(message_id))
+        with timed('connect'):
+            await client.connect()
+        with timed('get_entity'):
+            channel = await client.get_entity(int(credentials['channel_id']))
+        with timed('get_messages'):
+            message = await client.get_messages(channel, ids=int(message_id))
         
         if not message or not message.file:
             raise Exception(f"Message {message_id} not found or has no file")
@@ -518,17 +737,13 @@ async def stream_file_range(request: Request, message_id, credentials, file_name
                 chunk_size = 1024 * 1024  # 1MB chunks
                 downloaded = 0
                 
-                async for chunk in client.iter_download(
+                chunks = client.iter_download(
                     message.media,
                     offset=range_start,
                     limit=bytes_to_send,
                     chunk_size=chunk_size
-                ):
-                    # Check if client disconnected
-                    if await request.is_disconnected():
-                        print(f"Client disconnected during download, stopping...")
-                        break
-                    
+                )
+                async for chunk in stream_telegram_chunks(request, chunks, 'range', started):
                     downloaded += len(chunk)
                     if downloaded % (5 * 1024 * 1024) == 0:  # Log every 5MB
                         print(f"Streamed: {downloaded}/{bytes_to_send} bytes")
@@ -570,8 +785,9 @@ async def stream_file_range(request: Request, message_id, credentials, file_name
         raise
 
 
-async def stream_full_file(request: Request, message_id, credentials, file_name):
+async def stream_full_file(request: Request, message_id, credentials, file_name, started=None):
     """Stream entire file using pure async generator"""
+    started = started or time.perf_counter()
     
     # Get file size first for Content-Length header
     client_temp = TelegramClient(
@@ -579,9 +795,12 @@ async def stream_full_file(request: Request, message_id, credentials, file_name)
         int(credentials['telegram_api_id']),
         credentials['telegram_api_hash']
     )
-    await client_temp.connect()
-    channel_temp = await client_temp.get_entity(int(credentials['channel_id']))
-    message_temp = await client_temp.get_messages(channel_temp, ids=int(message_id))
+    with timed('connect'):
+        await client_temp.connect()
+    with timed('get_entity'):
+        channel_temp = await client_temp.get_entity(int(credentials['channel_id']))
+    with timed('get_messages'):
+        message_temp = await client_temp.get_messages(channel_temp, ids=int(message_id))
     
     if not message_temp or not message_temp.file:
         await client_temp.disconnect()
@@ -600,10 +819,13 @@ async def stream_full_file(request: Request, message_id, credentials, file_name)
                 credentials['telegram_api_hash']
             )
             
-            await client.connect()
+            with timed('connect'):
+                await client.connect()
             
-            channel = await client.get_entity(int(credentials['channel_id']))
-            message = await client.get_messages(channel, ids=int(message_id))
+            with timed('get_entity'):
+                channel = await client.get_entity(int(credentials['channel_id']))
+            with timed('get_messages'):
+                message = await client.get_messages(channel, ids=int(message_id))
             
             if not message or not message.file:
                 raise Exception(f"Message {message_id} not found or has no file")
@@ -612,12 +834,8 @@ async def stream_full_file(request: Request, message_id, credentials, file_name)
             
             # Stream chunks with 1MB size
             downloaded = 0
-            async for chunk in client.iter_download(message.media, chunk_size=1024 * 1024):
-                # Check if client disconnected
-                if await request.is_disconnected():
-                    print(f"Client disconnected during download, stopping...")
-                    break
-                
+            chunks = client.iter_download(message.media, chunk_size=1024 * 1024)
+            async for chunk in stream_telegram_chunks(request, chunks, 'full', started):
                 downloaded += len(chunk)
                 if downloaded % (10 * 1024 * 1024) == 0:  # Log every 10MB
                     print(f"Downloaded: {downloaded}/{message.file.size} bytes")